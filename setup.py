@@ -17,7 +17,15 @@
 # 	You should have received a copy of the GNU General Public License
 # 	along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
-from distutils.core import setup, Extension
+try:
+	from setuptools import setup, Extension
+	setup_options = {
+		# lcms2.aio requires asyncio and concurrent.futures backports
+		'extras_require': {'aio': ['trollius', 'futures']},
+	}
+except ImportError:
+	from distutils.core import setup, Extension
+	setup_options = {}
 import commands
 
 def get_pkg_libs(pkg_names):
@@ -70,4 +78,6 @@ setup (name='lcms2',
 
 	package_dir={'lcms2': 'src/lcms2'},
 
-	ext_modules=[lcms2_module])
+	ext_modules=[lcms2_module],
+
+	**setup_options)
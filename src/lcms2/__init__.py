@@ -19,20 +19,80 @@
 # 	along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import os
+import sys
 import types
+import hashlib
 import _lcms2
+from cache import LRUCache
 
-TYPE_RGB_8 = "RGBA"
-TYPE_RGB_16 = "RGBA;16"
+TYPE_RGB_8 = "RGB;24"
+TYPE_RGB_16 = "RGB;16"
+TYPE_RGB_16_SE = "RGB;16S"
 TYPE_RGBA_8 = "RGBA"
 TYPE_RGBA_16 = "RGBA;16"
+TYPE_RGBA_16_SE = "RGBA;16S"
+TYPE_BGR_8 = "BGR;24"
+TYPE_BGR_16 = "BGR;16"
+TYPE_BGR_16_SE = "BGR;16S"
+TYPE_BGRA_8 = "BGRA"
+TYPE_BGRA_16 = "BGRA;16"
+TYPE_BGRA_16_SE = "BGRA;16S"
+TYPE_ARGB_8 = "ARGB"
+TYPE_ARGB_16 = "ARGB;16"
+TYPE_ABGR_8 = "ABGR"
+TYPE_ABGR_16 = "ABGR;16"
 TYPE_CMYK_8 = "CMYK"
 TYPE_CMYK_16 = "CMYK;16"
+TYPE_CMYK_16_SE = "CMYK;16S"
+TYPE_CMYKA_8 = "CMYKA"
+TYPE_CMYKA_16 = "CMYKA;16"
+TYPE_CMYKA_16_SE = "CMYKA;16S"
 TYPE_GRAY_8 = "L"
 TYPE_GRAY_16 = "L;16"
+TYPE_GRAY_16_SE = "L;16S"
+TYPE_GRAYA_8 = "LA"
+TYPE_GRAYA_16 = "LA;16"
+TYPE_GRAYA_16_SE = "LA;16S"
 TYPE_Lab_8 = "LAB"
+TYPE_Lab_16 = "LAB;16"
+TYPE_XYZ_16 = "XYZ;16"
+TYPE_RGB_FLT = "RGB;float32"
+TYPE_RGBA_FLT = "RGBA;float32"
+TYPE_BGR_FLT = "BGR;float32"
+TYPE_BGRA_FLT = "BGRA;float32"
+TYPE_ARGB_FLT = "ARGB;float32"
+TYPE_CMYK_FLT = "CMYK;float32"
+TYPE_GRAY_FLT = "L;float32"
+TYPE_GRAYA_FLT = "LA;float32"
+TYPE_CMYKA_FLT = "CMYKA;float32"
+TYPE_Lab_FLT = "LAB;float32"
+TYPE_XYZ_FLT = "XYZ;float32"
+TYPE_RGB_HALF_FLT = "RGB;float16"
+TYPE_RGBA_HALF_FLT = "RGBA;float16"
+TYPE_BGR_HALF_FLT = "BGR;float16"
+TYPE_BGRA_HALF_FLT = "BGRA;float16"
+TYPE_ARGB_HALF_FLT = "ARGB;float16"
+TYPE_CMYK_HALF_FLT = "CMYK;float16"
+TYPE_GRAY_HALF_FLT = "L;float16"
+TYPE_RGB_DBL = "RGB;float"
+TYPE_BGR_DBL = "BGR;float"
+TYPE_CMYK_DBL = "CMYK;float"
+TYPE_GRAY_DBL = "L;float"
+TYPE_GRAYA_DBL = "LA;float"
+TYPE_RGBA_DBL = "RGBA;float"
+TYPE_CMYKA_DBL = "CMYKA;float"
 TYPE_Lab_DBL = "LAB;float"
 TYPE_XYZ_DBL = "XYZ;float"
+TYPE_RGB_8_PLANAR = "RGB;planar"
+TYPE_RGB_16_PLANAR = "RGB;16;planar"
+TYPE_BGR_8_PLANAR = "BGR;planar"
+TYPE_RGBA_8_PLANAR = "RGBA;planar"
+TYPE_RGBA_16_PLANAR = "RGBA;16;planar"
+TYPE_CMYK_8_PLANAR = "CMYK;planar"
+TYPE_CMYK_16_PLANAR = "CMYK;16;planar"
+
+# Supported mode names mapped on native lcms pixel formats
+FORMATS = _lcms2.getFormats()
 
 INTENT_PERCEPTUAL = 0
 INTENT_RELATIVE_COLORIMETRIC = 1
@@ -47,6 +107,35 @@ cmsFLAGS_PRESERVEBLACK = 0x8000
 cmsFLAGS_NULLTRANSFORM = 0x0200
 cmsFLAGS_HIGHRESPRECALC = 0x0400
 cmsFLAGS_LOWRESPRECALC = 0x0800
+# Extra channels (alpha) are copied into output pixels with sample
+# conversion, input and output formats should have equal extra counts.
+# Requires lcms 2.8 or newer.
+cmsFLAGS_COPY_ALPHA = 0x04000000
+
+def cmsFLAGS_GRIDPOINTS(n):
+	"""
+	Returns flags requesting n grid points of precalculated pipeline.
+	"""
+	return (n & 0xFF) << 16
+
+_PRECALC_FLAGS = cmsFLAGS_NOTPRECALC | cmsFLAGS_HIGHRESPRECALC | \
+			cmsFLAGS_LOWRESPRECALC | cmsFLAGS_GRIDPOINTS(0xFF)
+
+# Precalculation levels of adaptive transforms as (pixel count, flags)
+# pairs. Transform is upgraded to next level when transformed pixels
+# would take about as long as its build on unoptimized previous level.
+PRECALC_LEVELS = (
+	(0, cmsFLAGS_NOTPRECALC),
+	(1 << 12, cmsFLAGS_LOWRESPRECALC),
+	(1 << 18, 0),
+	(1 << 20, cmsFLAGS_HIGHRESPRECALC),
+)
+
+DELTA_E_CIE76 = 0
+DELTA_E_CIE94 = 1
+DELTA_E_CMC = 2
+DELTA_E_CIEDE2000 = 3
+DELTA_E_BFD = 4
 
 COLOR_BYTE = 0
 COLOR_WORD = 1
@@ -55,6 +144,24 @@ COLOR_DBL = 2
 class CmsError(Exception):
 	pass
 
+# Transforms returned by cmsCreateTransform() and cmsCreateProofingTransform()
+# are cached by content of used profiles and transform parameters.
+# Cached handles are shared by all callers, pass cached=False to get
+# a private handle. Use transform_cache.set_maxsize(0) to disable caching.
+transform_cache = LRUCache(128)
+
+def _build(cached, key, builder):
+	if cached:
+		return transform_cache.get(key, builder)
+	return builder()
+
+# Profiles returned by cmsOpenProfileFromMem() are cached by content hash.
+profile_cache = LRUCache(256)
+
+# Content digests of profile handles used in cache keys. Cached items
+# keep their handles alive, so id() of a handle is not reused.
+digest_cache = LRUCache(256)
+
 def COLORB(channel0=0, channel1=0, channel2=0, channel3=0):
 	"""
 	Emulates COLORB object from python-lcms.
@@ -90,6 +197,85 @@ def get_version():
 	ver = str(_lcms2.getVersion())
 	return ver[0] + '.' + ver[2]
 
+def enable_stats(enabled=True):
+	"""
+	Enables or disables collecting of timings and pixel counters
+	(see get_stats()). Handle counters are maintained always.
+	"""
+	_lcms2.enableStats(enabled)
+
+def get_stats():
+	"""
+	Returns dictionary of module statistics:
+	profiles_live, transforms_live - numbers of existing native handles
+	profiles_opened, profiles_closed - numbers of opened/created
+			and released profiles
+	transforms_built, transforms_freed - numbers of built and released
+			transforms
+	build_time - cumulative time of transform builds in seconds
+	transform_time - cumulative time of pixel transforms in seconds
+	transform_calls - number of pixel transform calls
+	pixels - number of transformed pixels
+	pixels_by_format - dictionary of transformed pixels by input mode
+	Timings and pixel counters are collected only if enabled
+	by enable_stats().
+	"""
+	stats = _lcms2.getStats()
+	names = _format_names()
+	stats['pixels_by_format'] = dict([(names.get(fmt, fmt), count)
+						for fmt, count in stats['pixels_by_format'].items()])
+	return stats
+
+def reset_stats():
+	"""
+	Resets accumulated statistics counters. Live handle counters are kept.
+	"""
+	_lcms2.resetStats()
+
+def set_slow_build_hook(callback, threshold=0.1):
+	"""
+	Sets callback which is called for each transform build longer
+	than threshold. Callback receives dictionary with build time in
+	seconds, input_format, output_format (mode names), intent, flags
+	and proofing fields. Exceptions raised by callback are reported
+	and ignored. Works independently of enable_stats().
+
+	callback - callable object or None to remove the hook
+	threshold - build time in seconds
+	"""
+	if callback is not None:
+		if not callable(callback):
+			raise CmsError, 'Slow build hook should be callable or None'
+		names = _format_names()
+
+		def hook(info, callback=callback):
+			info['input_format'] = names.get(info['input_format'],
+										info['input_format'])
+			info['output_format'] = names.get(info['output_format'],
+										info['output_format'])
+			callback(info)
+	else:
+		hook = None
+
+	_lcms2.setBuildHook(hook, threshold)
+
+_FORMAT_NAMES = {}
+
+def _format_names():
+	"""
+	Returns mapping of lcms pixel formats on mode names. Formats of
+	several names are mapped on names of TYPE_* constants.
+	"""
+	if not _FORMAT_NAMES:
+		for name, fmt in FORMATS.items():
+			if fmt not in _FORMAT_NAMES or name < _FORMAT_NAMES[fmt]:
+				_FORMAT_NAMES[fmt] = name
+		for key, name in globals().items():
+			if key.startswith('TYPE_') and name in FORMATS:
+				_FORMAT_NAMES[FORMATS[name]] = name
+	return _FORMAT_NAMES
+
+
 
 def cmsOpenProfileFromFile(profileFilename, mode=None):
 	"""	
@@ -112,6 +298,127 @@ def cmsOpenProfileFromFile(profileFilename, mode=None):
 
 	return result
 
+def _buffer_slice(data, offset, size):
+	"""
+	Returns zero-copy slice of buffer object.
+	"""
+	try:
+		view = memoryview(data)
+	except TypeError:
+		# old-style buffers (array.array, mmap)
+		if size < 0:
+			return buffer(data, offset)
+		return buffer(data, offset, size)
+	if view.ndim != 1 or view.itemsize != 1:
+		raise CmsError, 'Profile data should be a bytes-like buffer'
+	if size < 0:
+		return view[offset:]
+	return view[offset:offset + size]
+
+def _buffer_bytes(chunk):
+	"""
+	Returns str copy of buffer slice.
+	"""
+	if isinstance(chunk, memoryview):
+		return chunk.tobytes()
+	return str(chunk)
+
+def cmsOpenProfileFromMem(data, offset=0, size=None):
+	"""
+	Returns a handle to lcms2 profile wrapped as a Python object.
+	Profiles with identical content share the same handle
+	(see profile_cache), so the same embedded profile is parsed once.
+	Cached handles outlive the caller's buffer, so they read from their
+	own copy of profile data; only a whole immutable str is used without
+	copying. The buffer may be resized or unmapped after the call.
+
+	data - any object supporting buffer interface (str, bytearray,
+			memoryview, array.array, mmap) which contains ICC profile
+	offset - offset of the profile in data buffer
+	size - profile size in bytes, by default whole buffer after offset
+	"""
+	if size is None:
+		size = -1
+	if offset < 0:
+		raise CmsError, 'Invalid profile offset provided: %s' % offset
+
+	try:
+		chunk = _buffer_slice(data, offset, size)
+	except (TypeError, ValueError):
+		raise CmsError, 'Profile data should support buffer interface'
+
+	if size >= 0 and len(chunk) != size:
+		raise CmsError, 'Profile data is shorter than %d bytes' % size
+
+	digest = hashlib.md5(chunk).digest()
+
+	def open_profile():
+		if isinstance(data, str) and len(chunk) == len(data):
+			return _lcms2.openProfileFromMem(data, 0, -1)
+		return _lcms2.openProfileFromMem(_buffer_bytes(chunk), 0, -1)
+
+	result = profile_cache.get(digest, open_profile)
+
+	if result is None:
+		raise CmsError, 'It seems provided profile data is invalid'
+
+	return result
+
+def _format(mode):
+	"""
+	Returns native lcms pixel format for provided mode name.
+	Integer values are treated as lcms pixel formats and returned as is.
+	"""
+	if isinstance(mode, (int, long)):
+		return mode
+	try:
+		return FORMATS[mode]
+	except (KeyError, TypeError):
+		raise CmsError, 'Unsupported pixel mode: %s' % (mode,)
+
+def _check_flags(flags, inFormat, outFormat):
+	"""
+	Checks that transform flags are applicable to pixel formats.
+	"""
+	if flags & cmsFLAGS_COPY_ALPHA:
+		if _lcms2.getVersion() < 2080:
+			raise CmsError, 'cmsFLAGS_COPY_ALPHA requires lcms 2.8 or newer'
+		# lcms 2.8-2.9 silently skip mismatched extra channels
+		in_extra = _lcms2.getFormatInfo(inFormat)[1]
+		out_extra = _lcms2.getFormatInfo(outFormat)[1]
+		if in_extra != out_extra:
+			msg = 'cmsFLAGS_COPY_ALPHA requires equal extra channel counts, ' + \
+				'got %d and %d'
+			raise CmsError, msg % (in_extra, out_extra)
+
+def _calc_digest(profile):
+	# MD5 of serialized profile with zeroed flags, rendering intent and
+	# ID header fields like ICC profile ID is calculated. Stored ID
+	# is not trusted because editors don't always update it.
+	data = _lcms2.saveProfileToMem(profile)
+	if data is None:
+		return (profile, None)
+	data = data[:44] + '\0' * 4 + data[48:64] + '\0' * 4 + \
+		data[68:84] + '\0' * 16 + data[100:]
+	return (profile, hashlib.md5(data).hexdigest())
+
+def _profile_digest(profile):
+	"""
+	Returns hex MD5 of profile content memoized per profile handle
+	or None for invalid handles.
+	"""
+	return digest_cache.get(id(profile), lambda: _calc_digest(profile))[1]
+
+def _profile_id(profile):
+	"""
+	Returns profile content digest used as cache key. For invalid handles
+	returns profile object itself.
+	"""
+	result = _profile_digest(profile)
+	if result is None:
+		return profile
+	return result
+
 def cmsCreate_sRGBProfile():
 	"""
 	Returns a handle to lcms2 built-in sRGB profile.
@@ -141,30 +448,44 @@ def cmsCreateGrayProfile():
 def cmsCreateTransform(inputProfile, inMode,
 					outputProfile, outMode,
 					renderingIntent=INTENT_PERCEPTUAL,
-					flags=cmsFLAGS_NOTPRECALC):
+					flags=cmsFLAGS_NOTPRECALC, cached=True):
 	"""
 	Returns a handle to lcms2 transformation wrapped as a Python object.
 	The handle doesn't require to be closed after usage because
 	on object delete operation Python calls native cmsDeleteTransform()
 	function automatically 
+	Transforms are cached in transform_cache, so repeated calls with
+	the same profiles and parameters return the same handle. Per-handle
+	state (see enable_color_cache()) is shared by such callers, so
+	pass cached=False to get a private handle.
 
 	inputProfile - a valid lcms profile handle
 	inMode - predefined string constant 
-			(i.e. TYPE_RGB_8, TYPE_RGBA_8, TYPE_CMYK_8, etc.)	
+			(i.e. TYPE_RGB_8, TYPE_RGBA_8, TYPE_CMYK_8, etc.) or any mode
+			name from FORMATS dictionary
 	outputProfile - a valid lcms profile handle	
 	outMode - predefined string constant 
-			(i.e. TYPE_RGB_8, TYPE_RGBA_8, TYPE_CMYK_8, etc.)		
+			(i.e. TYPE_RGB_8, TYPE_RGBA_8, TYPE_CMYK_8, etc.) or any mode
+			name from FORMATS dictionary
 	renderingIntent - integer constant (0-3) specifying rendering intent 
 			for the transform
 	flags - a set of predefined lcms flags
+	cached - if False, a new private handle is built bypassing
+			transform_cache
 	"""
 
 	if renderingIntent not in (0, 1, 2, 3):
 		raise CmsError, 'renderingIntent must be an integer between 0 and 3'
 
-	result = _lcms2.buildTransform(inputProfile, inMode,
-								outputProfile, outMode,
-								renderingIntent, flags)
+	inFormat = _format(inMode)
+	outFormat = _format(outMode)
+	_check_flags(flags, inFormat, outFormat)
+	key = (_profile_id(inputProfile), inFormat, _profile_id(outputProfile),
+		outFormat, renderingIntent, flags)
+	result = _build(cached, key, lambda: _lcms2.buildTransform(
+								inputProfile, inFormat,
+								outputProfile, outFormat,
+								renderingIntent, flags))
 
 	if result is None:
 		msg = 'Cannot create requested transform'
@@ -177,9 +498,10 @@ def cmsCreateProofingTransform(inputProfile, inMode,
 						proofingProfile,
 						renderingIntent=INTENT_PERCEPTUAL,
 						proofingIntent=INTENT_RELATIVE_COLORIMETRIC,
-						flags=cmsFLAGS_SOFTPROOFING):
+						flags=cmsFLAGS_SOFTPROOFING, cached=True):
 	"""
 	Returns a handle to lcms transformation wrapped as a Python object.
+	Transforms are cached in transform_cache like in cmsCreateTransform().
 
 	inputProfile - a valid lcms profile handle
 	outputProfile - a valid lcms profile handle
@@ -193,6 +515,8 @@ def cmsCreateProofingTransform(inputProfile, inMode,
 	proofingIntent - integer constant (0-3) specifying proofing intent 
 			for the transform
 	flags - a set of predefined lcms flags
+	cached - if False, a new private handle is built bypassing
+			transform_cache
 	"""
 
 	if renderingIntent not in (0, 1, 2, 3):
@@ -201,10 +525,17 @@ def cmsCreateProofingTransform(inputProfile, inMode,
 	if proofingIntent not in (0, 1, 2, 3):
 		raise CmsError, 'proofingIntent must be an integer between 0 and 3'
 
-	result = _lcms2.buildProofingTransform(inputProfile, inMode,
-										outputProfile, outMode,
+	inFormat = _format(inMode)
+	outFormat = _format(outMode)
+	_check_flags(flags, inFormat, outFormat)
+	key = (_profile_id(inputProfile), inFormat, _profile_id(outputProfile),
+		outFormat, _profile_id(proofingProfile), renderingIntent,
+		proofingIntent, flags)
+	result = _build(cached, key, lambda: _lcms2.buildProofingTransform(
+										inputProfile, inFormat,
+										outputProfile, outFormat,
 										proofingProfile, renderingIntent,
-										proofingIntent, flags)
+										proofingIntent, flags))
 
 	if result is None:
 		msg = 'Cannot create requested proofing transform'
@@ -212,36 +543,993 @@ def cmsCreateProofingTransform(inputProfile, inMode,
 
 	return result
 
+def cmsCreateAdaptiveTransform(inputProfile, inMode,
+						outputProfile, outMode,
+						renderingIntent=INTENT_PERCEPTUAL,
+						flags=0, expected_pixels=0, levels=PRECALC_LEVELS,
+						cached=False):
+	"""
+	Returns a handle to lcms2 transformation which picks precalculation
+	level by pixel volume. Initial level is chosen by expected pixel
+	count, then transform learns from usage: when count of transformed
+	pixels reaches threshold of next level, transform is rebuilt with
+	its flags and the new pipeline replaces the old one in place, so
+	the handle stays valid. Chosen level is reported by
+	get_precalc_info(). Pixel counters belong to the handle, so by default
+	each call returns a private handle. With cached=True transforms are
+	cached in transform_cache like in cmsCreateTransform() and usage
+	of all callers sharing the handle is accumulated.
+
+	inputProfile - a valid lcms profile handle
+	inMode - predefined string constant or any mode name from FORMATS
+	outputProfile - a valid lcms profile handle
+	outMode - predefined string constant or any mode name from FORMATS
+	renderingIntent - integer constant (0-3) specifying rendering intent
+			for the transform
+	flags - a set of predefined lcms flags, precalculation flags
+			are taken from levels
+	expected_pixels - expected number of pixels to transform
+	levels - sequence of (pixel count, flags) pairs sorted by pixel
+			count starting with zero, flags may contain
+			cmsFLAGS_GRIDPOINTS(n), see PRECALC_LEVELS
+	cached - if True, the handle is shared via transform_cache
+	"""
+	if renderingIntent not in (0, 1, 2, 3):
+		raise CmsError, 'renderingIntent must be an integer between 0 and 3'
+
+	levels = tuple([(int(count), int(level_flags)) for count, level_flags in levels])
+	if not levels or levels[0][0] != 0 or \
+	list(levels) != sorted(levels, key=lambda item: item[0]):
+		raise CmsError, 'levels should be sorted by pixel count starting with 0'
+	level = max([i for i, item in enumerate(levels)
+				if item[0] <= max(expected_pixels, 0)])
+
+	flags &= ~_PRECALC_FLAGS
+	inFormat = _format(inMode)
+	outFormat = _format(outMode)
+	_check_flags(flags, inFormat, outFormat)
+	key = ('adaptive', _profile_id(inputProfile), inFormat,
+		_profile_id(outputProfile), outFormat, renderingIntent, flags,
+		levels, level)
+	result = _build(cached, key, lambda: _lcms2.buildAdaptiveTransform(
+								inputProfile, inFormat,
+								outputProfile, outFormat,
+								renderingIntent, flags, levels,
+								levels[level][0]))
+
+	if result is None:
+		msg = 'Cannot create requested adaptive transform'
+		raise CmsError, msg + ': %s %s' % (inMode, outMode)
+
+	return result
+
+def get_precalc_info(hTransform):
+	"""
+	Returns dictionary describing precalculation of transform: pixels
+	(count of transformed pixels), adaptive (True for transforms of
+	cmsCreateAdaptiveTransform()), flags (build flags of current
+	pipeline), precalc ('none', 'lowres', 'default' or 'highres'),
+	grid_points (requested grid points or 0 for lcms choice),
+	level (index of current adaptive level) and upgrades (count
+	of adaptive rebuilds).
+
+	hTransform - a valid lcms transformation handle
+	"""
+	result = _lcms2.getPrecalcInfo(hTransform)
+	if result is None:
+		raise CmsError, 'Invalid transform handle provided'
+
+	flags = result['flags']
+	result['adaptive'] = bool(result['adaptive'])
+	if flags & cmsFLAGS_NOTPRECALC:
+		result['precalc'] = 'none'
+	elif flags & cmsFLAGS_HIGHRESPRECALC:
+		result['precalc'] = 'highres'
+	elif flags & cmsFLAGS_LOWRESPRECALC:
+		result['precalc'] = 'lowres'
+	else:
+		result['precalc'] = 'default'
+	result['grid_points'] = (flags >> 16) & 0xFF
+	return result
+
+def _hop_values(value, count, name):
+	# value for each profile of chain, hop i sets value of profile i + 1,
+	# input profile gets value of the first hop
+	if not isinstance(value, (list, tuple)):
+		return (value,) * (count + 1)
+	if len(value) != count:
+		msg = '%s should provide value for each of %d hops'
+		raise CmsError, msg % (name, count)
+	return (value[0],) + tuple(value)
+
+def cmsCreateMultiprofileTransform(profiles, inMode, outMode,
+						renderingIntent=INTENT_PERCEPTUAL,
+						flags=cmsFLAGS_NOTPRECALC, bpc=None, cached=True):
+	"""
+	Returns a handle to lcms2 transformation over chain of profiles,
+	i.e. RGB -> Lab -> press CMYK. The whole chain is optimized into
+	single pipeline, so pixels are transformed by one pass without
+	intermediate buffers. Like in lcms, device profile in the middle
+	of chain is used as output and should be repeated to be used
+	as input too, i.e. (source, proof, proof, display).
+	Transforms are cached in transform_cache like in cmsCreateTransform().
+
+	profiles - sequence of valid lcms profile handles
+	inMode - predefined string constant matching the first profile
+	outMode - predefined string constant matching the last profile
+	renderingIntent - integer constant (0-3) specifying rendering intent
+			for all hops or sequence of intents for each hop between
+			adjacent profiles
+	flags - a set of predefined lcms flags
+	bpc - black point compensation for all hops or sequence of booleans
+			for each hop, by default cmsFLAGS_BLACKPOINTCOMPENSATION
+			flag is used
+	cached - if False, a new private handle is built bypassing
+			transform_cache
+	"""
+	profiles = tuple(profiles)
+	if len(profiles) < 2:
+		raise CmsError, 'At least two profiles are required'
+	hops = len(profiles) - 1
+	intents = _hop_values(renderingIntent, hops, 'renderingIntent')
+	for intent in intents:
+		if intent not in (0, 1, 2, 3):
+			raise CmsError, 'renderingIntent must be an integer between 0 and 3'
+	if bpc is None:
+		bpc = bool(flags & cmsFLAGS_BLACKPOINTCOMPENSATION)
+	bpc = tuple([bool(item) for item in _hop_values(bpc, hops, 'bpc')])
+
+	inFormat = _format(inMode)
+	outFormat = _format(outMode)
+	_check_flags(flags, inFormat, outFormat)
+	key = ('chain', tuple([_profile_id(item) for item in profiles]),
+		inFormat, outFormat, intents, bpc, flags)
+	result = _build(cached, key, lambda: _lcms2.buildMultiprofileTransform(
+										profiles, inFormat, outFormat,
+										intents, bpc, flags))
+
+	if result is None:
+		msg = 'Cannot create requested multiprofile transform'
+		raise CmsError, msg + ': %s %s' % (inMode, outMode)
+
+	return result
+
+def cmsCreateGamutCheckTransform(inputProfile, inMode, targetProfile,
+						renderingIntent=INTENT_RELATIVE_COLORIMETRIC,
+						flags=0, cached=True):
+	"""
+	Returns a handle to lcms2 gamut check transformation for gamut_check()
+	and gamut_check_array(). The transform is built with cmsFLAGS_GAMUTCHECK
+	against target profile and converts pixels into TYPE_Lab_16, pixels
+	out of target gamut get Lab (100, -128, -128) alarm color. Transforms
+	are cached in transform_cache like in cmsCreateTransform().
+
+	inputProfile - a valid lcms profile handle
+	inMode - predefined string constant or valid PIL mode
+	targetProfile - a valid lcms profile handle of checked device
+	renderingIntent - integer constant (0-3) specifying rendering intent
+			towards target profile
+	flags - a set of predefined lcms flags
+	cached - if False, a new private handle is built bypassing
+			transform_cache
+	"""
+	if renderingIntent not in (0, 1, 2, 3):
+		raise CmsError, 'renderingIntent must be an integer between 0 and 3'
+
+	inFormat = _format(inMode)
+	key = ('gamut', _profile_id(inputProfile), inFormat,
+		_profile_id(targetProfile), renderingIntent, flags)
+	result = _build(cached, key, lambda: _lcms2.buildGamutCheckTransform(
+										inputProfile, inFormat, targetProfile,
+										renderingIntent, flags))
+
+	if result is None:
+		msg = 'Cannot create requested gamut check transform'
+		raise CmsError, msg + ': %s' % (inMode,)
+
+	return result
+
+def cmsTransform2DeviceLink(hTransform, version=4.3, flags=0):
+	"""
+	Returns a handle to device link profile which contains precalculated
+	pipeline of provided transform. Transform created over the link
+	(see cmsCreateLinkTransform()) doesn't repeat optimization.
+
+	hTransform - a valid lcms transformation handle
+	version - ICC version of resulting profile
+	flags - a set of predefined lcms flags controlling precalculation
+	"""
+	result = _lcms2.transform2DeviceLink(hTransform, version, flags)
+
+	if result is None:
+		raise CmsError, 'Cannot convert transform into device link'
+
+	return result
+
+def cmsCreateLinkTransform(linkProfile, inMode, outMode,
+						renderingIntent=INTENT_PERCEPTUAL,
+						flags=cmsFLAGS_NOTPRECALC, cached=True):
+	"""
+	Returns a handle to lcms2 transformation built over device link profile.
+	Default flags keep precalculated link pipeline as is.
+	Transforms are cached in transform_cache like in cmsCreateTransform().
+
+	linkProfile - a valid lcms device link profile handle
+	inMode - predefined string constant matching link input colorspace
+	outMode - predefined string constant matching link output colorspace
+	renderingIntent - integer constant (0-3) specifying rendering intent
+			for the transform
+	flags - a set of predefined lcms flags
+	cached - if False, a new private handle is built bypassing
+			transform_cache
+	"""
+	if renderingIntent not in (0, 1, 2, 3):
+		raise CmsError, 'renderingIntent must be an integer between 0 and 3'
+
+	inFormat = _format(inMode)
+	outFormat = _format(outMode)
+	_check_flags(flags, inFormat, outFormat)
+	key = (_profile_id(linkProfile), inFormat, None, outFormat,
+		renderingIntent, flags)
+	result = _build(cached, key, lambda: _lcms2.buildTransform(
+								linkProfile, inFormat, None, outFormat,
+								renderingIntent, flags))
+
+	if result is None:
+		msg = 'Cannot create requested link transform'
+		raise CmsError, msg + ': %s %s' % (inMode, outMode)
+
+	return result
+
+def cmsSaveProfileToMem(profile):
+	"""
+	Returns ICC data of provided profile as a string.
+
+	profile - a valid lcms profile handle
+	"""
+	result = _lcms2.saveProfileToMem(profile)
+
+	if result is None:
+		raise CmsError, 'Cannot serialize provided profile'
+
+	return result
+
 def cmsDoTransform(hTransform, inbuff, outbuff, val=None):
 	"""
 	Transform color values from inputBuffer to outputBuffer using provided 
 	lcms transform handle.
 	
 	hTransform - a valid lcms transformation handle
-	inbuff - 5-member list object.
+	inbuff - 5-member list object. Sample types follow transform pixel
+					formats, so the last member (COLOR_BYTE, COLOR_WORD
+					or COLOR_DBL) is ignored.
 	outbuff - 5-member list object with any values for recording 
 					transformation results. Can be [0,0,0,0,0].
 	val - stub parameter for python-lcms compatibility			              
 	"""
 	if type(inbuff) is types.ListType and type(outbuff) is types.ListType and \
 	len(inbuff) == 5 and len(outbuff) == 5 :
-		vals = inbuff[:4] + [outbuff[4], ]
-		if inbuff[4] == COLOR_WORD:
-			ret = _lcms2.transformPixel16b(hTransform, *vals)
-		elif inbuff[4] == COLOR_DBL:
-			ret = _lcms2.transformPixelDbl(hTransform, *vals)
-		else:
-			ret = _lcms2.transformPixel(hTransform, *vals)
-		outbuff[0] = ret[0]
-		outbuff[1] = ret[1]
-		outbuff[2] = ret[2]
-		outbuff[3] = ret[3]
+		# sample types are defined by transform pixel formats,
+		# so color type members are not used
+		try:
+			apply_into = hTransform.apply_into
+		except AttributeError:
+			raise CmsError, 'Invalid transform handle provided'
+		apply_into(outbuff, inbuff[0], inbuff[1], inbuff[2], inbuff[3])
 		return
 
 	else:
 		msg = 'inputBuffer and outputBuffer must be Python 5-member list objects'
 		raise CmsError, msg
 
+def enable_color_cache(hTransform, capacity=4096):
+	"""
+	Attaches native color cache to transform handle. The cache maps
+	input pixels to output pixels, so repeated colors passed to
+	cmsDoTransform() skip lcms pipeline. The cache is direct-mapped,
+	i.e. a new color evicts previous color in the same slot.
+	Bulk buffer transforms don't use the cache.
+	The cache is attached to the handle, and handles from transform_cache
+	are shared by all callers with the same parameters, so enable it
+	on private handles created with cached=False.
+
+	hTransform - a valid lcms transformation handle
+	capacity - number of cache slots, rounded up to power of two
+	Returns actual cache capacity.
+	"""
+	result = _lcms2.enableColorCache(hTransform, capacity)
+
+	if result is None:
+		raise CmsError, 'Cannot create color cache of %s slots' % capacity
+
+	return result
+
+def disable_color_cache(hTransform):
+	"""
+	Drops native color cache attached to transform handle.
+
+	hTransform - a valid lcms transformation handle
+	"""
+	if _lcms2.disableColorCache(hTransform) is None:
+		raise CmsError, 'Invalid transform handle provided'
+
+def get_color_cache_stats(hTransform):
+	"""
+	Returns dictionary of color cache statistics (capacity, size, hits,
+	misses, evictions, hit_rate) or None if the cache is not enabled.
+
+	hTransform - a valid lcms transformation handle
+	"""
+	stats = _lcms2.getColorCacheStats(hTransform)
+
+	if stats is not None:
+		total = stats['hits'] + stats['misses']
+		stats['hit_rate'] = float(stats['hits']) / total if total else 0.0
+
+	return stats
+
+def cmsDoTransformBuffer(hTransform, inbuff, outbuff, npixels):
+	"""
+	Transforms npixels pixels from inbuff to outbuff using provided
+	lcms transform handle. Whole buffer is transformed by single native
+	call with released GIL.
+
+	hTransform - a valid lcms transformation handle
+	inbuff - any object supporting buffer interface (str, bytearray,
+			memoryview, array.array, mmap) which contains pixels packed
+			according to transform input mode
+	outbuff - any writable object supporting buffer interface
+			for recording transformation results in transform output mode.
+			Can be the same object as inbuff if pixel sizes are equal.
+	npixels - number of pixels to transform
+	Returns number of transformed pixels.
+	"""
+	result = _lcms2.transformBuffer(hTransform, inbuff, outbuff, npixels)
+
+	if result is None:
+		sizes = _lcms2.getPixelSizes(hTransform)
+		if sizes is None:
+			raise CmsError, 'Invalid transform handle provided'
+		msg = 'Cannot transform %d pixels: input buffer must provide ' + \
+			'%d bytes and writable output buffer must provide %d bytes'
+		raise CmsError, msg % (npixels, npixels * sizes[0],
+							npixels * sizes[1])
+
+	return result
+
+def transform_palette(hTransform, palette, indices=None, out=None,
+					index_size=1):
+	"""
+	Transforms palette (indexed) image using provided lcms transform
+	handle. Only palette entries pass through the transform, then indices
+	are expanded into output pixels by single native pass with released
+	GIL, so transform cost depends on palette size, not on image size.
+
+	hTransform - a valid lcms transformation handle
+	palette - buffer object of palette entries packed according to
+			transform input mode (up to 256 entries for 8-bit indices)
+	indices - buffer object of palette indices, one per pixel. If omitted,
+			converted palette is returned instead of image.
+	out - writable buffer object for output pixels packed according to
+			transform output mode, new bytearray is allocated if omitted
+	index_size - 1 for 8-bit or 2 for native 16-bit indices
+	Returns out buffer or converted palette string. If indices refer
+	to missing palette entries, CmsError is raised and out buffer
+	may be partially written.
+	"""
+	result = _lcms2.transformPalette(hTransform, palette, indices,
+									index_size, out)
+
+	if result is None:
+		if _lcms2.getPixelSizes(hTransform) is None:
+			raise CmsError, 'Invalid transform handle provided'
+		if index_size not in (1, 2):
+			raise CmsError, 'index_size should be 1 or 2: %s' % index_size
+		msg = 'Cannot transform palette image: palette should match ' + \
+			'chunky transform input mode, indices should refer to palette ' + \
+			'entries, 16-bit indices should fill whole buffer and ' + \
+			'writable output buffer should fit all pixels'
+		raise CmsError, msg
+
+	return result
+
+def gamut_check(hTransform, inbuff, npixels, mask=None, packed=True):
+	"""
+	Finds out-of-gamut pixels using gamut check transform created by
+	cmsCreateGamutCheckTransform(). All pixels are checked by single
+	native call with released GIL.
+
+	hTransform - a valid lcms gamut check transformation handle
+	inbuff - any object supporting buffer interface which contains
+			pixels packed according to transform input mode
+	npixels - number of pixels to check
+	mask - writable buffer object for the mask, new bytearray
+			is allocated if omitted
+	packed - if True the mask keeps 8 pixels per byte, most significant
+			bit first, otherwise each mask byte is 1 or 0
+	Returns (mask, number of out-of-gamut pixels) tuple.
+	"""
+	size = (npixels + 7) // 8 if packed else npixels
+	if mask is None:
+		mask = bytearray(max(size, 0))
+
+	result = _lcms2.gamutCheck(hTransform, inbuff, npixels, mask,
+							1 if packed else 0)
+
+	if result is None:
+		sizes = _lcms2.getPixelSizes(hTransform)
+		if sizes is None:
+			raise CmsError, 'Invalid transform handle provided'
+		msg = 'Cannot check %d pixels: gamut check transform of chunky ' + \
+			'input mode, input buffer of %d bytes and writable mask ' + \
+			'of %d bytes are required'
+		raise CmsError, msg % (npixels, npixels * sizes[0], size)
+
+	return mask, result
+
+def cmsDoTransformLineStride(hTransform, inbuff, outbuff, pixelsPerLine,
+						lineCount, bytesPerLineIn, bytesPerLineOut,
+						bytesPerPlaneIn=None, bytesPerPlaneOut=None):
+	"""
+	Transforms lineCount lines of pixelsPerLine pixels from inbuff to outbuff
+	using provided lcms transform handle. Lines are placed with provided
+	row strides, so crops, tiles and views into larger images are
+	transformed without copying. Transform is done by single native call
+	with released GIL.
+
+	hTransform - a valid lcms transformation handle
+	inbuff - any object supporting buffer interface which contains pixels
+			packed according to transform input mode
+	outbuff - any writable object supporting buffer interface
+			for recording transformation results in transform output mode.
+			Can be the same object as inbuff for in place transform.
+	pixelsPerLine - number of pixels in each line
+	lineCount - number of lines
+	bytesPerLineIn - distance between starts of input lines in bytes
+	bytesPerLineOut - distance between starts of output lines in bytes
+	bytesPerPlaneIn - distance between input channel planes in bytes for
+			planar modes, by default planes follow each other
+	bytesPerPlaneOut - distance between output channel planes in bytes for
+			planar modes, by default planes follow each other
+	Returns number of transformed lines.
+	"""
+	if bytesPerPlaneIn is None:
+		bytesPerPlaneIn = bytesPerLineIn * lineCount
+	if bytesPerPlaneOut is None:
+		bytesPerPlaneOut = bytesPerLineOut * lineCount
+
+	result = _lcms2.transformLineStride(hTransform, inbuff, outbuff,
+									pixelsPerLine, lineCount,
+									bytesPerLineIn, bytesPerLineOut,
+									bytesPerPlaneIn, bytesPerPlaneOut)
+
+	if result is None:
+		if _lcms2.getPixelSizes(hTransform) is None:
+			raise CmsError, 'Invalid transform handle provided'
+		msg = 'Cannot transform %d lines of %d pixels: buffers are too ' + \
+			'short for provided line and plane strides'
+		raise CmsError, msg % (lineCount, pixelsPerLine)
+
+	return result
+
+def parallel_transform(hTransform, inbuff, outbuff, width, height, threads=None):
+	"""
+	Transforms packed image from inbuff to outbuff using provided
+	lcms transform handle. Image is split on row bands which are
+	transformed by pool of native threads with released GIL.
+	Transform handle is shared between threads because cmsDoTransform()
+	doesn't modify transform state.
+
+	hTransform - a valid lcms transformation handle
+	inbuff - any object supporting buffer interface which contains
+			width * height pixels packed according to transform input mode
+	outbuff - any writable object supporting buffer interface
+			for recording transformation results in transform output mode
+	width - image width in pixels
+	height - image height in pixels
+	threads - number of threads, by default equals to CPU count
+	Returns number of used threads.
+	"""
+	if threads is None:
+		import multiprocessing
+		try:
+			threads = multiprocessing.cpu_count()
+		except NotImplementedError:
+			threads = 1
+
+	result = _lcms2.transformParallel(hTransform, inbuff, outbuff,
+									width, height, threads)
+
+	if result is None:
+		sizes = _lcms2.getPixelSizes(hTransform)
+		if sizes is None:
+			raise CmsError, 'Invalid transform handle provided'
+		msg = 'Cannot transform %dx%d image with %s threads: input buffer ' + \
+			'must provide %d bytes and writable output buffer must provide ' + \
+			'%d bytes'
+		raise CmsError, msg % (width, height, threads,
+							width * height * sizes[0],
+							width * height * sizes[1])
+
+	return result
+
+FANOUT_TILE_PIXELS = 4096
+
+def fanout_transform(inputProfile, inMode, targets, inbuff, npixels,
+					outbuffs=None, flags=cmsFLAGS_NOTPRECALC,
+					gamut_check=False, tile_pixels=FANOUT_TILE_PIXELS):
+	"""
+	Transforms the same pixels into several output profiles by single
+	native pass with released GIL. Input is processed by tiles, each
+	tile is transformed for all targets while it stays in CPU cache,
+	so the input buffer is read from memory once. Transforms are built
+	by cmsCreateTransform() and cached in transform_cache.
+
+	inputProfile - a valid lcms profile handle
+	inMode - predefined string constant of chunky input mode
+	targets - sequence of up to 64 (outputProfile, outMode) or
+			(outputProfile, outMode, renderingIntent) tuples, perceptual
+			intent is used if omitted
+	inbuff - any object supporting buffer interface which contains
+			npixels pixels packed according to inMode
+	npixels - number of pixels to transform
+	outbuffs - optional sequence of writable buffer objects for each
+			target, new bytearrays are allocated if omitted
+	flags - a set of predefined lcms flags of all transforms
+	gamut_check - if True, out-of-gamut pixels of each target profile
+			are counted in the same pass by gamut check transforms
+			(see cmsCreateGamutCheckTransform())
+	tile_pixels - number of pixels per tile
+	Returns (outbuffs, counts) tuple, counts is list of out-of-gamut
+	pixel counts of targets or None if gamut_check is False.
+	"""
+	targets = list(targets)
+	if not 1 <= len(targets) <= 64:
+		raise CmsError, 'From 1 to 64 targets are supported'
+	if tile_pixels < 1:
+		raise CmsError, 'tile_pixels should be positive: %s' % (tile_pixels,)
+	transforms = []
+	gamuts = []
+	for target in targets:
+		if len(target) not in (2, 3):
+			raise CmsError, 'Target should be (profile, mode[, intent]) tuple'
+		intent = target[2] if len(target) == 3 else INTENT_PERCEPTUAL
+		transforms.append(cmsCreateTransform(inputProfile, inMode,
+										target[0], target[1], intent, flags))
+		if gamut_check:
+			gamuts.append(cmsCreateGamutCheckTransform(inputProfile, inMode,
+										target[0], intent))
+		else:
+			gamuts.append(None)
+
+	if outbuffs is None:
+		outbuffs = [bytearray(max(npixels, 0) * _lcms2.getPixelSizes(item)[1])
+				for item in transforms]
+	outbuffs = list(outbuffs)
+	if len(outbuffs) != len(targets):
+		raise CmsError, 'Output buffer is required for each target'
+
+	result = _lcms2.transformFanout(tuple(transforms), inbuff,
+								tuple(outbuffs), npixels, tile_pixels,
+								tuple(gamuts))
+
+	if result is None:
+		in_size = _lcms2.getPixelSizes(transforms[0])[0]
+		out_sizes = [_lcms2.getPixelSizes(item)[1] for item in transforms]
+		msg = 'Cannot transform %d pixels into %d targets: chunky modes, ' + \
+			'input buffer of %d bytes and writable output buffers of %s ' + \
+			'bytes are required'
+		raise CmsError, msg % (npixels, len(targets), npixels * in_size,
+							', '.join([str(npixels * size) for size in out_sizes]))
+
+	return outbuffs, result if gamut_check else None
+
+# PIL image modes as (lcms colorspaces, color channels, bytes per sample,
+# float flag, bytes per pixel). PIL stores 3-channel 8-bit images
+# in 4-byte pixels.
+_IMAGE_LAYOUTS = {
+	'L': ((3,), 1, 1, 0, 1),
+	'I;16': ((3,), 1, 2, 0, 2),
+	'F': ((3,), 1, 4, 1, 4),
+	'RGB': ((4,), 3, 1, 0, 4),
+	'RGBA': ((4,), 3, 1, 0, 4),
+	'RGBX': ((4,), 3, 1, 0, 4),
+	'CMYK': ((6,), 4, 1, 0, 4),
+	'LAB': ((10, 30), 3, 1, 0, 4),
+}
+_IMAGE_MODES = ('L', 'I;16', 'F', 'RGB', 'RGBA', 'CMYK', 'LAB')
+
+def _image_compatible(fmt, mode):
+	layout = _IMAGE_LAYOUTS.get(mode)
+	if layout is None:
+		return False
+	spaces, colors, nbytes, isfloat, pixel_size = layout
+	channels, extra, size, flt, planar = _lcms2.getFormatInfo(fmt)
+	# byte swapped and reordered channels do not match PIL layouts
+	endian = (fmt >> 11) & 1 and size == 2
+	return ((fmt >> 16) & 31) in spaces + (0,) and channels == colors and \
+		size == nbytes and flt == isfloat and not planar and \
+		not (fmt >> 10) & 1 and not (fmt >> 14) & 1 and \
+		(channels + extra) * size <= pixel_size and \
+		endian == (nbytes == 2 and sys.byteorder == 'big')
+
+def _image_core(im):
+	core = getattr(im, 'im', None)
+	if not hasattr(core, 'unsafe_ptrs'):
+		raise CmsError, 'Image does not provide access to pixel memory'
+	return core
+
+def apply_to_image(hTransform, im, inplace=True, outMode=None):
+	"""
+	Transforms pixels of PIL image directly in image memory, rows are
+	transformed by native code with released GIL. Packed 3-channel
+	transforms (i.e. TYPE_RGB_8) are applied to 4-byte pixels of PIL
+	"RGB" images too, padding and alpha bytes are kept in such case.
+
+	hTransform - a valid lcms transformation handle, its input format
+			should match image mode
+	im - PIL Image object
+	inplace - if True and transform output format matches image mode,
+			pixels of im are replaced, otherwise new image is created
+	outMode - PIL mode of created image, by default it is selected
+			by transform output format
+	Returns transformed image (im itself for in place transform).
+	"""
+	formats = _lcms2.getTransformFormats(hTransform)
+	if formats is None:
+		raise CmsError, 'Invalid transform handle provided'
+	if not _image_compatible(formats[0], im.mode):
+		msg = 'Transform input mode does not match %s image mode'
+		raise CmsError, msg % im.mode
+
+	if outMode is None:
+		if _image_compatible(formats[1], im.mode):
+			outMode = im.mode
+		else:
+			for mode in _IMAGE_MODES:
+				if _image_compatible(formats[1], mode):
+					outMode = mode
+					break
+	if outMode is None or not _image_compatible(formats[1], outMode):
+		msg = 'Transform output mode does not match %s image mode'
+		raise CmsError, msg % (outMode or 'any')
+
+	im.load()
+	if outMode == im.mode:
+		if inplace:
+			# images sharing external buffers are copied by PIL first
+			if hasattr(im, '_ensure_mutable'):
+				im._ensure_mutable()
+			out = im
+		else:
+			out = im.copy()
+		out.load()
+		src = out
+	else:
+		from PIL import Image
+		out = Image.new(outMode, im.size)
+		out.load()
+		src = im
+
+	width, height = im.size
+	in_pixel = _IMAGE_LAYOUTS[im.mode][4]
+	out_pixel = _IMAGE_LAYOUTS[outMode][4]
+	result = _lcms2.transformImage(hTransform, _image_core(src),
+								_image_core(out), width, height,
+								in_pixel, out_pixel)
+	if result is None:
+		msg = 'Cannot transform %s image into %s image'
+		raise CmsError, msg % (im.mode, outMode)
+	return out
+
+def _iter_source(src, chunk_size):
+	"""
+	Yields byte chunks of chunk_size (the last one may be shorter) from
+	buffer object, file-like object or iterable of byte strings.
+	Chunks of file-like objects are read into the same reused buffer.
+	"""
+	try:
+		data = buffer(src)
+	except TypeError:
+		# new-style buffers like memoryview
+		try:
+			data = memoryview(src)
+		except TypeError:
+			data = None
+		else:
+			if data.ndim != 1 or data.itemsize != 1:
+				data = None
+	if data is not None:
+		for offset in xrange(0, len(data), chunk_size):
+			yield data[offset:offset + chunk_size]
+		return
+
+	inbuff = bytearray(chunk_size)
+	view = memoryview(inbuff)
+	if hasattr(src, 'readinto'):
+		while True:
+			size = 0
+			while size < chunk_size:
+				count = src.readinto(view[size:])
+				if not count:
+					break
+				size += count
+			if not size:
+				return
+			yield view[:size]
+			if size < chunk_size:
+				return
+
+	if hasattr(src, 'read'):
+		read = src.read
+		src = iter(lambda: read(chunk_size), '')
+
+	# iterable of arbitrary sized chunks is regrouped into full chunks
+	size = 0
+	for data in src:
+		data = buffer(data)
+		offset = 0
+		while offset < len(data):
+			count = min(chunk_size - size, len(data) - offset)
+			view[size:size + count] = data[offset:offset + count]
+			size += count
+			offset += count
+			if size == chunk_size:
+				yield view
+				size = 0
+	if size:
+		yield view[:size]
+
+def iter_transform(hTransform, src, chunk_pixels=65536):
+	"""
+	Generator which transforms pixel stream by fixed-size chunks, so memory
+	usage doesn't depend on stream size. Yielded chunk is a buffer object
+	over reused output buffer, it's valid until next iteration only.
+
+	hTransform - a valid lcms transformation handle
+	src - object supporting buffer interface (str, bytearray, mmap),
+			file-like object or iterable of byte strings with pixels
+			packed according to transform input mode
+	chunk_pixels - number of pixels transformed by single native call
+	"""
+	if chunk_pixels < 1:
+		raise CmsError, 'chunk_pixels should be positive: %s' % chunk_pixels
+
+	sizes = _lcms2.getPixelSizes(hTransform)
+	if sizes is None:
+		raise CmsError, 'Invalid transform handle provided'
+	in_size, out_size = sizes
+
+	outbuff = bytearray(chunk_pixels * out_size)
+	for chunk in _iter_source(src, chunk_pixels * in_size):
+		npixels, rest = divmod(len(chunk), in_size)
+		if rest:
+			msg = 'Stream size is not multiple of input pixel size (%d bytes)'
+			raise CmsError, msg % in_size
+		cmsDoTransformBuffer(hTransform, chunk, outbuff, npixels)
+		yield buffer(outbuff, 0, npixels * out_size)
+
+def transform_stream(hTransform, src, dst, chunk_pixels=65536):
+	"""
+	Transforms pixel stream from src to dst using provided lcms transform
+	handle. Pixels are read, transformed and written by fixed-size chunks,
+	so peak memory usage is constant regardless of image size.
+
+	hTransform - a valid lcms transformation handle
+	src - object supporting buffer interface (str, bytearray, mmap),
+			file-like object or iterable of byte strings with pixels
+			packed according to transform input mode
+	dst - file-like object for recording transformation results
+	chunk_pixels - number of pixels transformed by single native call
+	Returns number of transformed pixels.
+	"""
+	out_size = _lcms2.getPixelSizes(hTransform)
+	if out_size is None:
+		raise CmsError, 'Invalid transform handle provided'
+	out_size = out_size[1]
+
+	total = 0
+	for chunk in iter_transform(hTransform, src, chunk_pixels):
+		dst.write(chunk)
+		total += len(chunk)
+	return total // out_size if out_size else 0
+
+_ARRAY_DTYPES = {
+	(1, 0): 'uint8',
+	(2, 0): 'uint16',
+	(2, 1): 'float16',
+	(4, 1): 'float32',
+	(8, 1): 'float64',
+}
+
+def _array_dtype(fmt):
+	"""
+	Returns (dtype name, samples per pixel) tuple for provided lcms format.
+	"""
+	channels, extra, nbytes, isfloat, planar = _lcms2.getFormatInfo(fmt)
+	dtype = _ARRAY_DTYPES.get((nbytes, isfloat))
+	if dtype is None or planar:
+		raise CmsError, 'Transform format cannot be mapped on ndarray'
+	return dtype, channels + extra
+
+def transform_array(hTransform, arr, out=None):
+	"""
+	Transforms NumPy ndarray of pixels using provided lcms transform handle.
+	Pixel format is selected by array dtype and channel count and should
+	match transform input mode. All pixels are transformed by native code
+	with released GIL.
+
+	hTransform - a valid lcms transformation handle
+	arr - ndarray of (H, W, C) or (N, C) shape with uint8, uint16,
+			float32 or float64 dtype; rows may be strided
+	out - optional ndarray for recording transformation results,
+			should have the same leading dimensions as arr and dtype and
+			channel count of transform output mode
+	Returns output ndarray.
+	"""
+	import numpy
+
+	formats = _lcms2.getTransformFormats(hTransform)
+	if formats is None:
+		raise CmsError, 'Invalid transform handle provided'
+	in_dtype, in_channels = _array_dtype(formats[0])
+	out_dtype, out_channels = _array_dtype(formats[1])
+
+	arr = numpy.asarray(arr)
+	if arr.ndim not in (2, 3):
+		raise CmsError, 'Array should have (H, W, C) or (N, C) shape'
+	if arr.dtype != numpy.dtype(in_dtype) or arr.shape[-1] != in_channels:
+		msg = 'Array of %s with %d channels does not match ' + \
+			'transform input (%s with %d channels)'
+		raise CmsError, msg % (arr.dtype, arr.shape[-1],
+							in_dtype, in_channels)
+	if arr.strides[-1] != arr.itemsize or min(arr.strides) < 0 or \
+	arr.strides[-2] != arr.itemsize * in_channels:
+		arr = numpy.ascontiguousarray(arr)
+
+	shape = arr.shape[:-1] + (out_channels,)
+	if out is None:
+		out = numpy.empty(shape, dtype=out_dtype)
+	elif not isinstance(out, numpy.ndarray) or out.shape != shape or \
+	out.dtype != numpy.dtype(out_dtype) or not out.flags.writeable:
+		msg = 'Output array should be writable %s array of %s shape'
+		raise CmsError, msg % (out_dtype, shape)
+	elif out.strides[-1] != out.itemsize or \
+	out.strides[-2] != out.itemsize * out_channels:
+		raise CmsError, 'Output array pixels should be contiguous'
+
+	if arr.ndim == 2:
+		args = (arr.shape[0], 1, 0, 0)
+	else:
+		args = (arr.shape[1], arr.shape[0], arr.strides[0], out.strides[0])
+
+	if _lcms2.transformLines(hTransform, arr, out, *args) is None:
+		raise CmsError, 'Cannot transform provided array'
+
+	return out
+
+def gamut_check_array(hTransform, arr):
+	"""
+	Same as gamut_check() for NumPy ndarray of pixels.
+
+	hTransform - a valid lcms gamut check transformation handle
+	arr - ndarray of (H, W, C) or (N, C) shape matching transform input mode
+	Returns (boolean ndarray of (H, W) or (N,) shape, number of
+	out-of-gamut pixels) tuple.
+	"""
+	import numpy
+
+	formats = _lcms2.getTransformFormats(hTransform)
+	if formats is None:
+		raise CmsError, 'Invalid transform handle provided'
+	in_dtype, in_channels = _array_dtype(formats[0])
+
+	arr = numpy.asarray(arr)
+	if arr.ndim not in (2, 3) or arr.dtype != numpy.dtype(in_dtype) or \
+	arr.shape[-1] != in_channels:
+		msg = 'Array should have (H, W, %d) or (N, %d) shape and %s dtype'
+		raise CmsError, msg % (in_channels, in_channels, in_dtype)
+	arr = numpy.ascontiguousarray(arr)
+
+	mask = numpy.zeros(arr.shape[:-1], dtype=numpy.bool_)
+	count = gamut_check(hTransform, arr, mask.size,
+					mask.view(numpy.uint8), packed=False)[1]
+	return mask, count
+
+# Default weighting parameters: l, c for CMC and Kl, Kc, Kh for CIEDE2000
+_DELTA_E_PARAMS = {
+	DELTA_E_CMC: (2.0, 1.0, 0.0),
+	DELTA_E_CIEDE2000: (1.0, 1.0, 1.0),
+}
+
+def _buffer_size(data):
+	try:
+		view = memoryview(data)
+	except TypeError:
+		# old-style buffers (array.array, mmap)
+		return len(buffer(data))
+	size = view.itemsize
+	for dim in view.shape:
+		size *= dim
+	return size
+
+def _double_buffer(data, convert):
+	"""
+	Returns buffer object of doubles. NumPy arrays are converted into
+	C-contiguous float64 arrays if convert is True, buffers of other
+	typed items are rejected.
+	"""
+	if hasattr(data, '__array_interface__'):
+		import numpy
+		if convert:
+			return numpy.ascontiguousarray(data, dtype=numpy.float64)
+		if data.dtype != numpy.float64:
+			raise CmsError, 'Buffer of doubles is required, got %s' % data.dtype
+		return data
+	typecode = getattr(data, 'typecode', None)
+	if typecode is None:
+		try:
+			typecode = memoryview(data).format
+		except TypeError:
+			return data
+	# untyped byte buffers are treated as packed doubles
+	if typecode not in ('d', 'B', 'b', 'c'):
+		raise CmsError, 'Buffer of doubles is required, got %r items' % typecode
+	return data
+
+def delta_e(lab1, lab2, method=DELTA_E_CIE76, params=None, out=None,
+		stats=False, percentiles=(50, 95, 99)):
+	"""
+	Computes color differences between pairs of Lab colors by native code
+	with released GIL. Differences match lcms cmsDeltaE(), cmsCIE94DeltaE(),
+	cmsCMCdeltaE(), cmsCIE2000DeltaE() and cmsBFDdeltaE() functions.
+
+	lab1, lab2 - NumPy float64 arrays of (..., 3) shape or buffer objects
+			(i.e. array.array('d')) of L, a, b doubles (TYPE_Lab_DBL pixels)
+			with the same number of colors
+	method - one of DELTA_E_* constants
+	params - weighting parameters, (l, c) for DELTA_E_CMC (default 2:1)
+			and (Kl, Kc, Kh) for DELTA_E_CIEDE2000 (default 1, 1, 1)
+	out - writable buffer or float64 ndarray for differences, allocated
+			if omitted
+	stats - if True, summary statistics are returned too
+	percentiles - percentiles (0-100) included into summary statistics
+	Returns differences as array.array('d') or ndarray of lab1.shape[:-1]
+	shape for ndarrays. If stats is True, returns (differences, summary)
+	tuple where summary is dictionary of count, mean, min, max
+	and percentiles (dictionary of percentile values).
+	"""
+	if method not in (DELTA_E_CIE76, DELTA_E_CIE94, DELTA_E_CMC,
+					DELTA_E_CIEDE2000, DELTA_E_BFD):
+		raise CmsError, 'Unknown delta E method: %s' % (method,)
+	weights = list(_DELTA_E_PARAMS.get(method, (0.0, 0.0, 0.0)))
+	if params is not None:
+		weights[:len(params)] = params
+
+	lab1 = _double_buffer(lab1, True)
+	lab2 = _double_buffer(lab2, True)
+	if out is None:
+		if hasattr(lab1, '__array_interface__'):
+			import numpy
+			out = numpy.empty(lab1.shape[:-1], dtype=numpy.float64)
+		else:
+			import array
+			out = array.array('d', [0.0]) * (_buffer_size(lab1) // 24)
+	else:
+		_double_buffer(out, False)
+
+	result = _lcms2.deltaE(lab1, lab2, method, tuple(weights), out,
+						percentiles if stats else None)
+
+	if result is None:
+		msg = 'Cannot compute color differences: Lab buffers of the same ' + \
+			'size and writable output buffer of doubles are required'
+		raise CmsError, msg
+
+	if stats:
+		return out, result
+	return out
+
 
 def cmsDeleteTransform(transform):
 	"""
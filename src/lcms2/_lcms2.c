@@ -17,50 +17,428 @@
  */
 
 #include <Python.h>
+#include <pythread.h>
 #include <lcms2.h>
+#include <lcms2_plugin.h>
+
+#ifdef MS_WINDOWS
+#include <windows.h>
+#else
+#include <sys/time.h>
+#endif
+
+/* Pixel format registry. Mode names follow PIL notation where possible,
+ * ";16S" suffix means byte swapped 16-bit samples, ";float" suffix means
+ * double precision samples. "RGB" mode is mapped on 4-byte pixels
+ * because PIL stores RGB images this way, use "RGB;24" for packed pixels.
+ * Extra channels (alpha or padding, lcms doesn't distinguish them) are
+ * skipped by transforms unless cmsFLAGS_COPY_ALPHA is used.
+ */
+#define TYPE_CMYKA_8 (COLORSPACE_SH(PT_CMYK)|EXTRA_SH(1)|CHANNELS_SH(4)|BYTES_SH(1))
+#define TYPE_CMYKA_16 (COLORSPACE_SH(PT_CMYK)|EXTRA_SH(1)|CHANNELS_SH(4)|BYTES_SH(2))
+#define TYPE_CMYKA_16_SE (TYPE_CMYKA_16|ENDIAN16_SH(1))
+#define TYPE_CMYKA_FLT (FLOAT_SH(1)|COLORSPACE_SH(PT_CMYK)|EXTRA_SH(1)|CHANNELS_SH(4)|BYTES_SH(4))
+#define TYPE_CMYKA_DBL (FLOAT_SH(1)|COLORSPACE_SH(PT_CMYK)|EXTRA_SH(1)|CHANNELS_SH(4)|BYTES_SH(0))
+#define TYPE_RGBA_DBL (FLOAT_SH(1)|COLORSPACE_SH(PT_RGB)|EXTRA_SH(1)|CHANNELS_SH(3)|BYTES_SH(0))
+#define TYPE_GRAYA_FLT (FLOAT_SH(1)|COLORSPACE_SH(PT_GRAY)|EXTRA_SH(1)|CHANNELS_SH(1)|BYTES_SH(4))
+#define TYPE_GRAYA_DBL (FLOAT_SH(1)|COLORSPACE_SH(PT_GRAY)|EXTRA_SH(1)|CHANNELS_SH(1)|BYTES_SH(0))
+
+typedef struct {
+	const char *name;
+	cmsUInt32Number format;
+} FormatEntry;
+
+static const FormatEntry formatTable[] = {
+	{"RGB", TYPE_RGBA_8},
+	{"RGBA", TYPE_RGBA_8},
+	{"RGBX", TYPE_RGBA_8},
+	{"RGBA;16", TYPE_RGBA_16},
+	{"RGBA;16S", TYPE_RGBA_16_SE},
+	{"RGB;24", TYPE_RGB_8},
+	{"RGB;16", TYPE_RGB_16},
+	{"RGB;16S", TYPE_RGB_16_SE},
+	{"BGR;24", TYPE_BGR_8},
+	{"BGR;16", TYPE_BGR_16},
+	{"BGR;16S", TYPE_BGR_16_SE},
+	{"BGRA", TYPE_BGRA_8},
+	{"BGRA;16", TYPE_BGRA_16},
+	{"BGRA;16S", TYPE_BGRA_16_SE},
+	{"ARGB", TYPE_ARGB_8},
+	{"ARGB;16", TYPE_ARGB_16},
+	{"ABGR", TYPE_ABGR_8},
+	{"ABGR;16", TYPE_ABGR_16},
+	{"CMYK", TYPE_CMYK_8},
+	{"CMYK;16", TYPE_CMYK_16},
+	{"CMYK;16S", TYPE_CMYK_16_SE},
+	{"CMYKA", TYPE_CMYKA_8},
+	{"CMYKA;16", TYPE_CMYKA_16},
+	{"CMYKA;16S", TYPE_CMYKA_16_SE},
+	{"LA", TYPE_GRAYA_8},
+	{"LA;16", TYPE_GRAYA_16},
+	{"LA;16S", TYPE_GRAYA_16_SE},
+	{"L", TYPE_GRAY_8},
+	{"L;16", TYPE_GRAY_16},
+	{"L;16S", TYPE_GRAY_16_SE},
+	{"LAB", TYPE_Lab_8},
+	{"LAB;16", TYPE_Lab_16},
+	{"XYZ;16", TYPE_XYZ_16},
+	{"RGB;float32", TYPE_RGB_FLT},
+	{"RGBA;float32", TYPE_RGBA_FLT},
+	{"BGR;float32", TYPE_BGR_FLT},
+	{"BGRA;float32", TYPE_BGRA_FLT},
+	{"ARGB;float32", TYPE_ARGB_FLT},
+	{"CMYK;float32", TYPE_CMYK_FLT},
+	{"L;float32", TYPE_GRAY_FLT},
+	{"LA;float32", TYPE_GRAYA_FLT},
+	{"CMYKA;float32", TYPE_CMYKA_FLT},
+	{"LAB;float32", TYPE_Lab_FLT},
+	{"XYZ;float32", TYPE_XYZ_FLT},
+	{"RGB;float16", TYPE_RGB_HALF_FLT},
+	{"RGBA;float16", TYPE_RGBA_HALF_FLT},
+	{"BGR;float16", TYPE_BGR_HALF_FLT},
+	{"BGRA;float16", TYPE_BGRA_HALF_FLT},
+	{"ARGB;float16", TYPE_ARGB_HALF_FLT},
+	{"CMYK;float16", TYPE_CMYK_HALF_FLT},
+	{"L;float16", TYPE_GRAY_HALF_FLT},
+	{"RGB;float", TYPE_RGB_DBL},
+	{"BGR;float", TYPE_BGR_DBL},
+	{"CMYK;float", TYPE_CMYK_DBL},
+	{"L;float", TYPE_GRAY_DBL},
+	{"LA;float", TYPE_GRAYA_DBL},
+	{"RGBA;float", TYPE_RGBA_DBL},
+	{"CMYKA;float", TYPE_CMYKA_DBL},
+	{"LAB;float", TYPE_Lab_DBL},
+	{"XYZ;float", TYPE_XYZ_DBL},
+	{"RGB;planar", TYPE_RGB_8_PLANAR},
+	{"RGB;16;planar", TYPE_RGB_16_PLANAR},
+	{"BGR;planar", TYPE_BGR_8_PLANAR},
+	{"RGBA;planar", TYPE_RGBA_8_PLANAR},
+	{"RGBA;16;planar", TYPE_RGBA_16_PLANAR},
+	{"CMYK;planar", TYPE_CMYK_8_PLANAR},
+	{"CMYK;16;planar", TYPE_CMYK_16_PLANAR},
+	{NULL, 0}
+};
+
+
+/* Transform builds read profile tags lazily. lcms 2.8 and newer lock
+ * profile I/O, so builds may run without GIL while other threads use
+ * the same profiles; builds with older versions keep GIL.
+ */
+#if LCMS_VERSION >= 2080
+#define BUILD_BEGIN_ALLOW_THREADS Py_BEGIN_ALLOW_THREADS
+#define BUILD_END_ALLOW_THREADS Py_END_ALLOW_THREADS
+#else
+#define BUILD_BEGIN_ALLOW_THREADS {
+#define BUILD_END_ALLOW_THREADS }
+#endif
+
+/* Returns size of single pixel in bytes for provided lcms pixel format.
+ * Zero T_BYTES value means double precision samples.
+ */
+static Py_ssize_t
+getPixelSize (cmsUInt32Number format) {
+
+	Py_ssize_t bytes = T_BYTES(format);
+
+	if(bytes==0) bytes = sizeof(cmsFloat64Number);
+
+	return bytes * (T_CHANNELS(format) + T_EXTRA(format));
+}
+
+/* Fills Py_buffer view for any object supporting either new-style or
+ * old-style buffer interface (array.array and mmap objects provide
+ * old-style buffers only).
+ */
+static int
+getBuffer (PyObject *obj, Py_buffer *view, int writable) {
+
+	void *ptr;
+	const void *c_ptr;
+	Py_ssize_t len;
+
+	if(PyObject_CheckBuffer(obj)){
+		return PyObject_GetBuffer(obj, view, writable ? PyBUF_WRITABLE : PyBUF_SIMPLE);
+	}
+
+	if(writable){
+		if(PyObject_AsWriteBuffer(obj, &ptr, &len) < 0) return -1;
+		return PyBuffer_FillInfo(view, obj, ptr, len, 0, PyBUF_WRITABLE);
+	}
+
+	if(PyObject_AsReadBuffer(obj, &c_ptr, &len) < 0) return -1;
+	return PyBuffer_FillInfo(view, obj, (void *)c_ptr, len, 1, PyBUF_SIMPLE);
+}
+
+/* Same as getBuffer() but accepts non-contiguous exporters (i.e. row
+ * strided ndarrays). Memory span from the buffer start up to the last
+ * addressed byte is stored into span. Negative strides are rejected.
+ */
+static int
+getStridedBuffer (PyObject *obj, Py_buffer *view, int writable, Py_ssize_t *span) {
+
+	int i;
+	Py_ssize_t end;
+
+	if(!PyObject_CheckBuffer(obj)){
+		if(getBuffer(obj, view, writable) < 0) return -1;
+		*span = view->len;
+		return 0;
+	}
+
+	if(PyObject_GetBuffer(obj, view, PyBUF_STRIDES | (writable ? PyBUF_WRITABLE : 0)) < 0){
+		return -1;
+	}
+
+	*span = view->len;
+	if(view->strides==NULL || view->ndim==0 || view->len==0) return 0;
+
+	end = view->itemsize;
+	for(i=0; i<view->ndim; i++){
+		if(view->strides[i] < 0){
+			PyBuffer_Release(view);
+			PyErr_SetString(PyExc_ValueError, "negative strides are not supported");
+			return -1;
+		}
+		end += (view->shape[i] - 1) * view->strides[i];
+	}
+	*span = end;
+	return 0;
+}
+
+/* Checks that lineCount lines of lineSize bytes placed with provided
+ * stride fit into buffer span.
+ */
+static int
+checkLines (Py_ssize_t span, Py_ssize_t lineSize, Py_ssize_t lineCount, Py_ssize_t stride) {
+
+	if(lineCount==0) return 1;
+	if(lineSize > span) return 0;
+	if(lineCount==1) return 1;
+	if(stride < lineSize) return 0;
+	return (lineCount - 1) <= (span - lineSize) / stride;
+}
+
+/* Same as checkLines() for planar formats, i.e. planeCount planes of
+ * lineCount lines placed with provided plane stride.
+ */
+static int
+checkPlanes (Py_ssize_t span, Py_ssize_t lineSize, Py_ssize_t lineCount, Py_ssize_t stride,
+		Py_ssize_t planeCount, Py_ssize_t planeStride) {
+
+	if(lineCount==0 || lineSize==0) return 1;
+	if(planeCount<=1) return checkLines(span, lineSize, lineCount, stride);
+	if(planeStride<=0 || (planeCount - 1) > span / planeStride) return 0;
+	return checkLines(span - (planeCount - 1) * planeStride, lineSize, lineCount, stride);
+}
+
+/* Transforms pixels by chunks because cmsDoTransform() accepts
+ * 32-bit pixel count only. Should be called with released GIL.
+ */
+static void
+doTransform (cmsHTRANSFORM hTransform, char *inbuf, char *outbuf,
+		Py_ssize_t npixels, Py_ssize_t inSize, Py_ssize_t outSize) {
+
+	Py_ssize_t chunk;
+
+	while(npixels > 0){
+		chunk = npixels > 0x40000000 ? 0x40000000 : npixels;
+		cmsDoTransform(hTransform, inbuf, outbuf, (cmsUInt32Number) chunk);
+		inbuf += chunk * inSize;
+		outbuf += chunk * outSize;
+		npixels -= chunk;
+	}
+}
+
+/* Module statistics. Handle counters are always maintained, timings and
+ * pixel counters are collected when statistics are enabled. Counters
+ * are changed with GIL held only, so they don't require locking.
+ */
+#define MAX_STAT_FORMATS 64
+
+typedef struct {
+	cmsUInt32Number format;
+	unsigned PY_LONG_LONG pixels;
+} FormatStat;
+
+typedef struct {
+	int enabled;
+	long profilesLive, transformsLive;
+	unsigned long profilesOpened, profilesClosed;
+	unsigned long transformsBuilt, transformsFreed;
+	double buildTime, transformTime;
+	unsigned PY_LONG_LONG transformCalls, pixels;
+	int formatCount;
+	FormatStat formats[MAX_STAT_FORMATS];
+	PyObject *buildHook;
+	double buildHookThreshold;
+} ModuleStats;
+
+static ModuleStats stats;
+
+static double
+getTime (void) {
+#ifdef MS_WINDOWS
+	LARGE_INTEGER freq, count;
+
+	QueryPerformanceFrequency(&freq);
+	QueryPerformanceCounter(&count);
+	return (double) count.QuadPart / (double) freq.QuadPart;
+#else
+	struct timeval tv;
+
+	gettimeofday(&tv, NULL);
+	return (double) tv.tv_sec + tv.tv_usec * 1e-6;
+#endif
+}
+
+/* Returns start time for measured operation or zero if
+ * statistics are disabled.
+ */
+static double
+statStart (void) {
+	return stats.enabled ? getTime() : 0.0;
+}
+
+/* Accounts transformed pixels by input format of transform without
+ * accounting of call and time, i.e. for pixels of several transforms
+ * done by single call.
+ */
+static void
+statPixels (cmsHTRANSFORM hTransform, Py_ssize_t npixels) {
+
+	cmsUInt32Number format;
+	int i;
+
+	if(!stats.enabled) return;
+
+	stats.pixels += npixels;
+
+	format = cmsGetTransformInputFormat(hTransform);
+	for(i=0; i<stats.formatCount; i++){
+		if(stats.formats[i].format == format) break;
+	}
+	if(i == stats.formatCount){
+		/* rare formats over the limit are accounted in total only */
+		if(i == MAX_STAT_FORMATS) return;
+		stats.formats[i].format = format;
+		stats.formats[i].pixels = 0;
+		stats.formatCount++;
+	}
+	stats.formats[i].pixels += npixels;
+}
+
+/* Accounts transformed pixels. Start is a value returned by statStart().
+ */
+static void
+statTransform (cmsHTRANSFORM hTransform, Py_ssize_t npixels, double start) {
+
+	if(!stats.enabled || start == 0.0) return;
+
+	stats.transformTime += getTime() - start;
+	stats.transformCalls++;
+	statPixels(hTransform, npixels);
+}
+
+/* Accounts transform build and calls slow build hook. Hook errors
+ * are reported as unraisable, so they never break transform creation.
+ */
+static void
+statBuild (double start, cmsUInt32Number inFormat, cmsUInt32Number outFormat,
+		int renderingIntent, cmsUInt32Number flags, int proofing) {
+
+	double elapsed;
+	PyObject *info, *result;
+
+	if(start == 0.0) return;
+
+	elapsed = getTime() - start;
+	if(stats.enabled) stats.buildTime += elapsed;
+
+	if(stats.buildHook == NULL || elapsed < stats.buildHookThreshold) return;
+
+	info = Py_BuildValue("{s:d,s:k,s:k,s:i,s:k,s:i}",
+			"time", elapsed,
+			"input_format", (unsigned long) inFormat,
+			"output_format", (unsigned long) outFormat,
+			"intent", renderingIntent,
+			"flags", (unsigned long) flags,
+			"proofing", proofing);
+	if(info == NULL){
+		PyErr_WriteUnraisable(stats.buildHook);
+		return;
+	}
+
+	result = PyObject_CallFunctionObjArgs(stats.buildHook, info, NULL);
+	if(result == NULL){
+		PyErr_WriteUnraisable(stats.buildHook);
+	}
+	Py_XDECREF(result);
+	Py_DECREF(info);
+}
+
+/* Profile handle type. Profiles are created by module functions only
+ * and closed together with the last Python reference.
+ */
+typedef struct {
+	PyObject_HEAD
+	cmsHPROFILE hProfile;
+} ProfileObject;
 
-cmsUInt32Number
-getLCMStype (char* mode) {
-
-  if (strcmp(mode, "RGB") == 0) {
-    return TYPE_RGBA_8;
-  }
-  else if (strcmp(mode, "RGBA") == 0) {
-    return TYPE_RGBA_8;
-  }
-  else if (strcmp(mode, "RGBX") == 0) {
-    return TYPE_RGBA_8;
-  }
-  else if (strcmp(mode, "RGBA;16") == 0) {
-    return TYPE_RGBA_16;
-  }
-  else if (strcmp(mode, "CMYK") == 0) {
-    return TYPE_CMYK_8;
-  }
-  else if (strcmp(mode, "CMYK;16") == 0) {
-    return TYPE_CMYK_16;
-  }
-  else if (strcmp(mode, "L") == 0) {
-    return TYPE_GRAY_8;
-  }
-  else if (strcmp(mode, "L;16") == 0) {
-    return TYPE_GRAY_16;
-  }
-  else if (strcmp(mode, "LAB") == 0) {
-    return TYPE_Lab_8;
-  }
-  else if (strcmp(mode, "LAB;float") == 0) {
-    return TYPE_Lab_DBL;
-  }
-  else if (strcmp(mode, "XYZ;float") == 0) {
-    return TYPE_XYZ_DBL;
-  }
-
-  else {
-    return TYPE_GRAY_8;
-  }
+static void
+profileDealloc (ProfileObject *self) {
+
+	stats.profilesClosed++;
+	stats.profilesLive--;
+	cmsCloseProfile(self->hProfile);
+	PyObject_Del(self);
 }
 
+static PyTypeObject ProfileType = {
+	PyVarObject_HEAD_INIT(NULL, 0)
+	"_lcms2.Profile",				/* tp_name */
+	sizeof(ProfileObject),			/* tp_basicsize */
+	0,								/* tp_itemsize */
+	(destructor) profileDealloc,	/* tp_dealloc */
+	0,								/* tp_print */
+	0,								/* tp_getattr */
+	0,								/* tp_setattr */
+	0,								/* tp_compare */
+	0,								/* tp_repr */
+	0,								/* tp_as_number */
+	0,								/* tp_as_sequence */
+	0,								/* tp_as_mapping */
+	0,								/* tp_hash */
+	0,								/* tp_call */
+	0,								/* tp_str */
+	0,								/* tp_getattro */
+	0,								/* tp_setattro */
+	0,								/* tp_as_buffer */
+	Py_TPFLAGS_DEFAULT,				/* tp_flags */
+	"lcms2 profile handle",			/* tp_doc */
+};
+
+#define Profile_Check(op) PyObject_TypeCheck(op, &ProfileType)
+#define PROFILE_HANDLE(op) (((ProfileObject *)(op))->hProfile)
+
+/* Wraps profile into Profile handle object, the profile is closed
+ * together with the last Python reference.
+ */
+static PyObject *
+newProfileObject (cmsHPROFILE hProfile) {
+
+	ProfileObject *result;
+
+	result = PyObject_New(ProfileObject, &ProfileType);
+	if(result==NULL){
+		cmsCloseProfile(hProfile);
+		return NULL;
+	}
+
+	result->hProfile = hProfile;
+	stats.profilesOpened++;
+	stats.profilesLive++;
+	return (PyObject *) result;
+}
 
 static PyObject *
 pycms_OpenProfile(PyObject *self, PyObject *args) {
@@ -73,14 +451,139 @@ pycms_OpenProfile(PyObject *self, PyObject *args) {
 		return Py_None;
 	}
 
+	Py_BEGIN_ALLOW_THREADS
 	hProfile = cmsOpenProfileFromFile(profile, "r");
+	Py_END_ALLOW_THREADS
+
+	if(hProfile==NULL) {
+		Py_INCREF(Py_None);
+		return Py_None;
+	}
+
+	return newProfileObject(hProfile);
+}
+
+/* Read-only lcms IO handler over Python buffer. Profile tags are read
+ * lazily right from buffer memory, so the buffer is held until profile
+ * is closed. Close() is called by cmsCloseProfile() from handle
+ * destructor, i.e. while GIL is held.
+ */
+typedef struct {
+	Py_buffer view;
+	cmsUInt8Number *data;
+	cmsUInt32Number size;
+	cmsUInt32Number pointer;
+} MemStream;
+
+static cmsUInt32Number
+memStreamRead (cmsIOHANDLER *io, void *buffer, cmsUInt32Number size, cmsUInt32Number count) {
+
+	MemStream *stream = (MemStream *) io->stream;
+	cmsUInt64Number len = (cmsUInt64Number) size * count;
+
+	if(len > stream->size - stream->pointer) return 0;
+
+	memmove(buffer, stream->data + stream->pointer, (size_t) len);
+	stream->pointer += (cmsUInt32Number) len;
+	return count;
+}
+
+static cmsBool
+memStreamSeek (cmsIOHANDLER *io, cmsUInt32Number offset) {
+
+	MemStream *stream = (MemStream *) io->stream;
+
+	if(offset > stream->size) return FALSE;
+
+	stream->pointer = offset;
+	return TRUE;
+}
+
+static cmsUInt32Number
+memStreamTell (cmsIOHANDLER *io) {
+	return ((MemStream *) io->stream)->pointer;
+}
+
+static cmsBool
+memStreamWrite (cmsIOHANDLER *io, cmsUInt32Number size, const void *buffer) {
+	return FALSE;
+}
+
+static cmsBool
+memStreamClose (cmsIOHANDLER *io) {
+
+	MemStream *stream = (MemStream *) io->stream;
+
+	PyBuffer_Release(&stream->view);
+	free(stream);
+	free(io);
+	return TRUE;
+}
+
+static PyObject *
+pycms_OpenProfileFromMem(PyObject *self, PyObject *args) {
+
+	PyObject *data;
+	Py_ssize_t offset, size;
+	MemStream *stream;
+	cmsIOHANDLER *io;
+	cmsHPROFILE hProfile;
+
+	if (!PyArg_ParseTuple(args, "Onn", &data, &offset, &size) || offset < 0) {
+		PyErr_Clear();
+		Py_INCREF(Py_None);
+		return Py_None;
+	}
+
+	stream = (MemStream *) malloc(sizeof(MemStream));
+	io = (cmsIOHANDLER *) calloc(1, sizeof(cmsIOHANDLER));
+	if(stream==NULL || io==NULL){
+		free(stream);
+		free(io);
+		return PyErr_NoMemory();
+	}
+
+	if(getBuffer(data, &stream->view, 0) < 0){
+		PyErr_Clear();
+		free(stream);
+		free(io);
+		Py_INCREF(Py_None);
+		return Py_None;
+	}
+
+	if(size < 0) size = stream->view.len - offset;
+
+	if(offset > stream->view.len || size < 0 || size > stream->view.len - offset
+			|| size > 0xFFFFFFFFL){
+		io->stream = stream;
+		memStreamClose(io);
+		Py_INCREF(Py_None);
+		return Py_None;
+	}
+
+	stream->data = (cmsUInt8Number *) stream->view.buf + offset;
+	stream->size = (cmsUInt32Number) size;
+	stream->pointer = 0;
+
+	io->stream = stream;
+	io->ReportedSize = stream->size;
+	io->Read = memStreamRead;
+	io->Seek = memStreamSeek;
+	io->Close = memStreamClose;
+	io->Tell = memStreamTell;
+	io->Write = memStreamWrite;
+
+	/* IO handler is closed by lcms on failure */
+	hProfile = cmsOpenProfileFromIOhandlerTHR(NULL, io);
 
 	if(hProfile==NULL) {
 		Py_INCREF(Py_None);
 		return Py_None;
 	}
 
-	return Py_BuildValue("O", PyCObject_FromVoidPtr((void *)hProfile, (void *)cmsCloseProfile));
+	/* the handle (and the buffer it holds) is released together
+	 * with the last Python reference */
+	return newProfileObject(hProfile);
 }
 
 static PyObject *
@@ -95,7 +598,7 @@ pycms_CreateRGBProfile(PyObject *self, PyObject *args) {
 		return Py_None;
 	}
 
-	return Py_BuildValue("O", PyCObject_FromVoidPtr((void *)hProfile, (void *)cmsCloseProfile));
+	return newProfileObject(hProfile);
 }
 
 static PyObject *
@@ -110,7 +613,7 @@ pycms_CreateLabProfile(PyObject *self, PyObject *args) {
 		return Py_None;
 	}
 
-	return Py_BuildValue("O", PyCObject_FromVoidPtr((void *)hProfile, (void *)cmsCloseProfile));
+	return newProfileObject(hProfile);
 }
 
 static PyObject *
@@ -128,7 +631,7 @@ pycms_CreateGrayProfile(PyObject *self, PyObject *args) {
 		return Py_None;
 	}
 
-	return Py_BuildValue("O", PyCObject_FromVoidPtr((void *)hProfile, (void *)cmsCloseProfile));
+	return newProfileObject(hProfile);
 }
 
 static PyObject *
@@ -143,292 +646,2996 @@ pycms_CreateXYZProfile(PyObject *self, PyObject *args) {
 		return Py_None;
 	}
 
-	return Py_BuildValue("O", PyCObject_FromVoidPtr((void *)hProfile, (void *)cmsCloseProfile));
+	return newProfileObject(hProfile);
+}
+
+/* Optional per-transform color cache which maps input pixel bytes
+ * to output pixel bytes. The cache is direct-mapped: each slot keeps
+ * used flag, input pixel and output pixel.
+ */
+typedef struct {
+	Py_ssize_t capacity;
+	Py_ssize_t inSize;
+	Py_ssize_t outSize;
+	Py_ssize_t slotSize;
+	Py_ssize_t size;
+	unsigned long hits;
+	unsigned long misses;
+	unsigned long evictions;
+	unsigned char *slots;
+} ColorMemo;
+
+/* Sample types of single pixel transforms */
+#define SAMPLE_NONE 0
+#define SAMPLE_BYTE 1
+#define SAMPLE_WORD 2
+#define SAMPLE_WORD_SE 3
+#define SAMPLE_FLOAT 4
+#define SAMPLE_DOUBLE 5
+
+#define MAX_PRECALC_LEVELS 8
+
+/* Transform handle type. Pixel formats, pixel sizes and sample types
+ * are cached on build, single pixel transforms use preallocated
+ * scratch pixels, so they don't query lcms or allocate memory.
+ */
+typedef struct {
+	PyObject_HEAD
+	cmsHTRANSFORM hTransform;
+	cmsUInt32Number inFormat;
+	cmsUInt32Number outFormat;
+	Py_ssize_t inSize;
+	Py_ssize_t outSize;
+	int inSamples;
+	int outSamples;
+	int inType;
+	int outType;
+	int gamutCheck;
+	cmsContext context;
+	ColorMemo *memo;
+	cmsFloat64Number inbuf[cmsMAXCHANNELS];
+	cmsFloat64Number outbuf[cmsMAXCHANNELS];
+	/* pixel usage and adaptive precalculation, see acquireTransform() */
+	unsigned PY_LONG_LONG pixels;
+	PyObject *profiles;
+	int intent;
+	cmsUInt32Number baseFlags;
+	cmsUInt32Number flags;
+	int level;
+	int levelCount;
+	int upgrading;
+	unsigned PY_LONG_LONG thresholds[MAX_PRECALC_LEVELS];
+	cmsUInt32Number levelFlags[MAX_PRECALC_LEVELS];
+	cmsHTRANSFORM retired[MAX_PRECALC_LEVELS];
+	int retiredCount;
+} TransformObject;
+
+static PyTypeObject TransformType;
+
+#define Transform_Check(op) PyObject_TypeCheck(op, &TransformType)
+#define TRANSFORM_HANDLE(op) (((TransformObject *)(op))->hTransform)
+
+static void
+freeColorMemo (ColorMemo *memo) {
+
+	if(memo==NULL) return;
+	free(memo->slots);
+	free(memo);
+}
+
+/* FNV-1a hash of pixel bytes */
+static unsigned long
+memoHash (unsigned char *data, Py_ssize_t len) {
+
+	unsigned long hash = 2166136261UL;
+	Py_ssize_t i;
+
+	for(i=0; i<len; i++){
+		hash ^= data[i];
+		hash *= 16777619UL;
+	}
+	return hash;
+}
+
+/* Returns sample type of provided lcms pixel format. Half float
+ * samples are not supported by single pixel transforms.
+ */
+static int
+getSampleType (cmsUInt32Number format) {
+
+	if(T_FLOAT(format)){
+		if(T_BYTES(format)==4) return SAMPLE_FLOAT;
+		if(T_BYTES(format)==0) return SAMPLE_DOUBLE;
+		return SAMPLE_NONE;
+	}
+	if(T_BYTES(format)==1) return SAMPLE_BYTE;
+	if(T_BYTES(format)==2) return T_ENDIAN16(format) ? SAMPLE_WORD_SE : SAMPLE_WORD;
+	if(T_BYTES(format)==0) return SAMPLE_DOUBLE;
+	return SAMPLE_NONE;
+}
+
+static int
+getSampleCount (cmsUInt32Number format) {
+
+	int count = T_CHANNELS(format) + T_EXTRA(format);
+
+	return count > cmsMAXCHANNELS ? cmsMAXCHANNELS : count;
+}
+
+static void
+transformDealloc (TransformObject *self) {
+
+	int i;
+
+	cmsDeleteTransform(self->hTransform);
+	for(i=0; i<self->retiredCount; i++) cmsDeleteTransform(self->retired[i]);
+	Py_XDECREF(self->profiles);
+	if(self->context) cmsDeleteContext(self->context);
+	freeColorMemo(self->memo);
+	stats.transformsFreed++;
+	stats.transformsLive--;
+	PyObject_Del(self);
+}
+
+/* Wraps transform into Transform handle object, the transform is
+ * deleted together with the last Python reference.
+ */
+static PyObject *
+newTransformObject (cmsHTRANSFORM hTransform) {
+
+	TransformObject *result;
+	cmsUInt32Number inFormat, outFormat;
+
+	/* single pixels are transformed through fixed scratch buffers,
+	 * so larger pixels (i.e. 15 channels with 7 extra doubles) are
+	 * rejected, callers return None for them */
+	inFormat = cmsGetTransformInputFormat(hTransform);
+	outFormat = cmsGetTransformOutputFormat(hTransform);
+	if(getPixelSize(inFormat) > (Py_ssize_t) sizeof(result->inbuf)
+			|| getPixelSize(outFormat) > (Py_ssize_t) sizeof(result->outbuf)){
+		cmsDeleteTransform(hTransform);
+		Py_INCREF(Py_None);
+		return Py_None;
+	}
+
+	result = PyObject_New(TransformObject, &TransformType);
+	if(result==NULL){
+		cmsDeleteTransform(hTransform);
+		return NULL;
+	}
+
+	result->hTransform = hTransform;
+	result->inFormat = inFormat;
+	result->outFormat = outFormat;
+	result->inSize = getPixelSize(result->inFormat);
+	result->outSize = getPixelSize(result->outFormat);
+	result->inSamples = getSampleCount(result->inFormat);
+	result->outSamples = getSampleCount(result->outFormat);
+	result->inType = getSampleType(result->inFormat);
+	result->outType = getSampleType(result->outFormat);
+	result->gamutCheck = 0;
+	result->context = NULL;
+	result->memo = NULL;
+	memset(result->inbuf, 0, sizeof(result->inbuf));
+	memset(result->outbuf, 0, sizeof(result->outbuf));
+	result->pixels = 0;
+	result->profiles = NULL;
+	result->intent = 0;
+	result->baseFlags = 0;
+	result->flags = 0;
+	result->level = 0;
+	result->levelCount = 0;
+	result->upgrading = 0;
+	result->retiredCount = 0;
+
+	stats.transformsBuilt++;
+	stats.transformsLive++;
+	return (PyObject *) result;
+}
+
+/* Wraps transform and records its build flags */
+static PyObject *
+newBuiltTransform (cmsHTRANSFORM hTransform, cmsUInt32Number flags) {
+
+	PyObject *result = newTransformObject(hTransform);
+
+	if(result!=NULL && result!=Py_None) ((TransformObject *) result)->flags = flags;
+	return result;
+}
+
+/* Returns transform handle for transforming of npixels and counts them.
+ * Adaptive transforms are rebuilt with next precalculation level when
+ * pixel count reaches its threshold. The build may run without GIL
+ * (see BUILD_BEGIN_ALLOW_THREADS), other threads meanwhile use current
+ * handle. Replaced handles may still be in use by threads without GIL,
+ * so they are kept until dealloc.
+ */
+static cmsHTRANSFORM
+acquireTransform (TransformObject *self, Py_ssize_t npixels) {
+
+	cmsHTRANSFORM hTransform;
+	cmsHPROFILE hInputProfile, hOutputProfile;
+	cmsUInt32Number flags;
+	int level;
+	double start;
+
+	self->pixels += npixels;
+	if(self->profiles==NULL || self->upgrading || self->level + 1 >= self->levelCount
+			|| self->pixels < self->thresholds[self->level + 1]){
+		return self->hTransform;
+	}
+
+	level = self->level + 1;
+	while(level + 1 < self->levelCount && self->pixels >= self->thresholds[level + 1]) level++;
+
+	flags = self->baseFlags | self->levelFlags[level];
+	hInputProfile = PROFILE_HANDLE(PyTuple_GET_ITEM(self->profiles, 0));
+	hOutputProfile = PROFILE_HANDLE(PyTuple_GET_ITEM(self->profiles, 1));
+
+	self->upgrading = 1;
+	start = (stats.enabled || stats.buildHook) ? getTime() : 0.0;
+
+	BUILD_BEGIN_ALLOW_THREADS
+	hTransform = cmsCreateTransform(hInputProfile, self->inFormat,
+			hOutputProfile, self->outFormat, self->intent, flags);
+	BUILD_END_ALLOW_THREADS
+
+	self->upgrading = 0;
+	if(hTransform==NULL){
+		/* failed level is not retried */
+		self->levelCount = self->level + 1;
+		return self->hTransform;
+	}
+
+	statBuild(start, self->inFormat, self->outFormat, self->intent, flags, 0);
+
+	self->retired[self->retiredCount++] = self->hTransform;
+	self->hTransform = hTransform;
+	self->flags = flags;
+	self->level = level;
+
+	/* cached colors were produced by previous pipeline */
+	if(self->memo!=NULL){
+		memset(self->memo->slots, 0, self->memo->capacity * self->memo->slotSize);
+		self->memo->size = 0;
+	}
+	return hTransform;
 }
 
 static PyObject *
 pycms_BuildTransform (PyObject *self, PyObject *args) {
 
-	char *inMode;
-	char *outMode;
+	cmsUInt32Number inMode;
+	cmsUInt32Number outMode;
 	int renderingIntent;
 	int inFlags;
 	cmsUInt32Number flags;
-	void *inputProfile;
-	void *outputProfile;
+	PyObject *inputProfile;
+	PyObject *outputProfile;
 	cmsHPROFILE hInputProfile, hOutputProfile;
 	cmsHTRANSFORM hTransform;
+	double start;
 
-	if (!PyArg_ParseTuple(args, "OsOsii", &inputProfile, &inMode, &outputProfile, &outMode, &renderingIntent, &inFlags)) {
+	/* None output profile is used for device link transforms */
+	if (!PyArg_ParseTuple(args, "OIOIii", &inputProfile, &inMode, &outputProfile, &outMode, &renderingIntent, &inFlags)
+			|| !Profile_Check(inputProfile)
+			|| (outputProfile != Py_None && !Profile_Check(outputProfile))) {
+		PyErr_Clear();
 		Py_INCREF(Py_None);
 		return Py_None;
 	}
 
-	hInputProfile = (cmsHPROFILE) PyCObject_AsVoidPtr(inputProfile);
-	hOutputProfile = (cmsHPROFILE) PyCObject_AsVoidPtr(outputProfile);
+	hInputProfile = PROFILE_HANDLE(inputProfile);
+	hOutputProfile = outputProfile == Py_None ? NULL : PROFILE_HANDLE(outputProfile);
 	flags = (cmsUInt32Number) inFlags;
 
-	hTransform = cmsCreateTransform(hInputProfile, getLCMStype(inMode),
-			hOutputProfile, getLCMStype(outMode), renderingIntent, flags);
+	start = (stats.enabled || stats.buildHook) ? getTime() : 0.0;
+
+	/* profiles are held by caller, so building may run without GIL */
+	BUILD_BEGIN_ALLOW_THREADS
+	hTransform = cmsCreateTransform(hInputProfile, inMode,
+			hOutputProfile, outMode, renderingIntent, flags);
+	BUILD_END_ALLOW_THREADS
 
 	if(hTransform==NULL) {
 		Py_INCREF(Py_None);
 		return Py_None;
 	}
 
-	return Py_BuildValue("O", PyCObject_FromVoidPtr((void *)hTransform, (void *)cmsDeleteTransform));
+	statBuild(start, inMode, outMode, renderingIntent, flags, 0);
+
+	return newBuiltTransform(hTransform, flags);
 }
 
 static PyObject *
 pycms_BuildProofingTransform (PyObject *self, PyObject *args) {
 
-	char *inMode;
-	char *outMode;
+	cmsUInt32Number inMode;
+	cmsUInt32Number outMode;
 	int renderingIntent;
 	int proofingIntent;
 	int inFlags;
 	cmsUInt32Number flags;
-	void *inputProfile;
-	void *outputProfile;
-	void *proofingProfile;
+	PyObject *inputProfile;
+	PyObject *outputProfile;
+	PyObject *proofingProfile;
 
 	cmsHPROFILE hInputProfile, hOutputProfile, hProofingProfile;
 	cmsHTRANSFORM hTransform;
+	double start;
 
-	if (!PyArg_ParseTuple(args, "OsOsOiii", &inputProfile, &inMode, &outputProfile, &outMode,
-			&proofingProfile, &renderingIntent, &proofingIntent, &inFlags)) {
+	if (!PyArg_ParseTuple(args, "OIOIOiii", &inputProfile, &inMode, &outputProfile, &outMode,
+			&proofingProfile, &renderingIntent, &proofingIntent, &inFlags)
+			|| !Profile_Check(inputProfile) || !Profile_Check(outputProfile)
+			|| !Profile_Check(proofingProfile)) {
+		PyErr_Clear();
 		Py_INCREF(Py_None);
 		return Py_None;
 	}
 
-	hInputProfile = (cmsHPROFILE) PyCObject_AsVoidPtr(inputProfile);
-	hOutputProfile = (cmsHPROFILE) PyCObject_AsVoidPtr(outputProfile);
-	hProofingProfile = (cmsHPROFILE) PyCObject_AsVoidPtr(proofingProfile);
+	hInputProfile = PROFILE_HANDLE(inputProfile);
+	hOutputProfile = PROFILE_HANDLE(outputProfile);
+	hProofingProfile = PROFILE_HANDLE(proofingProfile);
 	flags = (cmsUInt32Number) inFlags;
 
-	hTransform = cmsCreateProofingTransform(hInputProfile, getLCMStype(inMode),
-			hOutputProfile, getLCMStype(outMode), hProofingProfile, renderingIntent, proofingIntent, flags);
+	start = (stats.enabled || stats.buildHook) ? getTime() : 0.0;
+
+	BUILD_BEGIN_ALLOW_THREADS
+	hTransform = cmsCreateProofingTransform(hInputProfile, inMode,
+			hOutputProfile, outMode, hProofingProfile, renderingIntent, proofingIntent, flags);
+	BUILD_END_ALLOW_THREADS
 
 	if(hTransform==NULL) {
 		Py_INCREF(Py_None);
 		return Py_None;
 	}
 
-	return Py_BuildValue("O", PyCObject_FromVoidPtr((void *)hTransform, (void *)cmsDeleteTransform));
-}
+	statBuild(start, inMode, outMode, renderingIntent, flags, 1);
 
-#define COLOR_BYTE 0
-#define COLOR_WORD 1
-#define COLOR_DBL 2
+	return newBuiltTransform(hTransform, flags);
+}
 
+/* Adaptive transforms start with precalculation level chosen by expected
+ * pixel count and are upgraded by acquireTransform() as transformed
+ * pixels reach thresholds of next levels. Levels are (threshold, flags)
+ * tuples sorted by threshold, the first threshold is zero.
+ */
 static PyObject *
-pycms_TransformPixel (PyObject *self, PyObject *args) {
+pycms_BuildAdaptiveTransform (PyObject *self, PyObject *args) {
 
-	unsigned char *inbuf=malloc(4);
-	unsigned short *outbuf=malloc(8);
-	double *d_outbuf=malloc(32);
-	int channel1,channel2,channel3,channel4,out_type;
-	void *transform;
+	cmsUInt32Number inMode;
+	cmsUInt32Number outMode;
+	int renderingIntent;
+	int inFlags;
+	cmsUInt32Number flags;
+	PyObject *inputProfile, *outputProfile, *levels, *item, *result;
+	unsigned PY_LONG_LONG expected, thresholds[MAX_PRECALC_LEVELS];
+	unsigned long levelFlags[MAX_PRECALC_LEVELS];
+	TransformObject *obj;
 	cmsHTRANSFORM hTransform;
-	PyObject *result;
-
-	if (!PyArg_ParseTuple(args, "Oiiiii", &transform, &channel1,
-			&channel2, &channel3, &channel4, &out_type)) {
-		free(inbuf);
-		free(outbuf);
-		free(d_outbuf);
+	Py_ssize_t count, i;
+	int level = 0;
+	double start;
+
+	if (!PyArg_ParseTuple(args, "OIOIiiO!K", &inputProfile, &inMode, &outputProfile, &outMode,
+			&renderingIntent, &inFlags, &PyTuple_Type, &levels, &expected)
+			|| !Profile_Check(inputProfile) || !Profile_Check(outputProfile)) {
+		PyErr_Clear();
 		Py_INCREF(Py_None);
 		return Py_None;
 	}
 
-	inbuf[0]=(unsigned char)channel1;
-	inbuf[1]=(unsigned char)channel2;
-	inbuf[2]=(unsigned char)channel3;
-	inbuf[3]=(unsigned char)channel4;
-
-	hTransform = (cmsHTRANSFORM) PyCObject_AsVoidPtr(transform);
-
-	if(out_type==COLOR_WORD){
-		cmsDoTransform(hTransform, inbuf, outbuf, 1);
-		result = Py_BuildValue("[iiii]", outbuf[0], outbuf[1], outbuf[2], outbuf[3]);
-	}else if(out_type==COLOR_DBL){
-		cmsDoTransform(hTransform, inbuf, d_outbuf, 1);
-		result = Py_BuildValue("[dddd]", d_outbuf[0], d_outbuf[1], d_outbuf[2], d_outbuf[3]);
-	}else{
-		cmsDoTransform(hTransform, inbuf, inbuf, 1);
-		result = Py_BuildValue("[iiii]", inbuf[0], inbuf[1], inbuf[2], inbuf[3]);
+	count = PyTuple_GET_SIZE(levels);
+	if(count < 1 || count > MAX_PRECALC_LEVELS){
+		Py_INCREF(Py_None);
+		return Py_None;
 	}
 
-	free(inbuf);
-	free(outbuf);
-	free(d_outbuf);
+	for(i=0; i<count; i++){
+		item = PyTuple_GET_ITEM(levels, i);
+		if(!PyArg_ParseTuple(item, "Kk", &thresholds[i], &levelFlags[i])
+				|| (i && thresholds[i] < thresholds[i - 1]) || (!i && thresholds[i])){
+			PyErr_Clear();
+			Py_INCREF(Py_None);
+			return Py_None;
+		}
+		if(thresholds[i] <= expected) level = (int) i;
+	}
 
-	return result;
-}
+	flags = (cmsUInt32Number) inFlags | (cmsUInt32Number) levelFlags[level];
 
-static PyObject *
-pycms_TransformPixel16b (PyObject *self, PyObject *args) {
+	start = (stats.enabled || stats.buildHook) ? getTime() : 0.0;
 
-	unsigned short *inbuf=malloc(8);
-	unsigned char *outbuf=malloc(4);
-	double *d_outbuf=malloc(32);
-	int channel1,channel2,channel3,channel4,out_type;
-	void *transform;
-	cmsHTRANSFORM hTransform;
-	PyObject *result;
+	BUILD_BEGIN_ALLOW_THREADS
+	hTransform = cmsCreateTransform(PROFILE_HANDLE(inputProfile), inMode,
+			PROFILE_HANDLE(outputProfile), outMode, renderingIntent, flags);
+	BUILD_END_ALLOW_THREADS
 
-	if (!PyArg_ParseTuple(args, "Oiiiii", &transform, &channel1,
-			&channel2, &channel3, &channel4, &out_type)) {
-		free(inbuf);
-		free(outbuf);
-		free(d_outbuf);
+	if(hTransform==NULL) {
 		Py_INCREF(Py_None);
 		return Py_None;
 	}
 
-	inbuf[0]=(unsigned short)channel1;
-	inbuf[1]=(unsigned short)channel2;
-	inbuf[2]=(unsigned short)channel3;
-	inbuf[3]=(unsigned short)channel4;
+	statBuild(start, inMode, outMode, renderingIntent, flags, 0);
 
-	hTransform = (cmsHTRANSFORM) PyCObject_AsVoidPtr(transform);
+	result = newTransformObject(hTransform);
+	if(result==NULL || result==Py_None) return result;
 
-	if(out_type==COLOR_BYTE){
-		cmsDoTransform(hTransform, inbuf, outbuf, 1);
-		result = Py_BuildValue("[iiii]", outbuf[0], outbuf[1], outbuf[2], outbuf[3]);
-	}else if(out_type==COLOR_DBL){
-		cmsDoTransform(hTransform, inbuf, d_outbuf, 1);
-		result = Py_BuildValue("[dddd]", d_outbuf[0], d_outbuf[1], d_outbuf[2], d_outbuf[3]);
-	}else{
-		cmsDoTransform(hTransform, inbuf, inbuf, 1);
-		result = Py_BuildValue("[iiii]", inbuf[0], inbuf[1], inbuf[2], inbuf[3]);
+	obj = (TransformObject *) result;
+	obj->profiles = PyTuple_Pack(2, inputProfile, outputProfile);
+	if(obj->profiles==NULL){
+		Py_DECREF(result);
+		return NULL;
+	}
+	obj->intent = renderingIntent;
+	obj->baseFlags = (cmsUInt32Number) inFlags;
+	obj->flags = flags;
+	obj->level = level;
+	obj->levelCount = (int) count;
+	for(i=0; i<count; i++){
+		obj->thresholds[i] = thresholds[i];
+		obj->levelFlags[i] = (cmsUInt32Number) levelFlags[i];
 	}
-
-	free(inbuf);
-	free(outbuf);
-	free(d_outbuf);
 
 	return result;
 }
 
 static PyObject *
-pycms_TransformPixelDbl (PyObject *self, PyObject *args) {
+pycms_GetPrecalcInfo (PyObject *self, PyObject *args) {
 
-	double *inbuf=malloc(32);
-	unsigned char *c_outbuf=malloc(4);
-	unsigned short *outbuf=malloc(8);
-	int out_type;
-	void *transform;
-	cmsHTRANSFORM hTransform;
-	PyObject *result;
+	PyObject *transform;
+	TransformObject *obj;
 
-	if (!PyArg_ParseTuple(args, "Oddddi", &transform, &inbuf[0],
-			&inbuf[1], &inbuf[2], &inbuf[3], &out_type)) {
-		free(inbuf);
-		free(outbuf);
-		free(c_outbuf);
+	if (!PyArg_ParseTuple(args, "O", &transform) || !Transform_Check(transform)) {
+		PyErr_Clear();
 		Py_INCREF(Py_None);
 		return Py_None;
 	}
 
-	hTransform = (cmsHTRANSFORM) PyCObject_AsVoidPtr(transform);
-
-	if(out_type==COLOR_WORD){
-		cmsDoTransform(hTransform, inbuf, outbuf, 1);
-		result = Py_BuildValue("[iiii]", outbuf[0], outbuf[1], outbuf[2], outbuf[3]);
-	}else if(out_type==COLOR_BYTE){
-		cmsDoTransform(hTransform, inbuf, c_outbuf, 1);
-		result = Py_BuildValue("[iiii]", c_outbuf[0], c_outbuf[1], c_outbuf[2], c_outbuf[3]);
-	}else{
-		cmsDoTransform(hTransform, inbuf, inbuf, 1);
-		result = Py_BuildValue("[dddd]", inbuf[0], inbuf[1], inbuf[2], inbuf[3]);
-	}
-
-	free(inbuf);
-	free(outbuf);
-	free(c_outbuf);
-
-	return result;
+	obj = (TransformObject *) transform;
+	return Py_BuildValue("{s:K,s:i,s:k,s:i,s:i}",
+			"pixels", obj->pixels,
+			"adaptive", obj->profiles!=NULL,
+			"flags", (unsigned long) obj->flags,
+			"level", obj->level,
+			"upgrades", obj->retiredCount);
 }
 
-#define BUFFER_SIZE 1000
+#define MAX_CHAIN_PROFILES 255
 
+/* Chain of profiles is linked into single pipeline, so intermediate
+ * color spaces never get into memory. Rendering intent and black
+ * point compensation are set per profile like in cmsLinkProfiles().
+ */
 static PyObject *
-pycms_GetProfileName (PyObject *self, PyObject *args) {
+pycms_BuildMultiprofileTransform (PyObject *self, PyObject *args) {
 
-	void *profile;
-	cmsHPROFILE hProfile;
-	char *buffer;
-	PyObject *ret;
+	cmsUInt32Number inMode;
+	cmsUInt32Number outMode;
+	int inFlags;
+	cmsUInt32Number flags;
+	PyObject *profiles, *intents, *bpc, *item;
+	cmsHPROFILE hProfiles[MAX_CHAIN_PROFILES];
+	cmsUInt32Number intentList[MAX_CHAIN_PROFILES];
+	cmsBool bpcList[MAX_CHAIN_PROFILES];
+	cmsFloat64Number adaptation[MAX_CHAIN_PROFILES];
+	cmsHTRANSFORM hTransform;
+	Py_ssize_t count, i;
+	double start;
 
-	if (!PyArg_ParseTuple(args, "O", &profile)) {
+	if (!PyArg_ParseTuple(args, "O!IIO!O!i", &PyTuple_Type, &profiles, &inMode, &outMode,
+			&PyTuple_Type, &intents, &PyTuple_Type, &bpc, &inFlags)) {
+		PyErr_Clear();
 		Py_INCREF(Py_None);
 		return Py_None;
 	}
 
-	buffer=malloc(BUFFER_SIZE);
-	hProfile = (cmsHPROFILE) PyCObject_AsVoidPtr(profile);
-
-	cmsGetProfileInfoASCII(hProfile,
-			cmsInfoDescription,
-			cmsNoLanguage, cmsNoCountry,
-			buffer, BUFFER_SIZE);
+	count = PyTuple_GET_SIZE(profiles);
+	if(count < 1 || count > MAX_CHAIN_PROFILES
+			|| PyTuple_GET_SIZE(intents) != count || PyTuple_GET_SIZE(bpc) != count){
+		Py_INCREF(Py_None);
+		return Py_None;
+	}
 
-	ret=Py_BuildValue("s", buffer);
-	free(buffer);
-	return ret;
-}
+	for(i=0; i<count; i++){
+		item = PyTuple_GET_ITEM(profiles, i);
+		if(!Profile_Check(item)){
+			Py_INCREF(Py_None);
+			return Py_None;
+		}
+		hProfiles[i] = PROFILE_HANDLE(item);
+		intentList[i] = (cmsUInt32Number) PyInt_AsLong(PyTuple_GET_ITEM(intents, i));
+		bpcList[i] = PyObject_IsTrue(PyTuple_GET_ITEM(bpc, i)) > 0;
+		adaptation[i] = cmsSetAdaptationState(-1);
+	}
+	if(PyErr_Occurred()){
+		PyErr_Clear();
+		Py_INCREF(Py_None);
+		return Py_None;
+	}
+	flags = (cmsUInt32Number) inFlags;
 
-static PyObject *
-pycms_GetProfileInfo (PyObject *self, PyObject *args) {
+	start = (stats.enabled || stats.buildHook) ? getTime() : 0.0;
 
-	void *profile;
-	cmsHPROFILE hProfile;
-	char *buffer;
-	PyObject *ret;
+	BUILD_BEGIN_ALLOW_THREADS
+	hTransform = cmsCreateExtendedTransform(NULL, (cmsUInt32Number) count, hProfiles,
+			bpcList, intentList, adaptation, NULL, 0, inMode, outMode, flags);
+	BUILD_END_ALLOW_THREADS
 
-	if (!PyArg_ParseTuple(args, "O", &profile)) {
+	if(hTransform==NULL) {
 		Py_INCREF(Py_None);
 		return Py_None;
 	}
 
-	buffer=malloc(BUFFER_SIZE);
-	hProfile = (cmsHPROFILE) PyCObject_AsVoidPtr(profile);
+	statBuild(start, inMode, outMode, (int) intentList[count - 1], flags, 0);
 
-	cmsGetProfileInfoASCII(hProfile,
+	return newBuiltTransform(hTransform, flags);
+}
+
+/* Gamut check transforms convert input pixels into Lab and put alarm
+ * color on pixels which are out of target profile gamut. The alarm is
+ * Lab (100, -128, -128) which no in-gamut color produces. Alarm codes
+ * are set in private context, so lcms global alarm codes are kept.
+ */
+static PyObject *
+pycms_BuildGamutCheckTransform (PyObject *self, PyObject *args) {
+
+	cmsUInt32Number inMode;
+	cmsUInt32Number outMode;
+	int renderingIntent;
+	int inFlags;
+	cmsUInt32Number flags;
+	PyObject *inputProfile;
+	PyObject *targetProfile;
+	PyObject *result;
+	cmsUInt16Number alarm[cmsMAXCHANNELS] = {0};
+	cmsContext context;
+	cmsHPROFILE hInputProfile, hTargetProfile, hLabProfile;
+	cmsHTRANSFORM hTransform = NULL;
+	double start;
+
+	if (!PyArg_ParseTuple(args, "OIOii", &inputProfile, &inMode, &targetProfile,
+			&renderingIntent, &inFlags)
+			|| !Profile_Check(inputProfile) || !Profile_Check(targetProfile)) {
+		PyErr_Clear();
+		Py_INCREF(Py_None);
+		return Py_None;
+	}
+
+	hInputProfile = PROFILE_HANDLE(inputProfile);
+	hTargetProfile = PROFILE_HANDLE(targetProfile);
+	flags = (cmsUInt32Number) inFlags | cmsFLAGS_GAMUTCHECK;
+	/* float inputs are packed into 16-bit Lab too, so alarm
+	 * color is compared exactly */
+	outMode = TYPE_Lab_16;
+
+	context = cmsCreateContext(NULL, NULL);
+	if(context==NULL) {
+		Py_INCREF(Py_None);
+		return Py_None;
+	}
+	alarm[0] = 0xFFFF;
+	cmsSetAlarmCodesTHR(context, alarm);
+
+	start = (stats.enabled || stats.buildHook) ? getTime() : 0.0;
+
+	BUILD_BEGIN_ALLOW_THREADS
+	hLabProfile = cmsCreateLab4ProfileTHR(context, NULL);
+	if(hLabProfile!=NULL){
+		hTransform = cmsCreateProofingTransformTHR(context, hInputProfile, inMode,
+				hLabProfile, outMode, hTargetProfile, renderingIntent,
+				INTENT_RELATIVE_COLORIMETRIC, flags);
+		cmsCloseProfile(hLabProfile);
+	}
+	BUILD_END_ALLOW_THREADS
+
+	if(hTransform==NULL) {
+		cmsDeleteContext(context);
+		Py_INCREF(Py_None);
+		return Py_None;
+	}
+
+	statBuild(start, inMode, outMode, renderingIntent, flags, 1);
+
+	result = newTransformObject(hTransform);
+	if(result==NULL || result==Py_None){
+		cmsDeleteContext(context);
+		return result;
+	}
+
+	((TransformObject *) result)->context = context;
+	((TransformObject *) result)->gamutCheck = 1;
+	return result;
+}
+
+/* Looks up pixel in transform color cache. Missed pixels are transformed
+ * and stored into the cache evicting previous slot owner. Is called
+ * with GIL held, so cache doesn't require locking.
+ */
+static void
+memoTransform (cmsHTRANSFORM hTransform, ColorMemo *memo, void *inbuf, void *outbuf) {
+
+	unsigned char *slot;
+
+	slot = memo->slots + (memoHash(inbuf, memo->inSize) & (memo->capacity - 1)) * memo->slotSize;
+
+	if(slot[0] && memcmp(slot + 1, inbuf, memo->inSize)==0){
+		memcpy(outbuf, slot + 1 + memo->inSize, memo->outSize);
+		memo->hits++;
+		return;
+	}
+
+	cmsDoTransform(hTransform, inbuf, outbuf, 1);
+	memo->misses++;
+
+	if(slot[0]) memo->evictions++;
+	else memo->size++;
+
+	slot[0] = 1;
+	memcpy(slot + 1, inbuf, memo->inSize);
+	memcpy(slot + 1 + memo->inSize, outbuf, memo->outSize);
+}
+
+/* Stores Python number as sample i of scratch pixel. Integer samples
+ * are clipped to sample range.
+ */
+static int
+packSample (void *buf, int type, int i, PyObject *value) {
+
+	long lvalue;
+	double dvalue;
+
+	if(type==SAMPLE_FLOAT || type==SAMPLE_DOUBLE){
+		dvalue = PyFloat_AsDouble(value);
+		if(dvalue==-1.0 && PyErr_Occurred()) return -1;
+		if(type==SAMPLE_FLOAT) ((cmsFloat32Number *) buf)[i] = (cmsFloat32Number) dvalue;
+		else ((cmsFloat64Number *) buf)[i] = dvalue;
+		return 0;
+	}
+
+	lvalue = PyInt_AsLong(value);
+	if(lvalue==-1 && PyErr_Occurred()) return -1;
+	if(lvalue < 0) lvalue = 0;
+
+	if(type==SAMPLE_BYTE){
+		((cmsUInt8Number *) buf)[i] = (cmsUInt8Number) (lvalue > 0xFF ? 0xFF : lvalue);
+	}else{
+		if(lvalue > 0xFFFF) lvalue = 0xFFFF;
+		if(type==SAMPLE_WORD_SE) lvalue = ((lvalue & 0xFF) << 8) | (lvalue >> 8);
+		((cmsUInt16Number *) buf)[i] = (cmsUInt16Number) lvalue;
+	}
+	return 0;
+}
+
+/* Returns sample i of scratch pixel as Python number. Samples
+ * outside of the pixel are returned as zeros.
+ */
+static PyObject *
+unpackSample (void *buf, int type, int i, int count) {
+
+	cmsUInt16Number word;
+
+	if(type==SAMPLE_FLOAT || type==SAMPLE_DOUBLE){
+		if(i >= count) return PyFloat_FromDouble(0.0);
+		if(type==SAMPLE_FLOAT) return PyFloat_FromDouble(((cmsFloat32Number *) buf)[i]);
+		return PyFloat_FromDouble(((cmsFloat64Number *) buf)[i]);
+	}
+
+	if(i >= count) return PyInt_FromLong(0);
+	if(type==SAMPLE_BYTE) return PyInt_FromLong(((cmsUInt8Number *) buf)[i]);
+	word = ((cmsUInt16Number *) buf)[i];
+	if(type==SAMPLE_WORD_SE) word = (cmsUInt16Number) ((word << 8) | (word >> 8));
+	return PyInt_FromLong(word);
+}
+
+/* Transforms single pixel of channel values from args tuple starting
+ * from first item. Missing channels are zeros, extra values are ignored.
+ * Arguments are unpacked right from the tuple, single pixel calls are
+ * too short for generic argument parsing.
+ */
+static int
+transformArgs (TransformObject *self, PyObject *args, Py_ssize_t first) {
+
+	Py_ssize_t nargs = PyTuple_GET_SIZE(args) - first;
+	double start;
+	int i;
+
+	if(self->inType==SAMPLE_NONE || self->outType==SAMPLE_NONE){
+		PyErr_SetString(PyExc_ValueError, "pixel format is not supported by single pixel transform");
+		return -1;
+	}
+
+	if(nargs > cmsMAXCHANNELS){
+		PyErr_SetString(PyExc_TypeError, "too many channel values");
+		return -1;
+	}
+
+	/* may release GIL, so scratch pixel is filled after it */
+	acquireTransform(self, 1);
+
+	if(nargs < self->inSamples) memset(self->inbuf, 0, self->inSize);
+
+	for(i=0; i<self->inSamples && i<nargs; i++){
+		if(packSample(self->inbuf, self->inType, i, PyTuple_GET_ITEM(args, first + i)) < 0){
+			return -1;
+		}
+	}
+
+	start = statStart();
+
+	if(self->memo!=NULL){
+		memoTransform(self->hTransform, self->memo, self->inbuf, self->outbuf);
+	}else{
+		cmsDoTransform(self->hTransform, self->inbuf, self->outbuf, 1);
+	}
+
+	statTransform(self->hTransform, 1, start);
+	return 0;
+}
+
+static PyObject *
+transformApply (TransformObject *self, PyObject *args) {
+
+	PyObject *result, *item;
+	int i;
+
+	if(transformArgs(self, args, 0) < 0) return NULL;
+
+	result = PyTuple_New(self->outSamples);
+	if(result==NULL) return NULL;
+
+	for(i=0; i<self->outSamples; i++){
+		item = unpackSample(self->outbuf, self->outType, i, self->outSamples);
+		if(item==NULL){
+			Py_DECREF(result);
+			return NULL;
+		}
+		PyTuple_SET_ITEM(result, i, item);
+	}
+	return result;
+}
+
+static PyObject *
+transformApplyInto (TransformObject *self, PyObject *args) {
+
+	PyObject *out, *item;
+	int i;
+
+	if(PyTuple_GET_SIZE(args) < 1){
+		PyErr_SetString(PyExc_TypeError, "apply_into() requires output list");
+		return NULL;
+	}
+
+	out = PyTuple_GET_ITEM(args, 0);
+	if(!PyList_Check(out) || PyList_GET_SIZE(out) < 4){
+		PyErr_SetString(PyExc_TypeError, "output should be a list of at least 4 items");
+		return NULL;
+	}
+
+	if(transformArgs(self, args, 1) < 0) return NULL;
+
+	for(i=0; i<4; i++){
+		item = unpackSample(self->outbuf, self->outType, i, self->outSamples);
+		if(item==NULL) return NULL;
+		PyList_SetItem(out, i, item);
+	}
+
+	Py_INCREF(Py_None);
+	return Py_None;
+}
+
+static PyMethodDef transformMethods[] = {
+	{"apply", (PyCFunction) transformApply, METH_VARARGS,
+		"apply(c0, c1, c2, c3) -> tuple\n\n"
+		"Transforms single pixel of channel values. Returns tuple of\n"
+		"output samples. Integer or float samples are used according\n"
+		"to transform pixel formats."},
+	{"apply_into", (PyCFunction) transformApplyInto, METH_VARARGS,
+		"apply_into(out, c0, c1, c2, c3)\n\n"
+		"Same as apply() but stores first four output samples into\n"
+		"out list, samples missing in output pixel are zeros."},
+	{NULL, NULL}
+};
+
+static PyObject *
+transformGetInputFormat (TransformObject *self, void *closure) {
+	return PyInt_FromLong((long) self->inFormat);
+}
+
+static PyObject *
+transformGetOutputFormat (TransformObject *self, void *closure) {
+	return PyInt_FromLong((long) self->outFormat);
+}
+
+static PyGetSetDef transformGetSet[] = {
+	{"input_format", (getter) transformGetInputFormat, NULL, "lcms input pixel format"},
+	{"output_format", (getter) transformGetOutputFormat, NULL, "lcms output pixel format"},
+	{NULL}
+};
+
+static PyTypeObject TransformType = {
+	PyVarObject_HEAD_INIT(NULL, 0)
+	"_lcms2.Transform",				/* tp_name */
+	sizeof(TransformObject),		/* tp_basicsize */
+	0,								/* tp_itemsize */
+	(destructor) transformDealloc,	/* tp_dealloc */
+	0,								/* tp_print */
+	0,								/* tp_getattr */
+	0,								/* tp_setattr */
+	0,								/* tp_compare */
+	0,								/* tp_repr */
+	0,								/* tp_as_number */
+	0,								/* tp_as_sequence */
+	0,								/* tp_as_mapping */
+	0,								/* tp_hash */
+	0,								/* tp_call */
+	0,								/* tp_str */
+	0,								/* tp_getattro */
+	0,								/* tp_setattro */
+	0,								/* tp_as_buffer */
+	Py_TPFLAGS_DEFAULT,				/* tp_flags */
+	"lcms2 transform handle",		/* tp_doc */
+	0,								/* tp_traverse */
+	0,								/* tp_clear */
+	0,								/* tp_richcompare */
+	0,								/* tp_weaklistoffset */
+	0,								/* tp_iter */
+	0,								/* tp_iternext */
+	transformMethods,				/* tp_methods */
+	0,								/* tp_members */
+	transformGetSet,				/* tp_getset */
+};
+
+static PyObject *
+pycms_EnableColorCache (PyObject *self, PyObject *args) {
+
+	PyObject *transform;
+	Py_ssize_t capacity, size;
+	TransformObject *obj;
+	ColorMemo *memo;
+
+	if (!PyArg_ParseTuple(args, "On", &transform, &capacity)
+			|| !Transform_Check(transform) || capacity < 1 || capacity > 0x1000000) {
+		PyErr_Clear();
+		Py_INCREF(Py_None);
+		return Py_None;
+	}
+
+	obj = (TransformObject *) transform;
+
+	/* Capacity is rounded up to power of two for slot masking */
+	size = 1;
+	while(size < capacity) size <<= 1;
+
+	memo = (ColorMemo *) malloc(sizeof(ColorMemo));
+	if(memo==NULL) return PyErr_NoMemory();
+
+	memo->capacity = size;
+	memo->inSize = obj->inSize;
+	memo->outSize = obj->outSize;
+	memo->slotSize = 1 + memo->inSize + memo->outSize;
+	memo->size = 0;
+	memo->hits = 0;
+	memo->misses = 0;
+	memo->evictions = 0;
+	memo->slots = (unsigned char *) calloc(size, memo->slotSize);
+
+	if(memo->slots==NULL){
+		free(memo);
+		return PyErr_NoMemory();
+	}
+
+	freeColorMemo(obj->memo);
+	obj->memo = memo;
+
+	return Py_BuildValue("n", size);
+}
+
+static PyObject *
+pycms_DisableColorCache (PyObject *self, PyObject *args) {
+
+	PyObject *transform;
+
+	if (!PyArg_ParseTuple(args, "O", &transform) || !Transform_Check(transform)) {
+		PyErr_Clear();
+		Py_INCREF(Py_None);
+		return Py_None;
+	}
+
+	freeColorMemo(((TransformObject *) transform)->memo);
+	((TransformObject *) transform)->memo = NULL;
+
+	return Py_BuildValue("i", 1);
+}
+
+static PyObject *
+pycms_GetColorCacheStats (PyObject *self, PyObject *args) {
+
+	PyObject *transform;
+	ColorMemo *memo;
+
+	if (!PyArg_ParseTuple(args, "O", &transform) || !Transform_Check(transform)
+			|| (memo = ((TransformObject *) transform)->memo)==NULL) {
+		PyErr_Clear();
+		Py_INCREF(Py_None);
+		return Py_None;
+	}
+
+	return Py_BuildValue("{s:n,s:n,s:k,s:k,s:k}",
+			"capacity", memo->capacity, "size", memo->size,
+			"hits", memo->hits, "misses", memo->misses,
+			"evictions", memo->evictions);
+}
+
+static PyObject *
+pycms_GetPixelSizes (PyObject *self, PyObject *args) {
+
+	PyObject *transform;
+
+	if (!PyArg_ParseTuple(args, "O", &transform) || !Transform_Check(transform)) {
+		PyErr_Clear();
+		Py_INCREF(Py_None);
+		return Py_None;
+	}
+
+	return Py_BuildValue("(nn)", ((TransformObject *) transform)->inSize,
+			((TransformObject *) transform)->outSize);
+}
+
+static PyObject *
+pycms_TransformBuffer (PyObject *self, PyObject *args) {
+
+	PyObject *transform, *inObj, *outObj;
+	Py_ssize_t npixels, inSize, outSize;
+	Py_buffer inView, outView;
+	double start;
+	cmsHTRANSFORM hTransform;
+
+	if (!PyArg_ParseTuple(args, "OOOn", &transform, &inObj, &outObj, &npixels)
+			|| !Transform_Check(transform) || npixels < 0) {
+		PyErr_Clear();
+		Py_INCREF(Py_None);
+		return Py_None;
+	}
+
+	inSize = ((TransformObject *) transform)->inSize;
+	outSize = ((TransformObject *) transform)->outSize;
+
+	if(getBuffer(inObj, &inView, 0) < 0){
+		PyErr_Clear();
+		Py_INCREF(Py_None);
+		return Py_None;
+	}
+
+	if(getBuffer(outObj, &outView, 1) < 0){
+		PyErr_Clear();
+		PyBuffer_Release(&inView);
+		Py_INCREF(Py_None);
+		return Py_None;
+	}
+
+	if(npixels > inView.len / inSize || npixels > outView.len / outSize){
+		PyBuffer_Release(&inView);
+		PyBuffer_Release(&outView);
+		Py_INCREF(Py_None);
+		return Py_None;
+	}
+
+	/* rejected calls are not counted by adaptive transforms */
+	hTransform = acquireTransform((TransformObject *) transform, npixels);
+	start = statStart();
+
+	Py_BEGIN_ALLOW_THREADS
+	doTransform(hTransform, inView.buf, outView.buf, npixels, inSize, outSize);
+	Py_END_ALLOW_THREADS
+
+	statTransform(hTransform, npixels, start);
+
+	PyBuffer_Release(&inView);
+	PyBuffer_Release(&outView);
+
+	return Py_BuildValue("n", npixels);
+}
+
+/* Copies palette pixels addressed by 8-bit or native 16-bit indices
+ * into output buffer. Index buffer may be unaligned, so 16-bit indices
+ * are copied out byte-wise. Expanding stops at the first index beyond
+ * palette entries. Returns number of expanded pixels. Should be called
+ * with released GIL.
+ */
+static Py_ssize_t
+expandPalette (const char *palette, Py_ssize_t entries, Py_ssize_t pixelSize,
+		const void *indices, int indexSize, char *outbuf, Py_ssize_t npixels) {
+
+	const cmsUInt8Number *bytes = (const cmsUInt8Number *) indices;
+	cmsUInt16Number word;
+	Py_ssize_t i;
+
+	if(indexSize==1){
+		if(pixelSize==4){
+			for(i=0; i<npixels; i++){
+				if(bytes[i] >= entries) break;
+				memcpy(outbuf + i * 4, palette + bytes[i] * 4, 4);
+			}
+		}else{
+			for(i=0; i<npixels; i++, outbuf += pixelSize){
+				if(bytes[i] >= entries) break;
+				memcpy(outbuf, palette + bytes[i] * pixelSize, pixelSize);
+			}
+		}
+	}else{
+		for(i=0; i<npixels; i++, outbuf += pixelSize){
+			memcpy(&word, bytes + i * 2, 2);
+			if(word >= entries) break;
+			memcpy(outbuf, palette + word * pixelSize, pixelSize);
+		}
+	}
+	return i;
+}
+
+/* Transforms palette entries only and expands indices into output
+ * pixels. Without indices the converted palette is returned as string.
+ * Output buffer is allocated as bytearray if out is None.
+ */
+static PyObject *
+pycms_TransformPalette (PyObject *self, PyObject *args) {
+
+	PyObject *transform, *palObj, *indObj, *outObj, *result = NULL;
+	Py_buffer palView, indView, outView;
+	Py_ssize_t entries, npixels, inSize, outSize, expanded;
+	int indexSize;
+	char *converted;
+	double start;
+	cmsHTRANSFORM hTransform;
+
+	if (!PyArg_ParseTuple(args, "OOOiO", &transform, &palObj, &indObj, &indexSize, &outObj)
+			|| !Transform_Check(transform) || (indexSize!=1 && indexSize!=2)
+			|| T_PLANAR(((TransformObject *) transform)->inFormat)
+			|| T_PLANAR(((TransformObject *) transform)->outFormat)) {
+		PyErr_Clear();
+		Py_INCREF(Py_None);
+		return Py_None;
+	}
+
+	inSize = ((TransformObject *) transform)->inSize;
+	outSize = ((TransformObject *) transform)->outSize;
+
+	if(getBuffer(palObj, &palView, 0) < 0){
+		PyErr_Clear();
+		Py_INCREF(Py_None);
+		return Py_None;
+	}
+
+	entries = palView.len / inSize;
+	if(entries==0 || entries > (indexSize==1 ? 0x100 : 0x10000)){
+		PyBuffer_Release(&palView);
+		Py_INCREF(Py_None);
+		return Py_None;
+	}
+
+	converted = (char *) malloc(entries * outSize);
+	if(converted==NULL){
+		PyBuffer_Release(&palView);
+		return PyErr_NoMemory();
+	}
+
+	hTransform = acquireTransform((TransformObject *) transform, entries);
+	start = statStart();
+
+	Py_BEGIN_ALLOW_THREADS
+	cmsDoTransform(hTransform, palView.buf, converted, (cmsUInt32Number) entries);
+	Py_END_ALLOW_THREADS
+
+	statTransform(hTransform, entries, start);
+	PyBuffer_Release(&palView);
+
+	if(indObj==Py_None){
+		result = PyString_FromStringAndSize(converted, entries * outSize);
+		free(converted);
+		return result;
+	}
+
+	if(getBuffer(indObj, &indView, 0) < 0){
+		PyErr_Clear();
+		free(converted);
+		Py_INCREF(Py_None);
+		return Py_None;
+	}
+	npixels = indView.len / indexSize;
+
+	if(indView.len % indexSize || npixels > PY_SSIZE_T_MAX / outSize){
+		goto done;
+	}
+
+	if(outObj==Py_None){
+		outObj = PyByteArray_FromStringAndSize(NULL, npixels * outSize);
+		if(outObj==NULL){
+			free(converted);
+			PyBuffer_Release(&indView);
+			return NULL;
+		}
+	}else{
+		Py_INCREF(outObj);
+	}
+
+	if(getBuffer(outObj, &outView, 1) < 0){
+		PyErr_Clear();
+		Py_DECREF(outObj);
+		goto done;
+	}
+
+	if(outView.len / outSize < npixels){
+		PyBuffer_Release(&outView);
+		Py_DECREF(outObj);
+		goto done;
+	}
+
+	/* indices are checked while expanding, output is partially
+	 * written if the image refers to missing palette entries */
+	Py_BEGIN_ALLOW_THREADS
+	expanded = expandPalette(converted, entries, outSize, indView.buf,
+							indexSize, outView.buf, npixels);
+	Py_END_ALLOW_THREADS
+
+	PyBuffer_Release(&outView);
+	if(expanded < npixels){
+		Py_DECREF(outObj);
+		goto done;
+	}
+	result = outObj;
+
+done:
+	free(converted);
+	PyBuffer_Release(&indView);
+	if(result==NULL){
+		Py_INCREF(Py_None);
+		return Py_None;
+	}
+	return result;
+}
+
+#define GAMUT_CHUNK 4096
+
+/* Transforms pixels by gamut check transform and marks pixels with
+ * alarm color in the mask. Packed mask keeps 8 pixels per byte, most
+ * significant bit first, otherwise the mask keeps 0 or 1 per pixel.
+ * Returns number of out-of-gamut pixels. Should be called with
+ * released GIL.
+ */
+static Py_ssize_t
+gamutMask (cmsHTRANSFORM hTransform, const char *inbuf, Py_ssize_t inSize,
+		Py_ssize_t npixels, unsigned char *mask, int packed, cmsUInt16Number *lab) {
+
+	Py_ssize_t done, chunk, i, count = 0;
+	int alarm;
+
+	if(packed) memset(mask, 0, (npixels + 7) / 8);
+
+	for(done=0; done<npixels; done+=chunk){
+		chunk = npixels - done > GAMUT_CHUNK ? GAMUT_CHUNK : npixels - done;
+		cmsDoTransform(hTransform, inbuf + done * inSize, lab, (cmsUInt32Number) chunk);
+
+		for(i=0; i<chunk; i++){
+			alarm = lab[i * 3]==0xFFFF && lab[i * 3 + 1]==0 && lab[i * 3 + 2]==0;
+			if(packed){
+				if(alarm) mask[(done + i) >> 3] |= 0x80 >> ((done + i) & 7);
+			}else{
+				mask[done + i] = (unsigned char) alarm;
+			}
+			count += alarm;
+		}
+	}
+	return count;
+}
+
+static PyObject *
+pycms_GamutCheck (PyObject *self, PyObject *args) {
+
+	PyObject *transform, *inObj, *maskObj;
+	TransformObject *obj;
+	Py_ssize_t npixels, maskSize, count;
+	Py_buffer inView, maskView;
+	int packed;
+	cmsUInt16Number *lab;
+	double start;
+
+	if (!PyArg_ParseTuple(args, "OOnOi", &transform, &inObj, &npixels, &maskObj, &packed)
+			|| !Transform_Check(transform) || npixels < 0
+			|| !((TransformObject *) transform)->gamutCheck
+			|| T_PLANAR(((TransformObject *) transform)->inFormat)) {
+		PyErr_Clear();
+		Py_INCREF(Py_None);
+		return Py_None;
+	}
+
+	obj = (TransformObject *) transform;
+	maskSize = packed ? npixels / 8 + (npixels % 8 ? 1 : 0) : npixels;
+
+	if(getBuffer(inObj, &inView, 0) < 0){
+		PyErr_Clear();
+		Py_INCREF(Py_None);
+		return Py_None;
+	}
+
+	if(getBuffer(maskObj, &maskView, 1) < 0){
+		PyErr_Clear();
+		PyBuffer_Release(&inView);
+		Py_INCREF(Py_None);
+		return Py_None;
+	}
+
+	if(npixels > inView.len / obj->inSize || maskSize > maskView.len){
+		PyBuffer_Release(&inView);
+		PyBuffer_Release(&maskView);
+		Py_INCREF(Py_None);
+		return Py_None;
+	}
+
+	lab = (cmsUInt16Number *) malloc(GAMUT_CHUNK * 3 * sizeof(cmsUInt16Number));
+	if(lab==NULL){
+		PyBuffer_Release(&inView);
+		PyBuffer_Release(&maskView);
+		return PyErr_NoMemory();
+	}
+
+	start = statStart();
+
+	Py_BEGIN_ALLOW_THREADS
+	count = gamutMask(obj->hTransform, inView.buf, obj->inSize, npixels,
+			maskView.buf, packed, lab);
+	Py_END_ALLOW_THREADS
+
+	statTransform(obj->hTransform, npixels, start);
+
+	free(lab);
+	PyBuffer_Release(&inView);
+	PyBuffer_Release(&maskView);
+
+	return Py_BuildValue("n", count);
+}
+
+#define MAX_FANOUT_TARGETS 64
+
+/* Transforms the same pixels by several transforms of equal input format
+ * tile by tile, so each input tile is read from memory once and stays
+ * in cache for all targets. Optional gamut check transforms of targets
+ * count out-of-gamut pixels in the same pass. Returns list of counts,
+ * None items for targets without gamut check.
+ */
+static PyObject *
+pycms_TransformFanout (PyObject *self, PyObject *args) {
+
+	PyObject *transforms, *inObj, *outObjs, *gamuts, *item, *result = NULL;
+	Py_ssize_t npixels, tilePixels, count, done, chunk, i, k;
+	Py_ssize_t inSize, outSizes[MAX_FANOUT_TARGETS], counts[MAX_FANOUT_TARGETS];
+	cmsHTRANSFORM handles[MAX_FANOUT_TARGETS], checks[MAX_FANOUT_TARGETS];
+	Py_buffer inView, outViews[MAX_FANOUT_TARGETS];
+	cmsUInt32Number inFormat;
+	cmsUInt16Number *lab = NULL;
+	TransformObject *obj;
+	char *inbuf;
+	double start;
+	int ok = 1, checked = 0;
+
+	if (!PyArg_ParseTuple(args, "OOOnnO", &transforms, &inObj, &outObjs,
+			&npixels, &tilePixels, &gamuts)
+			|| !PyTuple_Check(transforms) || !PyTuple_Check(outObjs)
+			|| !PyTuple_Check(gamuts) || npixels < 0 || tilePixels <= 0) {
+		PyErr_Clear();
+		Py_INCREF(Py_None);
+		return Py_None;
+	}
+
+	count = PyTuple_GET_SIZE(transforms);
+	if(count < 1 || count > MAX_FANOUT_TARGETS || PyTuple_GET_SIZE(outObjs) != count
+			|| PyTuple_GET_SIZE(gamuts) != count){
+		Py_INCREF(Py_None);
+		return Py_None;
+	}
+
+	/* all transforms should read the same chunky input pixels */
+	inFormat = 0;
+	for(k=0; k<count; k++){
+		item = PyTuple_GET_ITEM(transforms, k);
+		if(!Transform_Check(item)){
+			Py_INCREF(Py_None);
+			return Py_None;
+		}
+		obj = (TransformObject *) item;
+		if(k==0) inFormat = obj->inFormat;
+		if(obj->inFormat != inFormat || T_PLANAR(obj->inFormat) || T_PLANAR(obj->outFormat)){
+			Py_INCREF(Py_None);
+			return Py_None;
+		}
+		outSizes[k] = obj->outSize;
+		checks[k] = NULL;
+		item = PyTuple_GET_ITEM(gamuts, k);
+		if(item != Py_None){
+			if(!Transform_Check(item) || !((TransformObject *) item)->gamutCheck
+					|| ((TransformObject *) item)->inFormat != inFormat){
+				Py_INCREF(Py_None);
+				return Py_None;
+			}
+			checks[k] = TRANSFORM_HANDLE(item);
+			checked = 1;
+		}
+		counts[k] = 0;
+	}
+	inSize = ((TransformObject *) PyTuple_GET_ITEM(transforms, 0))->inSize;
+
+	if(getBuffer(inObj, &inView, 0) < 0){
+		PyErr_Clear();
+		Py_INCREF(Py_None);
+		return Py_None;
+	}
+
+	for(k=0; k<count; k++){
+		if(getBuffer(PyTuple_GET_ITEM(outObjs, k), &outViews[k], 1) < 0){
+			PyErr_Clear();
+			ok = 0;
+			break;
+		}
+		if(npixels > outViews[k].len / outSizes[k]){
+			k++;
+			ok = 0;
+			break;
+		}
+	}
+
+	if(!ok || npixels > inView.len / inSize){
+		for(i=0; i<k; i++) PyBuffer_Release(&outViews[i]);
+		PyBuffer_Release(&inView);
+		Py_INCREF(Py_None);
+		return Py_None;
+	}
+
+	if(tilePixels > npixels) tilePixels = npixels ? npixels : 1;
+	if(checked){
+		lab = (cmsUInt16Number *) malloc(tilePixels * 3 * sizeof(cmsUInt16Number));
+		if(lab==NULL){
+			for(k=0; k<count; k++) PyBuffer_Release(&outViews[k]);
+			PyBuffer_Release(&inView);
+			return PyErr_NoMemory();
+		}
+	}
+
+	for(k=0; k<count; k++){
+		handles[k] = acquireTransform((TransformObject *) PyTuple_GET_ITEM(transforms, k), npixels);
+	}
+	inbuf = inView.buf;
+	start = statStart();
+
+	Py_BEGIN_ALLOW_THREADS
+	for(done=0; done<npixels; done+=chunk){
+		chunk = npixels - done > tilePixels ? tilePixels : npixels - done;
+		for(k=0; k<count; k++){
+			doTransform(handles[k], inbuf + done * inSize,
+					(char *) outViews[k].buf + done * outSizes[k],
+					chunk, inSize, outSizes[k]);
+			if(checks[k]!=NULL){
+				cmsDoTransform(checks[k], inbuf + done * inSize, lab, (cmsUInt32Number) chunk);
+				for(i=0; i<chunk; i++){
+					counts[k] += lab[i * 3]==0xFFFF && lab[i * 3 + 1]==0 && lab[i * 3 + 2]==0;
+				}
+			}
+		}
+	}
+	Py_END_ALLOW_THREADS
+
+	/* single call, but pixels are accounted by each transform */
+	if(start != 0.0){
+		statTransform(handles[0], npixels, start);
+		for(k=0; k<count; k++){
+			if(k) statPixels(handles[k], npixels);
+			if(checks[k]!=NULL) statPixels(checks[k], npixels);
+		}
+	}
+
+	free(lab);
+	for(k=0; k<count; k++) PyBuffer_Release(&outViews[k]);
+	PyBuffer_Release(&inView);
+
+	result = PyList_New(count);
+	if(result==NULL) return NULL;
+	for(k=0; k<count; k++){
+		if(checks[k]!=NULL){
+			item = PyInt_FromSsize_t(counts[k]);
+			if(item==NULL){
+				Py_DECREF(result);
+				return NULL;
+			}
+		}else{
+			Py_INCREF(Py_None);
+			item = Py_None;
+		}
+		PyList_SET_ITEM(result, k, item);
+	}
+	return result;
+}
+
+static PyObject *
+pycms_GetTransformFormats (PyObject *self, PyObject *args) {
+
+	PyObject *transform;
+
+	if (!PyArg_ParseTuple(args, "O", &transform) || !Transform_Check(transform)) {
+		PyErr_Clear();
+		Py_INCREF(Py_None);
+		return Py_None;
+	}
+
+	return Py_BuildValue("(kk)",
+			(unsigned long) ((TransformObject *) transform)->inFormat,
+			(unsigned long) ((TransformObject *) transform)->outFormat);
+}
+
+/* Returns dictionary of supported mode names and lcms pixel formats.
+ */
+static PyObject *
+pycms_GetFormats (PyObject *self, PyObject *args) {
+
+	PyObject *result, *value;
+	const FormatEntry *entry;
+
+	result = PyDict_New();
+	if(result==NULL) return NULL;
+
+	for(entry=formatTable; entry->name!=NULL; entry++){
+		value = PyInt_FromLong((long) entry->format);
+		if(value==NULL || PyDict_SetItemString(result, entry->name, value) < 0){
+			Py_XDECREF(value);
+			Py_DECREF(result);
+			return NULL;
+		}
+		Py_DECREF(value);
+	}
+
+	return result;
+}
+
+static PyObject *
+pycms_GetFormatInfo (PyObject *self, PyObject *args) {
+
+	unsigned long format;
+	int bytes;
+
+	if (!PyArg_ParseTuple(args, "k", &format)) {
+		PyErr_Clear();
+		Py_INCREF(Py_None);
+		return Py_None;
+	}
+
+	bytes = T_BYTES(format);
+	if(bytes==0) bytes = sizeof(cmsFloat64Number);
+
+	return Py_BuildValue("(iiiii)", T_CHANNELS(format), T_EXTRA(format),
+			bytes, T_FLOAT(format), T_PLANAR(format));
+}
+
+static PyObject *
+pycms_TransformLines (PyObject *self, PyObject *args) {
+
+	PyObject *transform, *inObj, *outObj;
+	Py_ssize_t pixelsPerLine, lineCount, inStride, outStride;
+	Py_ssize_t inSize, outSize, inSpan, outSpan, i;
+	Py_buffer inView, outView;
+	double start;
+	cmsHTRANSFORM hTransform;
+	char *inbuf, *outbuf;
+
+	if (!PyArg_ParseTuple(args, "OOOnnnn", &transform, &inObj, &outObj,
+			&pixelsPerLine, &lineCount, &inStride, &outStride)
+			|| !Transform_Check(transform) || pixelsPerLine < 0 || lineCount < 0) {
+		PyErr_Clear();
+		Py_INCREF(Py_None);
+		return Py_None;
+	}
+
+	inSize = ((TransformObject *) transform)->inSize;
+	outSize = ((TransformObject *) transform)->outSize;
+
+	if(pixelsPerLine > PY_SSIZE_T_MAX / inSize || pixelsPerLine > PY_SSIZE_T_MAX / outSize){
+		Py_INCREF(Py_None);
+		return Py_None;
+	}
+
+	if(getStridedBuffer(inObj, &inView, 0, &inSpan) < 0){
+		PyErr_Clear();
+		Py_INCREF(Py_None);
+		return Py_None;
+	}
+
+	if(getStridedBuffer(outObj, &outView, 1, &outSpan) < 0){
+		PyErr_Clear();
+		PyBuffer_Release(&inView);
+		Py_INCREF(Py_None);
+		return Py_None;
+	}
+
+	if(!checkLines(inSpan, pixelsPerLine * inSize, lineCount, inStride) ||
+			!checkLines(outSpan, pixelsPerLine * outSize, lineCount, outStride)){
+		PyBuffer_Release(&inView);
+		PyBuffer_Release(&outView);
+		Py_INCREF(Py_None);
+		return Py_None;
+	}
+
+	hTransform = acquireTransform((TransformObject *) transform, pixelsPerLine * lineCount);
+	inbuf = inView.buf;
+	outbuf = outView.buf;
+	start = statStart();
+
+	Py_BEGIN_ALLOW_THREADS
+	if(inStride == pixelsPerLine * inSize && outStride == pixelsPerLine * outSize){
+		doTransform(hTransform, inbuf, outbuf, pixelsPerLine * lineCount, inSize, outSize);
+	}else{
+		for(i=0; i<lineCount; i++){
+			doTransform(hTransform, inbuf + i * inStride, outbuf + i * outStride,
+					pixelsPerLine, inSize, outSize);
+		}
+	}
+	Py_END_ALLOW_THREADS
+
+	statTransform(hTransform, pixelsPerLine * lineCount, start);
+
+	PyBuffer_Release(&inView);
+	PyBuffer_Release(&outView);
+
+	return Py_BuildValue("n", lineCount);
+}
+
+/* Transforms lineCount lines using cmsDoTransformLineStride(). Row strides
+ * may differ from line size, so regions of larger images are transformed
+ * in place. For planar formats plane strides are distances between
+ * channel planes, for chunky formats plane strides are ignored.
+ */
+static PyObject *
+pycms_TransformLineStride (PyObject *self, PyObject *args) {
+
+	PyObject *transform, *inObj, *outObj;
+	Py_ssize_t pixelsPerLine, lineCount, inStride, outStride, inPlaneStride, outPlaneStride;
+	Py_ssize_t inSize, outSize, inPlanes, outPlanes, inSpan, outSpan;
+	cmsUInt32Number inFormat, outFormat;
+	Py_buffer inView, outView;
+	double start;
+	cmsHTRANSFORM hTransform;
+	int result = 1;
+
+	if (!PyArg_ParseTuple(args, "OOOnnnnnn", &transform, &inObj, &outObj,
+			&pixelsPerLine, &lineCount, &inStride, &outStride,
+			&inPlaneStride, &outPlaneStride)
+			|| !Transform_Check(transform) || pixelsPerLine < 0 || lineCount < 0
+			|| inStride < 0 || outStride < 0 || inPlaneStride < 0 || outPlaneStride < 0) {
+		PyErr_Clear();
+		Py_INCREF(Py_None);
+		return Py_None;
+	}
+
+	/* lcms accepts 32-bit counts and strides only */
+	if(pixelsPerLine > 0xFFFFFFFFL || lineCount > 0xFFFFFFFFL ||
+			inStride > 0xFFFFFFFFL || outStride > 0xFFFFFFFFL ||
+			inPlaneStride > 0xFFFFFFFFL || outPlaneStride > 0xFFFFFFFFL){
+		Py_INCREF(Py_None);
+		return Py_None;
+	}
+
+	inFormat = ((TransformObject *) transform)->inFormat;
+	outFormat = ((TransformObject *) transform)->outFormat;
+
+	/* planar lines contain single sample per pixel */
+	inPlanes = outPlanes = 1;
+	inSize = getPixelSize(inFormat);
+	outSize = getPixelSize(outFormat);
+	if(T_PLANAR(inFormat)){
+		inPlanes = T_CHANNELS(inFormat) + T_EXTRA(inFormat);
+		inSize /= inPlanes;
+	}
+	if(T_PLANAR(outFormat)){
+		outPlanes = T_CHANNELS(outFormat) + T_EXTRA(outFormat);
+		outSize /= outPlanes;
+	}
+
+	if(pixelsPerLine > PY_SSIZE_T_MAX / inSize || pixelsPerLine > PY_SSIZE_T_MAX / outSize){
+		Py_INCREF(Py_None);
+		return Py_None;
+	}
+
+	if(getStridedBuffer(inObj, &inView, 0, &inSpan) < 0){
+		PyErr_Clear();
+		Py_INCREF(Py_None);
+		return Py_None;
+	}
+
+	if(getStridedBuffer(outObj, &outView, 1, &outSpan) < 0){
+		PyErr_Clear();
+		PyBuffer_Release(&inView);
+		Py_INCREF(Py_None);
+		return Py_None;
+	}
+
+	if(!checkPlanes(inSpan, pixelsPerLine * inSize, lineCount, inStride, inPlanes, inPlaneStride) ||
+			!checkPlanes(outSpan, pixelsPerLine * outSize, lineCount, outStride, outPlanes, outPlaneStride)){
+		PyBuffer_Release(&inView);
+		PyBuffer_Release(&outView);
+		Py_INCREF(Py_None);
+		return Py_None;
+	}
+
+	hTransform = acquireTransform((TransformObject *) transform, pixelsPerLine * lineCount);
+	start = statStart();
+
+#if LCMS_VERSION >= 2080
+	Py_BEGIN_ALLOW_THREADS
+	cmsDoTransformLineStride(hTransform, inView.buf, outView.buf,
+			(cmsUInt32Number) pixelsPerLine, (cmsUInt32Number) lineCount,
+			(cmsUInt32Number) inStride, (cmsUInt32Number) outStride,
+			(cmsUInt32Number) inPlaneStride, (cmsUInt32Number) outPlaneStride);
+	Py_END_ALLOW_THREADS
+#else
+	/* older lcms versions support planar lines with packed planes only */
+	if(inPlanes > 1 || outPlanes > 1){
+		result = 0;
+	}else{
+		Py_ssize_t i;
+		char *inbuf = inView.buf;
+		char *outbuf = outView.buf;
+
+		Py_BEGIN_ALLOW_THREADS
+		for(i=0; i<lineCount; i++){
+			doTransform(hTransform, inbuf + i * inStride, outbuf + i * outStride,
+					pixelsPerLine, inSize, outSize);
+		}
+		Py_END_ALLOW_THREADS
+	}
+#endif
+
+	PyBuffer_Release(&inView);
+	PyBuffer_Release(&outView);
+
+	if(!result){
+		Py_INCREF(Py_None);
+		return Py_None;
+	}
+
+	statTransform(hTransform, pixelsPerLine * lineCount, start);
+
+	return Py_BuildValue("n", lineCount);
+}
+
+/* Pixel sizes of PIL image storage by image mode */
+static const struct {
+	const char *mode;
+	Py_ssize_t pixelSize;
+} imageModes[] = {
+	{"1", 1}, {"L", 1}, {"P", 1},
+	{"I;16", 2}, {"I;16L", 2}, {"I;16B", 2}, {"I;16N", 2},
+	{"I", 4}, {"F", 4}, {"LA", 4}, {"La", 4}, {"PA", 4},
+	{"RGB", 4}, {"RGBA", 4}, {"RGBX", 4}, {"RGBa", 4},
+	{"CMYK", 4}, {"YCbCr", 4}, {"LAB", 4}, {"HSV", 4},
+	{NULL, 0}
+};
+
+/* Reads size, pixel size and array of row pointers of PIL image core
+ * object (im.im). Row pointers are taken from "image" field exposed by
+ * unsafe_ptrs, pixel size is defined by image mode, so images of unknown
+ * modes are rejected. Returns 0 on failure.
+ */
+static int
+getImageRows (PyObject *core, Py_ssize_t *width, Py_ssize_t *height,
+		Py_ssize_t *pixelSize, char ***rows) {
+
+	PyObject *size, *mode, *ptrs, *item;
+	Py_ssize_t i, addr = 0;
+	int ret = 0;
+
+	size = PyObject_GetAttrString(core, "size");
+	mode = PyObject_GetAttrString(core, "mode");
+	ptrs = PyObject_GetAttrString(core, "unsafe_ptrs");
+
+	if(size==NULL || mode==NULL || ptrs==NULL || !PyString_Check(mode)
+			|| !PyArg_ParseTuple(size, "nn", width, height)
+			|| !PyTuple_Check(ptrs)){
+		goto done;
+	}
+
+	*pixelSize = 0;
+	for(i=0; imageModes[i].mode!=NULL; i++){
+		if(strcmp(PyString_AS_STRING(mode), imageModes[i].mode)==0){
+			*pixelSize = imageModes[i].pixelSize;
+		}
+	}
+
+	for(i=0; i<PyTuple_GET_SIZE(ptrs); i++){
+		item = PyTuple_GET_ITEM(ptrs, i);
+		if(PyTuple_Check(item) && PyTuple_GET_SIZE(item)==2
+				&& PyString_Check(PyTuple_GET_ITEM(item, 0))
+				&& strcmp(PyString_AS_STRING(PyTuple_GET_ITEM(item, 0)), "image")==0){
+			addr = PyNumber_AsSsize_t(PyTuple_GET_ITEM(item, 1), NULL);
+		}
+	}
+
+	*rows = (char **) addr;
+	ret = *pixelSize && addr && *width >= 0 && *height >= 0;
+
+done:
+	Py_XDECREF(size);
+	Py_XDECREF(mode);
+	Py_XDECREF(ptrs);
+	return ret;
+}
+
+/* Transforms rows of PIL image memory. Images are passed as PIL core
+ * objects, their rows are addressed by arrays of row pointers, so images
+ * stored in several memory blocks are supported. Provided sizes are
+ * checked against image cores before rows are touched. Pixel sizes are
+ * sizes of image pixels, they may exceed sizes of transform pixels
+ * (i.e. packed RGB transform of 4-byte PIL "RGB" pixels), such rows
+ * are packed into and unpacked from temporary rows and padding bytes
+ * of image pixels are not changed.
+ */
+static PyObject *
+pycms_TransformImage (PyObject *self, PyObject *args) {
+
+	PyObject *transform, *inCore, *outCore;
+	Py_ssize_t width, height, inPixel, outPixel;
+	Py_ssize_t inWidth, inHeight, inImagePixel, outWidth, outHeight, outImagePixel;
+	Py_ssize_t inSize, outSize, i, j;
+	char **inRows, **outRows;
+	char *inTemp = NULL, *outTemp = NULL, *inbuf, *outbuf;
+	int packIn, packOut;
+	double start;
+	cmsHTRANSFORM hTransform;
+
+	if (!PyArg_ParseTuple(args, "OOOnnnn", &transform, &inCore, &outCore,
+			&width, &height, &inPixel, &outPixel)
+			|| !Transform_Check(transform)
+			|| !getImageRows(inCore, &inWidth, &inHeight, &inImagePixel, &inRows)
+			|| !getImageRows(outCore, &outWidth, &outHeight, &outImagePixel, &outRows)) {
+		PyErr_Clear();
+		Py_INCREF(Py_None);
+		return Py_None;
+	}
+
+	inSize = ((TransformObject *) transform)->inSize;
+	outSize = ((TransformObject *) transform)->outSize;
+
+	if(width != inWidth || width != outWidth || height != inHeight
+			|| height != outHeight || inPixel != inImagePixel
+			|| outPixel != outImagePixel || inPixel < inSize || outPixel < outSize
+			|| width > PY_SSIZE_T_MAX / inPixel || width > PY_SSIZE_T_MAX / outPixel){
+		Py_INCREF(Py_None);
+		return Py_None;
+	}
+
+	/* rows of the same image are transformed in place through
+	 * temporary row when pixel sizes of transform differ */
+	packIn = inPixel != inSize || (inRows==outRows && inSize != outSize);
+	packOut = outPixel != outSize;
+	if(packIn) inTemp = (char *) malloc(width * inSize + 1);
+	if(packOut) outTemp = (char *) malloc(width * outSize + 1);
+	if((packIn && inTemp==NULL) || (packOut && outTemp==NULL)){
+		free(inTemp);
+		free(outTemp);
+		return PyErr_NoMemory();
+	}
+
+	hTransform = acquireTransform((TransformObject *) transform, width * height);
+	start = statStart();
+
+	Py_BEGIN_ALLOW_THREADS
+	for(i=0; i<height; i++){
+		inbuf = inRows[i];
+		if(packIn){
+			if(inPixel==inSize){
+				memcpy(inTemp, inbuf, width * inSize);
+			}else{
+				for(j=0; j<width; j++){
+					memcpy(inTemp + j * inSize, inbuf + j * inPixel, inSize);
+				}
+			}
+			inbuf = inTemp;
+		}
+		outbuf = packOut ? outTemp : outRows[i];
+		doTransform(hTransform, inbuf, outbuf, width, inSize, outSize);
+		if(packOut){
+			for(j=0; j<width; j++){
+				memcpy(outRows[i] + j * outPixel, outTemp + j * outSize, outSize);
+			}
+		}
+	}
+	Py_END_ALLOW_THREADS
+
+	statTransform(hTransform, width * height, start);
+
+	free(inTemp);
+	free(outTemp);
+
+	return Py_BuildValue("n", height);
+}
+
+/* Image which is split on row bands for transforming by pool of
+ * native threads. Transform handle is shared between threads because
+ * cmsDoTransform() works on a local copy of transform cache and doesn't
+ * modify transform state.
+ */
+typedef struct {
+	cmsHTRANSFORM hTransform;
+	char *inbuf;
+	char *outbuf;
+	Py_ssize_t width;
+	Py_ssize_t height;
+	Py_ssize_t inSize;
+	Py_ssize_t outSize;
+	Py_ssize_t bandHeight;
+	Py_ssize_t nextRow;
+	int running;
+	PyThread_type_lock lock;
+	PyThread_type_lock done;
+} BandJob;
+
+static int
+takeBand (BandJob *job, Py_ssize_t *start, Py_ssize_t *count) {
+
+	int ret = 0;
+
+	PyThread_acquire_lock(job->lock, WAIT_LOCK);
+	if(job->nextRow < job->height){
+		*start = job->nextRow;
+		*count = job->height - job->nextRow;
+		if(*count > job->bandHeight) *count = job->bandHeight;
+		job->nextRow += *count;
+		ret = 1;
+	}
+	PyThread_release_lock(job->lock);
+	return ret;
+}
+
+static void
+processBands (BandJob *job) {
+
+	Py_ssize_t start, count;
+
+	while(takeBand(job, &start, &count)){
+		doTransform(job->hTransform,
+				job->inbuf + start * job->width * job->inSize,
+				job->outbuf + start * job->width * job->outSize,
+				count * job->width, job->inSize, job->outSize);
+	}
+}
+
+static void
+bandWorker (void *arg) {
+
+	BandJob *job = (BandJob *) arg;
+	int last;
+
+	processBands(job);
+
+	PyThread_acquire_lock(job->lock, WAIT_LOCK);
+	job->running--;
+	last = job->running==0;
+	PyThread_release_lock(job->lock);
+
+	/* Job can be destroyed right after this call */
+	if(last) PyThread_release_lock(job->done);
+}
+
+static PyObject *
+pycms_TransformParallel (PyObject *self, PyObject *args) {
+
+	PyObject *transform, *inObj, *outObj;
+	Py_ssize_t width, height;
+	Py_buffer inView, outView;
+	int threads, i, wait;
+	BandJob job;
+	double start;
+
+	if (!PyArg_ParseTuple(args, "OOOnni", &transform, &inObj, &outObj,
+			&width, &height, &threads) || !Transform_Check(transform)
+			|| width < 0 || height < 0 || threads < 1) {
+		PyErr_Clear();
+		Py_INCREF(Py_None);
+		return Py_None;
+	}
+
+	job.inSize = ((TransformObject *) transform)->inSize;
+	job.outSize = ((TransformObject *) transform)->outSize;
+
+	/* bands of planar images are not contiguous */
+	if(T_PLANAR(((TransformObject *) transform)->inFormat) ||
+			T_PLANAR(((TransformObject *) transform)->outFormat)){
+		Py_INCREF(Py_None);
+		return Py_None;
+	}
+
+	if(width && (height > PY_SSIZE_T_MAX / width ||
+			width * height > PY_SSIZE_T_MAX / job.inSize ||
+			width * height > PY_SSIZE_T_MAX / job.outSize)){
+		Py_INCREF(Py_None);
+		return Py_None;
+	}
+
+	if(getBuffer(inObj, &inView, 0) < 0){
+		PyErr_Clear();
+		Py_INCREF(Py_None);
+		return Py_None;
+	}
+
+	if(getBuffer(outObj, &outView, 1) < 0){
+		PyErr_Clear();
+		PyBuffer_Release(&inView);
+		Py_INCREF(Py_None);
+		return Py_None;
+	}
+
+	if(inView.len < width * height * job.inSize ||
+			outView.len < width * height * job.outSize){
+		PyBuffer_Release(&inView);
+		PyBuffer_Release(&outView);
+		Py_INCREF(Py_None);
+		return Py_None;
+	}
+
+	job.hTransform = acquireTransform((TransformObject *) transform, width * height);
+	job.inbuf = inView.buf;
+	job.outbuf = outView.buf;
+	job.width = width;
+	job.height = height;
+	job.nextRow = 0;
+	job.running = 0;
+	job.lock = NULL;
+	job.done = NULL;
+
+	/* Several bands per thread to balance uneven thread load */
+	if(threads > height) threads = height ? (int) height : 1;
+	job.bandHeight = height / (threads * 4);
+	if(job.bandHeight < 1) job.bandHeight = 1;
+
+	if(threads > 1){
+		job.lock = PyThread_allocate_lock();
+		job.done = PyThread_allocate_lock();
+		if(job.lock==NULL || job.done==NULL) threads = 1;
+	}
+
+	start = statStart();
+
+	Py_BEGIN_ALLOW_THREADS
+	if(threads > 1){
+		/* Workers are counted in advance so done lock is released
+		 * exactly once, by the last finished worker. Job lives on this
+		 * stack, so it is always waited for while any started worker
+		 * may still use it; workers don't touch job after release. */
+		PyThread_acquire_lock(job.done, WAIT_LOCK);
+		job.running = threads - 1;
+		wait = 1;
+		for(i=1; i<threads; i++){
+			if(PyThread_start_new_thread(bandWorker, &job) == -1){
+				PyThread_acquire_lock(job.lock, WAIT_LOCK);
+				job.running -= threads - i;
+				/* started workers have finished without release */
+				wait = job.running > 0;
+				PyThread_release_lock(job.lock);
+				break;
+			}
+		}
+		processBands(&job);
+		if(wait) PyThread_acquire_lock(job.done, WAIT_LOCK);
+	}else{
+		doTransform(job.hTransform, job.inbuf, job.outbuf,
+				width * height, job.inSize, job.outSize);
+	}
+	Py_END_ALLOW_THREADS
+
+	statTransform(job.hTransform, width * height, start);
+
+	if(job.lock) PyThread_free_lock(job.lock);
+	if(job.done) PyThread_free_lock(job.done);
+
+	PyBuffer_Release(&inView);
+	PyBuffer_Release(&outView);
+
+	return Py_BuildValue("i", threads);
+}
+
+#define BUFFER_SIZE 1000
+
+static PyObject *
+pycms_GetProfileName (PyObject *self, PyObject *args) {
+
+	PyObject *profile;
+	cmsHPROFILE hProfile;
+	char *buffer;
+	PyObject *ret;
+
+	if (!PyArg_ParseTuple(args, "O", &profile) || !Profile_Check(profile)) {
+		PyErr_Clear();
+		Py_INCREF(Py_None);
+		return Py_None;
+	}
+
+	buffer=malloc(BUFFER_SIZE);
+	hProfile = PROFILE_HANDLE(profile);
+
+	cmsGetProfileInfoASCII(hProfile,
+			cmsInfoDescription,
+			cmsNoLanguage, cmsNoCountry,
+			buffer, BUFFER_SIZE);
+
+	ret=Py_BuildValue("s", buffer);
+	free(buffer);
+	return ret;
+}
+
+static PyObject *
+pycms_GetProfileInfo (PyObject *self, PyObject *args) {
+
+	PyObject *profile;
+	cmsHPROFILE hProfile;
+	char *buffer;
+	PyObject *ret;
+
+	if (!PyArg_ParseTuple(args, "O", &profile) || !Profile_Check(profile)) {
+		PyErr_Clear();
+		Py_INCREF(Py_None);
+		return Py_None;
+	}
+
+	buffer=malloc(BUFFER_SIZE);
+	hProfile = PROFILE_HANDLE(profile);
+
+	cmsGetProfileInfoASCII(hProfile,
 			cmsInfoModel,
 			cmsNoLanguage, cmsNoCountry,
 			buffer, BUFFER_SIZE);
 
-	ret=Py_BuildValue("s", buffer);
-	free(buffer);
-	return ret;
+	ret=Py_BuildValue("s", buffer);
+	free(buffer);
+	return ret;
+}
+
+static PyObject *
+pycms_GetProfileInfoCopyright (PyObject *self, PyObject *args) {
+
+	PyObject *profile;
+	cmsHPROFILE hProfile;
+	char *buffer;
+	PyObject *ret;
+
+	if (!PyArg_ParseTuple(args, "O", &profile) || !Profile_Check(profile)) {
+		PyErr_Clear();
+		Py_INCREF(Py_None);
+		return Py_None;
+	}
+
+	buffer=malloc(BUFFER_SIZE);
+	hProfile = PROFILE_HANDLE(profile);
+
+	cmsGetProfileInfoASCII(hProfile,
+			cmsInfoCopyright,
+			cmsNoLanguage, cmsNoCountry,
+			buffer, BUFFER_SIZE);
+
+	ret=Py_BuildValue("s", buffer);
+	free(buffer);
+	return ret;
+}
+
+/* Converts built transform into device link profile. The link contains
+ * precalculated pipeline of the transform, so it can be loaded back
+ * without repeating of optimization.
+ */
+static PyObject *
+pycms_Transform2DeviceLink (PyObject *self, PyObject *args) {
+
+	PyObject *transform;
+	double version;
+	int inFlags;
+	cmsHPROFILE hProfile;
+
+	if (!PyArg_ParseTuple(args, "Odi", &transform, &version, &inFlags) ||
+			!Transform_Check(transform)) {
+		PyErr_Clear();
+		Py_INCREF(Py_None);
+		return Py_None;
+	}
+
+	Py_BEGIN_ALLOW_THREADS
+	hProfile = cmsTransform2DeviceLink(
+			TRANSFORM_HANDLE(transform),
+			version, (cmsUInt32Number) inFlags);
+	Py_END_ALLOW_THREADS
+
+	if(hProfile==NULL) {
+		Py_INCREF(Py_None);
+		return Py_None;
+	}
+
+	return newProfileObject(hProfile);
 }
 
+/* Serializes profile into ICC data string.
+ */
 static PyObject *
-pycms_GetProfileInfoCopyright (PyObject *self, PyObject *args) {
+pycms_SaveProfileToMem (PyObject *self, PyObject *args) {
 
-	void *profile;
+	PyObject *profile;
+	PyObject *result;
 	cmsHPROFILE hProfile;
-	char *buffer;
-	PyObject *ret;
+	cmsUInt32Number size = 0;
 
-	if (!PyArg_ParseTuple(args, "O", &profile)) {
+	if (!PyArg_ParseTuple(args, "O", &profile) || !Profile_Check(profile)) {
+		PyErr_Clear();
 		Py_INCREF(Py_None);
 		return Py_None;
 	}
 
-	buffer=malloc(BUFFER_SIZE);
-	hProfile = (cmsHPROFILE) PyCObject_AsVoidPtr(profile);
+	hProfile = PROFILE_HANDLE(profile);
 
-	cmsGetProfileInfoASCII(hProfile,
-			cmsInfoCopyright,
-			cmsNoLanguage, cmsNoCountry,
-			buffer, BUFFER_SIZE);
+	if(!cmsSaveProfileToMem(hProfile, NULL, &size) || !size) {
+		Py_INCREF(Py_None);
+		return Py_None;
+	}
 
-	ret=Py_BuildValue("s", buffer);
-	free(buffer);
-	return ret;
+	result = PyString_FromStringAndSize(NULL, size);
+	if(result==NULL) return NULL;
+
+	if(!cmsSaveProfileToMem(hProfile, PyString_AS_STRING(result), &size)) {
+		Py_DECREF(result);
+		Py_INCREF(Py_None);
+		return Py_None;
+	}
+
+	return result;
+}
+
+/* Color difference metrics, numbers match DELTA_E_* constants */
+#define DE_CIE76 0
+#define DE_CIE94 1
+#define DE_CMC 2
+#define DE_CIEDE2000 3
+#define DE_BFD 4
+
+/* Computes color differences between count pairs of Lab colors and
+ * accumulates sum, minimum and maximum. Should be called with
+ * released GIL.
+ */
+static void
+deltaE (const cmsCIELab *lab1, const cmsCIELab *lab2, double *out, Py_ssize_t count,
+		int method, const double *params, double *sum, double *min, double *max) {
+
+	Py_ssize_t i;
+	double value;
+
+	*sum = 0.0;
+	*min = *max = count ? -1.0 : 0.0;
+
+	for(i=0; i<count; i++){
+		switch(method){
+		case DE_CIE94:
+			value = cmsCIE94DeltaE(lab1 + i, lab2 + i);
+			break;
+		case DE_CMC:
+			value = cmsCMCdeltaE(lab1 + i, lab2 + i, params[0], params[1]);
+			break;
+		case DE_CIEDE2000:
+			value = cmsCIE2000DeltaE(lab1 + i, lab2 + i, params[0], params[1], params[2]);
+			break;
+		case DE_BFD:
+			value = cmsBFDdeltaE(lab1 + i, lab2 + i);
+			break;
+		default:
+			value = cmsDeltaE(lab1 + i, lab2 + i);
+		}
+		out[i] = value;
+		*sum += value;
+		if(*min < 0.0 || value < *min) *min = value;
+		if(value > *max) *max = value;
+	}
+}
+
+static int
+compareDoubles (const void *a, const void *b) {
+
+	double x = *(const double *) a, y = *(const double *) b;
+
+	return x < y ? -1 : (x > y ? 1 : 0);
+}
+
+/* Returns percentile of sorted values with linear interpolation
+ * between closest ranks.
+ */
+static double
+getPercentile (const double *sorted, Py_ssize_t count, double percent) {
+
+	double rank;
+	Py_ssize_t low;
+
+	if(count==0) return 0.0;
+	if(percent <= 0.0) return sorted[0];
+	if(percent >= 100.0) return sorted[count - 1];
+
+	rank = percent / 100.0 * (count - 1);
+	low = (Py_ssize_t) rank;
+	if(low + 1 >= count) return sorted[count - 1];
+	return sorted[low] + (sorted[low + 1] - sorted[low]) * (rank - low);
+}
+
+/* Computes color differences of two buffers of Lab doubles into output
+ * buffer of doubles. If percentiles sequence is provided, returns
+ * summary dictionary, otherwise returns number of differences.
+ */
+static PyObject *
+pycms_DeltaE (PyObject *self, PyObject *args) {
+
+	PyObject *lab1Obj, *lab2Obj, *outObj, *percentiles, *seq = NULL;
+	PyObject *result = NULL, *values = NULL, *item;
+	Py_buffer lab1View, lab2View, outView;
+	Py_ssize_t count, i;
+	double params[3], sum, min, max, percent, *sorted = NULL;
+	int method;
+
+	if (!PyArg_ParseTuple(args, "OOi(ddd)OO", &lab1Obj, &lab2Obj, &method,
+			&params[0], &params[1], &params[2], &outObj, &percentiles)
+			|| method < DE_CIE76 || method > DE_BFD) {
+		PyErr_Clear();
+		Py_INCREF(Py_None);
+		return Py_None;
+	}
+
+	if(percentiles != Py_None){
+		seq = PySequence_Fast(percentiles, "percentiles should be a sequence");
+		if(seq==NULL){
+			PyErr_Clear();
+			Py_INCREF(Py_None);
+			return Py_None;
+		}
+	}
+
+	if(getBuffer(lab1Obj, &lab1View, 0) < 0){
+		PyErr_Clear();
+		Py_XDECREF(seq);
+		Py_INCREF(Py_None);
+		return Py_None;
+	}
+
+	if(getBuffer(lab2Obj, &lab2View, 0) < 0){
+		PyErr_Clear();
+		PyBuffer_Release(&lab1View);
+		Py_XDECREF(seq);
+		Py_INCREF(Py_None);
+		return Py_None;
+	}
+
+	if(getBuffer(outObj, &outView, 1) < 0){
+		PyErr_Clear();
+		PyBuffer_Release(&lab1View);
+		PyBuffer_Release(&lab2View);
+		Py_XDECREF(seq);
+		Py_INCREF(Py_None);
+		return Py_None;
+	}
+
+	count = lab1View.len / sizeof(cmsCIELab);
+
+	if(lab1View.len % sizeof(cmsCIELab) || lab2View.len != lab1View.len
+			|| outView.len / (Py_ssize_t) sizeof(double) < count){
+		PyBuffer_Release(&lab1View);
+		PyBuffer_Release(&lab2View);
+		PyBuffer_Release(&outView);
+		Py_XDECREF(seq);
+		Py_INCREF(Py_None);
+		return Py_None;
+	}
+
+	if(seq!=NULL && count){
+		sorted = (double *) malloc(count * sizeof(double));
+		if(sorted==NULL){
+			PyBuffer_Release(&lab1View);
+			PyBuffer_Release(&lab2View);
+			PyBuffer_Release(&outView);
+			Py_DECREF(seq);
+			return PyErr_NoMemory();
+		}
+	}
+
+	Py_BEGIN_ALLOW_THREADS
+	deltaE((const cmsCIELab *) lab1View.buf, (const cmsCIELab *) lab2View.buf,
+			(double *) outView.buf, count, method, params, &sum, &min, &max);
+	if(sorted!=NULL){
+		memcpy(sorted, outView.buf, count * sizeof(double));
+		qsort(sorted, count, sizeof(double), compareDoubles);
+	}
+	Py_END_ALLOW_THREADS
+
+	PyBuffer_Release(&lab1View);
+	PyBuffer_Release(&lab2View);
+	PyBuffer_Release(&outView);
+
+	if(seq==NULL) return Py_BuildValue("n", count);
+
+	values = PyDict_New();
+	if(values==NULL){
+		free(sorted);
+		Py_DECREF(seq);
+		return NULL;
+	}
+
+	for(i=0; i<PySequence_Fast_GET_SIZE(seq); i++){
+		item = PySequence_Fast_GET_ITEM(seq, i);
+		percent = PyFloat_AsDouble(item);
+		if(percent==-1.0 && PyErr_Occurred()){
+			PyErr_Clear();
+			Py_CLEAR(values);
+			break;
+		}
+		result = PyFloat_FromDouble(getPercentile(sorted, count, percent));
+		if(result==NULL || PyDict_SetItem(values, item, result) < 0){
+			Py_XDECREF(result);
+			Py_CLEAR(values);
+			free(sorted);
+			Py_DECREF(seq);
+			return NULL;
+		}
+		Py_DECREF(result);
+	}
+
+	free(sorted);
+	Py_DECREF(seq);
+
+	if(values==NULL){
+		Py_INCREF(Py_None);
+		return Py_None;
+	}
+
+	result = Py_BuildValue("{s:n,s:d,s:d,s:d,s:O}",
+			"count", count,
+			"mean", count ? sum / count : 0.0,
+			"min", min,
+			"max", max,
+			"percentiles", values);
+	Py_DECREF(values);
+	return result;
+}
+
+/* Implicit k-d tree of Lab colors. Colors are reordered so that the
+ * middle color of each range splits the range by axis depth % 3, so
+ * the tree is kept in color and id arrays only and is serialized
+ * without any rebuilding. CIEDE2000 queries search CIE76 radius which
+ * is proven to enclose all colors within CIEDE2000 difference.
+ */
+static double
+labDistance2 (const double *p, const double *q) {
+
+	double dL = p[0] - q[0], da = p[1] - q[1], db = p[2] - q[2];
+
+	return dL * dL + da * da + db * db;
+}
+
+static void
+kdSwap (double *points, int *ids, Py_ssize_t i, Py_ssize_t j) {
+
+	double tmp[3];
+	int id;
+
+	memcpy(tmp, points + i * 3, sizeof(tmp));
+	memcpy(points + i * 3, points + j * 3, sizeof(tmp));
+	memcpy(points + j * 3, tmp, sizeof(tmp));
+	id = ids[i];
+	ids[i] = ids[j];
+	ids[j] = id;
+}
+
+/* Places color of k-th rank by axis at position k of [lo, hi) range */
+static void
+kdSelect (double *points, int *ids, Py_ssize_t lo, Py_ssize_t hi, Py_ssize_t k, int axis) {
+
+	Py_ssize_t i, store;
+	double pivot;
+
+	while(hi - lo > 1){
+		kdSwap(points, ids, lo + (hi - lo) / 2, hi - 1);
+		pivot = points[(hi - 1) * 3 + axis];
+		store = lo;
+		for(i=lo; i<hi - 1; i++){
+			if(points[i * 3 + axis] < pivot) kdSwap(points, ids, i, store++);
+		}
+		kdSwap(points, ids, store, hi - 1);
+		if(store == k) return;
+		if(k < store) hi = store;
+		else lo = store + 1;
+	}
+}
+
+static void
+kdBuild (double *points, int *ids, Py_ssize_t lo, Py_ssize_t hi, int axis) {
+
+	Py_ssize_t mid;
+
+	while(hi - lo > 1){
+		mid = lo + (hi - lo) / 2;
+		kdSelect(points, ids, lo, hi, mid, axis);
+		kdBuild(points, ids, lo, mid, (axis + 1) % 3);
+		lo = mid + 1;
+		axis = (axis + 1) % 3;
+	}
+}
+
+/* Colors found by search, kept as bounded max-heap of nearest colors
+ * or as growing list of colors within radius
+ */
+typedef struct {
+	double dist;
+	Py_ssize_t pos;
+} KdItem;
+
+typedef struct {
+	Py_ssize_t size;
+	Py_ssize_t count;
+	KdItem *items;
+} KdHeap;
+
+static void
+kdHeapPush (KdHeap *heap, double dist, Py_ssize_t pos) {
+
+	Py_ssize_t i, child;
+	KdItem *items = heap->items;
+
+	if(heap->count == heap->size){
+		if(dist >= items[0].dist) return;
+		/* replace the farthest color and sift it down */
+		i = 0;
+		while((child = 2 * i + 1) < heap->count){
+			if(child + 1 < heap->count && items[child + 1].dist > items[child].dist) child++;
+			if(items[child].dist <= dist) break;
+			items[i] = items[child];
+			i = child;
+		}
+	}else{
+		i = heap->count++;
+		while(i > 0 && items[(i - 1) / 2].dist < dist){
+			items[i] = items[(i - 1) / 2];
+			i = (i - 1) / 2;
+		}
+	}
+	items[i].dist = dist;
+	items[i].pos = pos;
+}
+
+static void
+kdNearest (const double *points, Py_ssize_t lo, Py_ssize_t hi, int axis,
+		const double *query, KdHeap *heap) {
+
+	Py_ssize_t mid;
+	double diff;
+
+	while(hi > lo){
+		mid = lo + (hi - lo) / 2;
+		kdHeapPush(heap, labDistance2(points + mid * 3, query), mid);
+		diff = query[axis] - points[mid * 3 + axis];
+
+		if(diff < 0){
+			kdNearest(points, lo, mid, (axis + 1) % 3, query, heap);
+			if(heap->count == heap->size && diff * diff >= heap->items[0].dist) return;
+			lo = mid + 1;
+		}else{
+			kdNearest(points, mid + 1, hi, (axis + 1) % 3, query, heap);
+			if(heap->count == heap->size && diff * diff >= heap->items[0].dist) return;
+			hi = mid;
+		}
+		axis = (axis + 1) % 3;
+	}
+}
+
+/* Collects colors closer than sqrt(radius2) into list, which grows
+ * as required. Returns -1 on memory error.
+ */
+static int
+kdWithin (const double *points, Py_ssize_t lo, Py_ssize_t hi, int axis,
+		const double *query, double radius2, KdHeap *found) {
+
+	Py_ssize_t mid, size;
+	double diff, dist;
+	KdItem *items;
+
+	while(hi > lo){
+		mid = lo + (hi - lo) / 2;
+		dist = labDistance2(points + mid * 3, query);
+
+		if(dist <= radius2){
+			if(found->count == found->size){
+				size = found->size ? found->size * 2 : 64;
+				items = (KdItem *) realloc(found->items, size * sizeof(KdItem));
+				if(items==NULL) return -1;
+				found->items = items;
+				found->size = size;
+			}
+			found->items[found->count].dist = dist;
+			found->items[found->count++].pos = mid;
+		}
+
+		diff = query[axis] - points[mid * 3 + axis];
+		if(diff * diff <= radius2){
+			if(kdWithin(points, lo, mid, (axis + 1) % 3, query, radius2, found) < 0) return -1;
+			lo = mid + 1;
+		}else if(diff < 0){
+			hi = mid;
+		}else{
+			lo = mid + 1;
+		}
+		axis = (axis + 1) % 3;
+	}
+	return 0;
+}
+
+/* Returns CIE76 radius enclosing all colors within CIEDE2000 difference
+ * from Lab color. Lightness difference is at most Kl * SL * radius
+ * (SL <= 1.75). Rotation term removes at most sin(60) share of chroma
+ * and hue terms, so they are at most radius / sqrt(1 - sin(60)). Their
+ * distance in a'b' plane, which is not less than ab distance, grows
+ * with mean chroma by SC >= SH weighting, while a' is at most 1.5 a.
+ */
+static double
+kdSearchRadius (const double *lab, double radius, const double *params) {
+
+	double chroma, k, u, ab, l;
+
+	chroma = 1.5 * sqrt(lab[1] * lab[1] + lab[2] * lab[2]);
+	k = params[1] > params[2] ? params[1] : params[2];
+	u = k * radius / 0.366;
+	if(0.0225 * u >= 1.0) return HUGE_VAL;
+
+	ab = (1.0 + 0.045 * chroma) * u / (1.0 - 0.0225 * u);
+	l = 1.75 * params[0] * radius;
+	return sqrt(l * l + ab * ab) * 1.001 + 1e-6;
+}
+
+/* Returns lower bound of CIEDE2000 difference by the same terms as
+ * kdSearchRadius(), so most colors are skipped without computing it.
+ */
+static double
+kdLowerBound (const double *lab1, const double *lab2, const double *params) {
+
+	double meanL, sl, sc, dL, da, db, k;
+
+	meanL = (lab1[0] + lab2[0]) / 2.0 - 50.0;
+	sl = 1.0 + 0.015 * meanL * meanL / sqrt(20.0 + meanL * meanL);
+	sc = 1.0 + 0.03375 * (sqrt(lab1[1] * lab1[1] + lab1[2] * lab1[2])
+			+ sqrt(lab2[1] * lab2[1] + lab2[2] * lab2[2]));
+	k = params[1] > params[2] ? params[1] : params[2];
+
+	dL = (lab1[0] - lab2[0]) / (params[0] * sl);
+	da = lab1[1] - lab2[1];
+	db = lab1[2] - lab2[2];
+	return sqrt(dL * dL + 0.134 * (da * da + db * db) / (k * k * sc * sc)) * 0.999;
+}
+
+static int
+compareKdItems (const void *a, const void *b) {
+
+	double x = ((const KdItem *) a)->dist, y = ((const KdItem *) b)->dist;
+
+	return (x > y) - (x < y);
+}
+
+/* Replaces squared CIE76 distances of found colors by final
+ * differences of requested method and sorts colors by them. CIEDE2000
+ * differences are not computed for colors surely farther than limit,
+ * such colors are dropped.
+ */
+static void
+kdFinish (const double *points, const double *query, KdHeap *found,
+		int method, const double *params, double limit) {
+
+	Py_ssize_t i, count = 0;
+	KdItem *item;
+
+	for(i=0; i<found->count; i++){
+		item = found->items + i;
+		if(method==DE_CIEDE2000){
+			if(kdLowerBound(points + item->pos * 3, query, params) > limit) continue;
+			item->dist = cmsCIE2000DeltaE((const cmsCIELab *) (points + item->pos * 3),
+					(const cmsCIELab *) query, params[0], params[1], params[2]);
+		}else{
+			item->dist = sqrt(item->dist);
+		}
+		found->items[count++] = *item;
+	}
+	found->count = count;
+	qsort(found->items, found->count, sizeof(KdItem), compareKdItems);
+}
+
+static PyObject *
+pycms_KdBuild (PyObject *self, PyObject *args) {
+
+	PyObject *pointsObj, *idsObj;
+	Py_buffer pointsView, idsView;
+	Py_ssize_t count;
+
+	if (!PyArg_ParseTuple(args, "OO", &pointsObj, &idsObj)) {
+		PyErr_Clear();
+		Py_INCREF(Py_None);
+		return Py_None;
+	}
+
+	if(getBuffer(pointsObj, &pointsView, 1) < 0){
+		PyErr_Clear();
+		Py_INCREF(Py_None);
+		return Py_None;
+	}
+
+	if(getBuffer(idsObj, &idsView, 1) < 0){
+		PyErr_Clear();
+		PyBuffer_Release(&pointsView);
+		Py_INCREF(Py_None);
+		return Py_None;
+	}
+
+	count = idsView.len / sizeof(int);
+	if(pointsView.len != count * 3 * (Py_ssize_t) sizeof(double)){
+		PyBuffer_Release(&pointsView);
+		PyBuffer_Release(&idsView);
+		Py_INCREF(Py_None);
+		return Py_None;
+	}
+
+	Py_BEGIN_ALLOW_THREADS
+	kdBuild((double *) pointsView.buf, (int *) idsView.buf, 0, count, 0);
+	Py_END_ALLOW_THREADS
+
+	PyBuffer_Release(&pointsView);
+	PyBuffer_Release(&idsView);
+
+	return Py_BuildValue("n", count);
+}
+
+/* Finds k nearest colors for each query color. Ids and differences
+ * are stored into output buffers of queries * k items, missing
+ * results get -1 id.
+ */
+static PyObject *
+pycms_KdNearest (PyObject *self, PyObject *args) {
+
+	PyObject *pointsObj, *idsObj, *queryObj, *outIdsObj, *outDistObj;
+	Py_buffer pointsView, idsView, queryView, outIdsView, outDistView;
+	Py_ssize_t count, nqueries, k, candidates, i, j;
+	double params[3], radius, *points, *queries, *query, *outDist;
+	int method, *ids, *outIds, ok = 1, ret = 0;
+	KdHeap heap = {0, 0, NULL}, found = {0, 0, NULL};
+	KdItem *item;
+
+	if (!PyArg_ParseTuple(args, "OOOni(ddd)OO", &pointsObj, &idsObj, &queryObj,
+			&k, &method, &params[0], &params[1], &params[2],
+			&outIdsObj, &outDistObj) || k < 1) {
+		PyErr_Clear();
+		Py_INCREF(Py_None);
+		return Py_None;
+	}
+
+	if(getBuffer(pointsObj, &pointsView, 0) < 0){
+		PyErr_Clear();
+		Py_INCREF(Py_None);
+		return Py_None;
+	}
+	if(getBuffer(idsObj, &idsView, 0) < 0){
+		PyErr_Clear();
+		PyBuffer_Release(&pointsView);
+		Py_INCREF(Py_None);
+		return Py_None;
+	}
+	if(getBuffer(queryObj, &queryView, 0) < 0){
+		PyErr_Clear();
+		PyBuffer_Release(&pointsView);
+		PyBuffer_Release(&idsView);
+		Py_INCREF(Py_None);
+		return Py_None;
+	}
+	if(getBuffer(outIdsObj, &outIdsView, 1) < 0){
+		PyErr_Clear();
+		PyBuffer_Release(&pointsView);
+		PyBuffer_Release(&idsView);
+		PyBuffer_Release(&queryView);
+		Py_INCREF(Py_None);
+		return Py_None;
+	}
+	if(getBuffer(outDistObj, &outDistView, 1) < 0){
+		PyErr_Clear();
+		PyBuffer_Release(&pointsView);
+		PyBuffer_Release(&idsView);
+		PyBuffer_Release(&queryView);
+		PyBuffer_Release(&outIdsView);
+		Py_INCREF(Py_None);
+		return Py_None;
+	}
+
+	count = idsView.len / sizeof(int);
+	nqueries = queryView.len / (3 * sizeof(double));
+
+	if(pointsView.len / (Py_ssize_t) (3 * sizeof(double)) < count
+			|| outIdsView.len / (Py_ssize_t) sizeof(int) / k < nqueries
+			|| outDistView.len / (Py_ssize_t) sizeof(double) / k < nqueries){
+		ok = 0;
+	}
+
+	/* more CIE76 candidates give lower bound of CIEDE2000 difference */
+	candidates = method==DE_CIEDE2000 ? 4 * k : k;
+	if(ok) heap.items = (KdItem *) malloc(candidates * sizeof(KdItem));
+
+	if(ok && heap.items!=NULL){
+		points = (double *) pointsView.buf;
+		ids = (int *) idsView.buf;
+		queries = (double *) queryView.buf;
+		outIds = (int *) outIdsView.buf;
+		outDist = (double *) outDistView.buf;
+
+		Py_BEGIN_ALLOW_THREADS
+		for(i=0; i<nqueries; i++){
+			query = queries + i * 3;
+			heap.size = candidates;
+			heap.count = 0;
+			kdNearest(points, 0, count, 0, query, &heap);
+			kdFinish(points, query, &heap, method, params, HUGE_VAL);
+
+			if(method==DE_CIEDE2000 && heap.count){
+				/* k-th difference of candidates bounds k-th difference of
+				 * all colors, closer colors are inside of its search radius */
+				radius = kdSearchRadius(query,
+						heap.items[(heap.count < k ? heap.count : k) - 1].dist, params);
+				found.count = 0;
+				ret = kdWithin(points, 0, count, 0, query, radius * radius, &found);
+				if(ret < 0) break;
+
+				heap.size = k;
+				heap.count = 0;
+				for(j=0; j<found.count; j++){
+					item = found.items + j;
+					if(heap.count == k && kdLowerBound(points + item->pos * 3,
+							query, params) >= heap.items[0].dist) continue;
+					kdHeapPush(&heap, cmsCIE2000DeltaE((const cmsCIELab *) (points + item->pos * 3),
+							(const cmsCIELab *) query, params[0], params[1], params[2]), item->pos);
+				}
+				qsort(heap.items, heap.count, sizeof(KdItem), compareKdItems);
+			}
+
+			for(j=0; j<k; j++){
+				outIds[i * k + j] = j < heap.count ? ids[heap.items[j].pos] : -1;
+				outDist[i * k + j] = j < heap.count ? heap.items[j].dist : 0.0;
+			}
+		}
+		Py_END_ALLOW_THREADS
+	}
+
+	free(heap.items);
+	free(found.items);
+	PyBuffer_Release(&pointsView);
+	PyBuffer_Release(&idsView);
+	PyBuffer_Release(&queryView);
+	PyBuffer_Release(&outIdsView);
+	PyBuffer_Release(&outDistView);
+
+	if(!ok){
+		Py_INCREF(Py_None);
+		return Py_None;
+	}
+	if(heap.items==NULL || ret < 0) return PyErr_NoMemory();
+
+	return Py_BuildValue("n", nqueries);
+}
+
+/* Finds colors within radius from each query color with released GIL.
+ * Results of all queries are collected into single list and split
+ * by offsets, so Python objects are created after search only.
+ * Returns list of lists of (id, difference) tuples sorted by difference.
+ */
+static PyObject *
+pycms_KdWithin (PyObject *self, PyObject *args) {
+
+	PyObject *pointsObj, *idsObj, *queryObj, *result = NULL, *items, *item;
+	Py_buffer pointsView, idsView, queryView;
+	Py_ssize_t count, nqueries, size, i, j, *offsets;
+	double params[3], radius, searchRadius, *points, *query;
+	int method, *ids, ret = 0;
+	KdHeap found = {0, 0, NULL}, all = {0, 0, NULL};
+	KdItem *grown;
+
+	if (!PyArg_ParseTuple(args, "OOOdi(ddd)", &pointsObj, &idsObj, &queryObj,
+			&radius, &method, &params[0], &params[1], &params[2]) || radius < 0) {
+		PyErr_Clear();
+		Py_INCREF(Py_None);
+		return Py_None;
+	}
+
+	if(getBuffer(pointsObj, &pointsView, 0) < 0){
+		PyErr_Clear();
+		Py_INCREF(Py_None);
+		return Py_None;
+	}
+	if(getBuffer(idsObj, &idsView, 0) < 0){
+		PyErr_Clear();
+		PyBuffer_Release(&pointsView);
+		Py_INCREF(Py_None);
+		return Py_None;
+	}
+	if(getBuffer(queryObj, &queryView, 0) < 0){
+		PyErr_Clear();
+		PyBuffer_Release(&pointsView);
+		PyBuffer_Release(&idsView);
+		Py_INCREF(Py_None);
+		return Py_None;
+	}
+
+	count = idsView.len / sizeof(int);
+	nqueries = queryView.len / (3 * sizeof(double));
+	if(pointsView.len / (Py_ssize_t) (3 * sizeof(double)) < count){
+		PyBuffer_Release(&pointsView);
+		PyBuffer_Release(&idsView);
+		PyBuffer_Release(&queryView);
+		Py_INCREF(Py_None);
+		return Py_None;
+	}
+
+	offsets = (Py_ssize_t *) malloc((nqueries + 1) * sizeof(Py_ssize_t));
+	if(offsets==NULL){
+		PyBuffer_Release(&pointsView);
+		PyBuffer_Release(&idsView);
+		PyBuffer_Release(&queryView);
+		return PyErr_NoMemory();
+	}
+
+	points = (double *) pointsView.buf;
+	ids = (int *) idsView.buf;
+	offsets[0] = 0;
+
+	Py_BEGIN_ALLOW_THREADS
+	for(i=0; i<nqueries; i++){
+		query = (double *) queryView.buf + i * 3;
+		searchRadius = radius;
+		if(method==DE_CIEDE2000) searchRadius = kdSearchRadius(query, radius, params);
+
+		found.count = 0;
+		ret = kdWithin(points, 0, count, 0, query, searchRadius * searchRadius, &found);
+		if(ret < 0) break;
+		kdFinish(points, query, &found, method, params, radius);
+
+		for(j=0; j<found.count && found.items[j].dist <= radius; j++){
+			if(all.count == all.size){
+				size = all.size ? all.size * 2 : 64;
+				grown = (KdItem *) realloc(all.items, size * sizeof(KdItem));
+				if(grown==NULL){
+					ret = -1;
+					break;
+				}
+				all.items = grown;
+				all.size = size;
+			}
+			all.items[all.count++] = found.items[j];
+		}
+		if(ret < 0) break;
+		offsets[i + 1] = all.count;
+	}
+	Py_END_ALLOW_THREADS
+
+	if(ret==0) result = PyList_New(nqueries);
+	else PyErr_NoMemory();
+
+	for(i=0; result!=NULL && i<nqueries; i++){
+		items = PyList_New(offsets[i + 1] - offsets[i]);
+		for(j=offsets[i]; items!=NULL && j<offsets[i + 1]; j++){
+			item = Py_BuildValue("(id)", ids[all.items[j].pos], all.items[j].dist);
+			if(item==NULL){
+				Py_CLEAR(items);
+				break;
+			}
+			PyList_SET_ITEM(items, j - offsets[i], item);
+		}
+		if(items==NULL){
+			Py_CLEAR(result);
+			break;
+		}
+		PyList_SET_ITEM(result, i, items);
+	}
+
+	free(offsets);
+	free(found.items);
+	free(all.items);
+	PyBuffer_Release(&pointsView);
+	PyBuffer_Release(&idsView);
+	PyBuffer_Release(&queryView);
+	return result;
+}
+
+static PyObject *
+pycms_EnableStats (PyObject *self, PyObject *args) {
+
+	int enabled;
+
+	if (!PyArg_ParseTuple(args, "i", &enabled)) {
+		PyErr_Clear();
+		Py_INCREF(Py_None);
+		return Py_None;
+	}
+
+	stats.enabled = enabled ? 1 : 0;
+	return Py_BuildValue("i", stats.enabled);
+}
+
+static PyObject *
+pycms_GetStats (PyObject *self, PyObject *args) {
+
+	PyObject *result, *formats, *key, *value;
+	int i, ret;
+
+	formats = PyDict_New();
+	if(formats==NULL) return NULL;
+
+	for(i=0; i<stats.formatCount; i++){
+		key = PyInt_FromLong((long) stats.formats[i].format);
+		value = PyLong_FromUnsignedLongLong(stats.formats[i].pixels);
+		ret = (key==NULL || value==NULL) ? -1 : PyDict_SetItem(formats, key, value);
+		Py_XDECREF(key);
+		Py_XDECREF(value);
+		if(ret < 0){
+			Py_DECREF(formats);
+			return NULL;
+		}
+	}
+
+	result = Py_BuildValue("{s:i,s:l,s:l,s:k,s:k,s:k,s:k,s:d,s:d,s:K,s:K,s:O}",
+			"enabled", stats.enabled,
+			"profiles_live", stats.profilesLive,
+			"transforms_live", stats.transformsLive,
+			"profiles_opened", stats.profilesOpened,
+			"profiles_closed", stats.profilesClosed,
+			"transforms_built", stats.transformsBuilt,
+			"transforms_freed", stats.transformsFreed,
+			"build_time", stats.buildTime,
+			"transform_time", stats.transformTime,
+			"transform_calls", stats.transformCalls,
+			"pixels", stats.pixels,
+			"pixels_by_format", formats);
+	Py_DECREF(formats);
+	return result;
+}
+
+/* Resets accumulated counters. Live handle counters are kept because
+ * they describe currently existing handles.
+ */
+static PyObject *
+pycms_ResetStats (PyObject *self, PyObject *args) {
+
+	stats.profilesOpened = stats.profilesClosed = 0;
+	stats.transformsBuilt = stats.transformsFreed = 0;
+	stats.buildTime = stats.transformTime = 0.0;
+	stats.transformCalls = stats.pixels = 0;
+	stats.formatCount = 0;
+
+	Py_INCREF(Py_None);
+	return Py_None;
+}
+
+/* Sets callable which is called with build info dictionary for each
+ * transform build longer than threshold seconds. None removes the hook.
+ */
+static PyObject *
+pycms_SetBuildHook (PyObject *self, PyObject *args) {
+
+	PyObject *hook;
+	double threshold;
+
+	if (!PyArg_ParseTuple(args, "Od", &hook, &threshold) ||
+			(hook != Py_None && !PyCallable_Check(hook))) {
+		PyErr_Clear();
+		Py_INCREF(Py_None);
+		return Py_None;
+	}
+
+	Py_CLEAR(stats.buildHook);
+	if(hook != Py_None){
+		Py_INCREF(hook);
+		stats.buildHook = hook;
+	}
+	stats.buildHookThreshold = threshold;
+
+	return Py_BuildValue("i", 1);
 }
 
 static PyObject *
@@ -439,24 +3646,63 @@ pycms_GetVersion (PyObject *self, PyObject *args) {
 static
 PyMethodDef pycms_methods[] = {
 	{"getVersion", pycms_GetVersion, METH_VARARGS},
+	{"enableStats", pycms_EnableStats, METH_VARARGS},
+	{"getStats", pycms_GetStats, METH_VARARGS},
+	{"resetStats", pycms_ResetStats, METH_VARARGS},
+	{"setBuildHook", pycms_SetBuildHook, METH_VARARGS},
 	{"openProfile", pycms_OpenProfile, METH_VARARGS},
+	{"openProfileFromMem", pycms_OpenProfileFromMem, METH_VARARGS},
 	{"createRGBProfile", pycms_CreateRGBProfile, METH_VARARGS},
 	{"createLabProfile", pycms_CreateLabProfile, METH_VARARGS},
 	{"createGrayProfile", pycms_CreateGrayProfile, METH_VARARGS},
 	{"createXYZProfile", pycms_CreateXYZProfile, METH_VARARGS},
 	{"buildTransform", pycms_BuildTransform, METH_VARARGS},
 	{"buildProofingTransform", pycms_BuildProofingTransform, METH_VARARGS},
-	{"transformPixel", pycms_TransformPixel, METH_VARARGS},
-	{"transformPixel16b", pycms_TransformPixel16b, METH_VARARGS},
-	{"transformPixelDbl", pycms_TransformPixelDbl, METH_VARARGS},
+	{"buildMultiprofileTransform", pycms_BuildMultiprofileTransform, METH_VARARGS},
+	{"buildAdaptiveTransform", pycms_BuildAdaptiveTransform, METH_VARARGS},
+	{"getPrecalcInfo", pycms_GetPrecalcInfo, METH_VARARGS},
+	{"buildGamutCheckTransform", pycms_BuildGamutCheckTransform, METH_VARARGS},
+	{"enableColorCache", pycms_EnableColorCache, METH_VARARGS},
+	{"disableColorCache", pycms_DisableColorCache, METH_VARARGS},
+	{"getColorCacheStats", pycms_GetColorCacheStats, METH_VARARGS},
+	{"getPixelSizes", pycms_GetPixelSizes, METH_VARARGS},
+	{"transformBuffer", pycms_TransformBuffer, METH_VARARGS},
+	{"transformPalette", pycms_TransformPalette, METH_VARARGS},
+	{"gamutCheck", pycms_GamutCheck, METH_VARARGS},
+	{"getTransformFormats", pycms_GetTransformFormats, METH_VARARGS},
+	{"getFormats", pycms_GetFormats, METH_VARARGS},
+	{"getFormatInfo", pycms_GetFormatInfo, METH_VARARGS},
+	{"transformLines", pycms_TransformLines, METH_VARARGS},
+	{"transformLineStride", pycms_TransformLineStride, METH_VARARGS},
+	{"transformParallel", pycms_TransformParallel, METH_VARARGS},
+	{"transformImage", pycms_TransformImage, METH_VARARGS},
+	{"transformFanout", pycms_TransformFanout, METH_VARARGS},
 	{"getProfileName", pycms_GetProfileName, METH_VARARGS},
 	{"getProfileInfo", pycms_GetProfileInfo, METH_VARARGS},
 	{"getProfileInfoCopyright", pycms_GetProfileInfoCopyright, METH_VARARGS},
+	{"transform2DeviceLink", pycms_Transform2DeviceLink, METH_VARARGS},
+	{"saveProfileToMem", pycms_SaveProfileToMem, METH_VARARGS},
+	{"deltaE", pycms_DeltaE, METH_VARARGS},
+	{"kdBuild", pycms_KdBuild, METH_VARARGS},
+	{"kdNearest", pycms_KdNearest, METH_VARARGS},
+	{"kdWithin", pycms_KdWithin, METH_VARARGS},
 	{NULL, NULL}
 };
 
 void
 init_lcms2(void)
 {
-    Py_InitModule("_lcms2", pycms_methods);
+    PyObject *module;
+
+    if (PyType_Ready(&ProfileType) < 0 || PyType_Ready(&TransformType) < 0)
+        return;
+
+    module = Py_InitModule("_lcms2", pycms_methods);
+    if (module == NULL)
+        return;
+
+    Py_INCREF((PyObject *) &ProfileType);
+    PyModule_AddObject(module, "Profile", (PyObject *) &ProfileType);
+    Py_INCREF((PyObject *) &TransformType);
+    PyModule_AddObject(module, "Transform", (PyObject *) &TransformType);
 }
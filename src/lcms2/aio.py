@@ -0,0 +1,215 @@
+# -*- coding: utf-8 -*-
+#
+# 	Copyright (C) 2017 by Igor E. Novikov
+#
+# 	This program is free software: you can redistribute it and/or modify
+# 	it under the terms of the GNU General Public License as published by
+# 	the Free Software Foundation, either version 3 of the License, or
+# 	(at your option) any later version.
+#
+# 	This program is distributed in the hope that it will be useful,
+# 	but WITHOUT ANY WARRANTY; without even the implied warranty of
+# 	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# 	GNU General Public License for more details.
+#
+# 	You should have received a copy of the GNU General Public License
+# 	along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Asynchronous counterparts of blocking lcms2 functions for asyncio
+(or trollius) event loops. Functions return event loop futures, so
+they can be awaited by coroutines. Native work runs on executor threads
+with released GIL, so slow builds and large transforms don't block
+the loop.
+
+Number of simultaneously running jobs is limited (see configure()),
+extra jobs wait in a queue. Cancelled jobs are dropped from the queue,
+running buffer transforms stop between chunks.
+"""
+
+import threading
+from collections import deque
+
+try:
+	import asyncio
+except ImportError:
+	import trollius as asyncio
+
+from concurrent.futures import ThreadPoolExecutor
+
+import lcms2
+
+_lock = threading.Lock()
+_executor = None
+_max_concurrency = 4
+_running = 0
+_queue = deque()
+
+def configure(executor=None, max_concurrency=None):
+	"""
+	Sets executor and concurrency limit for asynchronous jobs.
+
+	executor - concurrent.futures executor, by default thread pool
+			of max_concurrency workers is created on first use
+	max_concurrency - maximum number of simultaneously running jobs
+	"""
+	global _executor, _max_concurrency
+	if max_concurrency is not None:
+		if max_concurrency < 1:
+			raise ValueError('max_concurrency should be positive')
+		with _lock:
+			_max_concurrency = max_concurrency
+	if executor is not None:
+		with _lock:
+			_executor = executor
+	_start_queued()
+
+def _get_executor():
+	global _executor
+	with _lock:
+		if _executor is None:
+			_executor = ThreadPoolExecutor(_max_concurrency)
+		return _executor
+
+class _Cancelled(Exception):
+	pass
+
+class _Job(object):
+
+	def __init__(self, loop, func, args):
+		self.loop = loop
+		self.func = func
+		self.args = args
+		self.cancel_event = threading.Event()
+		self.future = asyncio.Future(loop=loop)
+		self.future.add_done_callback(self._on_done)
+
+	def _on_done(self, future):
+		if future.cancelled():
+			self.cancel_event.set()
+
+	def start(self):
+		try:
+			worker = _get_executor().submit(self.func, *self.args)
+		except Exception, e:
+			self._deliver(None, e)
+			return
+		worker.add_done_callback(self._on_worker_done)
+
+	def _on_worker_done(self, worker):
+		try:
+			result, error = worker.result(), None
+		except Exception, e:
+			result, error = None, e
+		self._deliver(result, error)
+
+	def _deliver(self, result, error):
+		# job slot is released here, not by loop callback, so jobs
+		# of closed loops don't hold it forever
+		_finish_job()
+		if self.loop.is_closed():
+			return
+		try:
+			self.loop.call_soon_threadsafe(self._set_result, result, error)
+		except RuntimeError:
+			# loop is closed meanwhile
+			pass
+
+	def _set_result(self, result, error):
+		if self.future.cancelled():
+			return
+		if error is not None:
+			self.future.set_exception(error)
+		else:
+			self.future.set_result(result)
+
+def _finish_job():
+	global _running
+	with _lock:
+		_running -= 1
+	_start_queued()
+
+def _start_queued():
+	global _running
+	while True:
+		with _lock:
+			if _running >= _max_concurrency or not _queue:
+				return
+			job = _queue.popleft()
+			if job.future.cancelled():
+				continue
+			_running += 1
+		job.start()
+
+def _submit(loop, func, args, cancellable=False):
+	job = _Job(loop or asyncio.get_event_loop(), func, args)
+	if cancellable:
+		job.args = (job.cancel_event,) + args
+	with _lock:
+		_queue.append(job)
+	_start_queued()
+	return job
+
+def open_profile(profileFilename, loop=None):
+	"""
+	Asynchronous cmsOpenProfileFromFile(). Returns future of profile handle.
+	"""
+	return _submit(loop, lcms2.cmsOpenProfileFromFile,
+				(profileFilename,)).future
+
+def create_transform(inputProfile, inMode, outputProfile, outMode,
+				renderingIntent=lcms2.INTENT_PERCEPTUAL,
+				flags=lcms2.cmsFLAGS_NOTPRECALC, loop=None):
+	"""
+	Asynchronous cmsCreateTransform(). Returns future of transform handle.
+	"""
+	return _submit(loop, lcms2.cmsCreateTransform, (inputProfile, inMode,
+				outputProfile, outMode, renderingIntent, flags)).future
+
+def _transform_chunks(cancel_event, hTransform, inbuff, outbuff,
+					npixels, chunk_pixels):
+	sizes = lcms2._lcms2.getPixelSizes(hTransform)
+	if sizes is None:
+		raise lcms2.CmsError, 'Invalid transform handle provided'
+	in_size, out_size = sizes
+
+	try:
+		inview = memoryview(inbuff)
+		outview = memoryview(outbuff)
+	except TypeError:
+		# old-style buffers can't be sliced for writing
+		return lcms2.cmsDoTransformBuffer(hTransform, inbuff, outbuff, npixels)
+	if inview.ndim != 1 or inview.itemsize != 1 or \
+	outview.ndim != 1 or outview.itemsize != 1:
+		return lcms2.cmsDoTransformBuffer(hTransform, inbuff, outbuff, npixels)
+
+	if npixels < 0 or len(inview) < npixels * in_size or \
+	len(outview) < npixels * out_size:
+		return lcms2.cmsDoTransformBuffer(hTransform, inbuff, outbuff, npixels)
+
+	done = 0
+	while done < npixels:
+		if cancel_event.is_set():
+			raise _Cancelled()
+		count = min(chunk_pixels, npixels - done)
+		lcms2.cmsDoTransformBuffer(hTransform,
+						inview[done * in_size:(done + count) * in_size],
+						outview[done * out_size:(done + count) * out_size],
+						count)
+		done += count
+	return npixels
+
+def transform_buffer(hTransform, inbuff, outbuff, npixels,
+					chunk_pixels=1 << 20, loop=None):
+	"""
+	Asynchronous cmsDoTransformBuffer(). Returns future of transformed
+	pixel count. Pixels are transformed by chunks, so cancelled transform
+	stops after current chunk. Buffers should not be changed until
+	the future is done.
+
+	chunk_pixels - number of pixels transformed between cancellation checks
+	"""
+	if chunk_pixels < 1:
+		raise lcms2.CmsError, 'chunk_pixels should be positive: %s' % chunk_pixels
+	return _submit(loop, _transform_chunks, (hTransform, inbuff, outbuff,
+				npixels, chunk_pixels), cancellable=True).future
@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+#
+# 	Copyright (C) 2017 by Igor E. Novikov
+#
+# 	This program is free software: you can redistribute it and/or modify
+# 	it under the terms of the GNU General Public License as published by
+# 	the Free Software Foundation, either version 3 of the License, or
+# 	(at your option) any later version.
+#
+# 	This program is distributed in the hope that it will be useful,
+# 	but WITHOUT ANY WARRANTY; without even the implied warranty of
+# 	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# 	GNU General Public License for more details.
+#
+# 	You should have received a copy of the GNU General Public License
+# 	along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import threading
+from collections import OrderedDict
+
+class LRUCache(object):
+	"""
+	Bounded thread-safe cache which evicts least recently used items.
+	Items are built outside of the cache lock, so slow builds don't block
+	lookups from other threads.
+
+	maxsize - maximum number of cached items, zero disables caching
+	"""
+
+	def __init__(self, maxsize=128):
+		self._lock = threading.Lock()
+		self._items = OrderedDict()
+		self.maxsize = maxsize
+		self.hits = 0
+		self.misses = 0
+		self.evictions = 0
+
+	def __len__(self):
+		return len(self._items)
+
+	def __contains__(self, key):
+		return key in self._items
+
+	def _evict(self):
+		while len(self._items) > self.maxsize:
+			self._items.popitem(last=False)
+			self.evictions += 1
+
+	def get(self, key, builder):
+		"""
+		Returns cached item for the key. If there is no such item,
+		calls builder() and caches its result. None results are not cached.
+		"""
+		with self._lock:
+			if key in self._items:
+				item = self._items.pop(key)
+				self._items[key] = item
+				self.hits += 1
+				return item
+			self.misses += 1
+
+		item = builder()
+
+		if item is None or self.maxsize <= 0:
+			return item
+
+		with self._lock:
+			if key in self._items:
+				# concurrently built item wins to keep single instance
+				item = self._items.pop(key)
+			self._items[key] = item
+			self._evict()
+
+		return item
+
+	def set_maxsize(self, maxsize):
+		"""
+		Changes cache size evicting extra items.
+		"""
+		with self._lock:
+			self.maxsize = maxsize
+			self._evict()
+
+	def clear(self):
+		"""
+		Drops all cached items and resets counters.
+		"""
+		with self._lock:
+			self._items.clear()
+			self.hits = 0
+			self.misses = 0
+			self.evictions = 0
+
+	def stats(self):
+		"""
+		Returns dictionary of cache counters.
+		"""
+		with self._lock:
+			return {'size': len(self._items), 'maxsize': self.maxsize,
+				'hits': self.hits, 'misses': self.misses,
+				'evictions': self.evictions}
@@ -0,0 +1,336 @@
+# -*- coding: utf-8 -*-
+#
+# 	Copyright (C) 2017 by Igor E. Novikov
+#
+# 	This program is free software: you can redistribute it and/or modify
+# 	it under the terms of the GNU General Public License as published by
+# 	the Free Software Foundation, either version 3 of the License, or
+# 	(at your option) any later version.
+#
+# 	This program is distributed in the hope that it will be useful,
+# 	but WITHOUT ANY WARRANTY; without even the implied warranty of
+# 	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# 	GNU General Public License for more details.
+#
+# 	You should have received a copy of the GNU General Public License
+# 	along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import sys
+import json
+import struct
+import tempfile
+
+import lcms2
+
+PROFILE_EXTENSIONS = ('.icc', '.icm')
+
+# Description tags longer than this are truncated, profile pickers
+# don't need more
+_MAX_DESC_SIZE = 4096
+_MAX_TAG_COUNT = 1024
+_INDEX_VERSION = 1
+
+def get_system_profile_dirs():
+	"""
+	Returns list of existing system and user color profile directories.
+	"""
+	home = os.path.expanduser('~')
+	if os.name == 'nt':
+		root = os.environ.get('SystemRoot', 'C:\\Windows')
+		dirs = [os.path.join(root, 'System32', 'spool', 'drivers', 'color')]
+	elif sys.platform == 'darwin':
+		dirs = ['/System/Library/ColorSync/Profiles',
+			'/Library/ColorSync/Profiles',
+			os.path.join(home, 'Library', 'ColorSync', 'Profiles')]
+	else:
+		dirs = ['/usr/share/color/icc', '/usr/local/share/color/icc',
+			os.path.join(home, '.local', 'share', 'icc'),
+			os.path.join(home, '.color', 'icc')]
+	return [item for item in dirs if os.path.isdir(item)]
+
+def _signature(data):
+	return data.rstrip('\0 ')
+
+def _read_text(data):
+	# textDescriptionType (ICC v2), multiLocalizedUnicodeType (ICC v4)
+	# and textType tag data
+	sig = data[:4]
+	if sig == 'desc' and len(data) >= 12:
+		size = struct.unpack('>I', data[8:12])[0]
+		return data[12:12 + size].split('\0', 1)[0].decode('cp1252', 'replace')
+	if sig == 'mluc' and len(data) >= 16:
+		count, record_size = struct.unpack('>II', data[8:16])
+		if record_size < 12:
+			return u''
+		# counts of malformed tags are limited by tag data
+		count = min(count, (len(data) - 16) // record_size)
+		text = None
+		for i in xrange(count):
+			record = data[16 + i * record_size:28 + i * record_size]
+			lang = record[:2]
+			size, offset = struct.unpack('>II', record[4:12])
+			if text is None or lang == 'en':
+				text = data[offset:offset + size].decode('utf-16-be', 'replace')
+			if lang == 'en':
+				break
+		return (text or u'').split(u'\0', 1)[0]
+	if sig == 'text':
+		return data[8:].split('\0', 1)[0].decode('cp1252', 'replace')
+	return u''
+
+def read_profile_header(fileobj):
+	"""
+	Reads ICC profile header, tag table and description tag from file
+	object without loading the whole profile.
+
+	fileobj - file object positioned at profile start
+	Returns dictionary of color_space, pcs, device_class, version,
+	profile_id (hex string, all zeros if not calculated), size
+	and description. Raises CmsError for non-ICC data.
+	"""
+	header = fileobj.read(132)
+	if len(header) < 132 or header[36:40] != 'acsp':
+		raise lcms2.CmsError, 'It seems provided data is not ICC profile'
+
+	size = struct.unpack('>I', header[:4])[0]
+	major, minor = ord(header[8]), ord(header[9])
+	info = {
+		'size': size,
+		'version': '%d.%d' % (major, minor >> 4),
+		'device_class': _signature(header[12:16]),
+		'color_space': _signature(header[16:20]),
+		'pcs': _signature(header[20:24]),
+		'profile_id': header[84:100].encode('hex'),
+		'description': u'',
+	}
+
+	count = struct.unpack('>I', header[128:132])[0]
+	if count > _MAX_TAG_COUNT:
+		return info
+	table = fileobj.read(count * 12)
+	for i in range(len(table) // 12):
+		sig, offset, tag_size = struct.unpack('>4sII', table[i * 12:i * 12 + 12])
+		if sig == 'desc':
+			fileobj.seek(offset)
+			info['description'] = _read_text(fileobj.read(min(tag_size,
+															_MAX_DESC_SIZE)))
+			break
+	return info
+
+class ProfileEntry(object):
+	"""
+	Catalog record of ICC profile file. Header fields are available as
+	attributes, profile itself is opened on first open() call.
+	"""
+
+	fields = ('path', 'mtime', 'size', 'color_space', 'pcs', 'device_class',
+			'version', 'profile_id', 'description')
+
+	def __init__(self, **kwargs):
+		for name in self.fields:
+			setattr(self, name, kwargs.get(name))
+		self._profile = None
+
+	def __repr__(self):
+		return '<ProfileEntry %s %s %r>' % (self.device_class,
+										self.color_space, self.description)
+
+	def as_dict(self):
+		return dict([(name, getattr(self, name)) for name in self.fields])
+
+	def open(self):
+		"""
+		Returns profile handle, the profile is opened on first call.
+		"""
+		if self._profile is None:
+			self._profile = lcms2.cmsOpenProfileFromFile(self.path)
+		return self._profile
+
+def _scan_file(item):
+	path, mtime, size = item
+	try:
+		with open(path, 'rb') as fileobj:
+			info = read_profile_header(fileobj)
+	except (IOError, OSError, struct.error, ValueError, UnicodeError,
+		MemoryError, lcms2.CmsError):
+		# single broken file doesn't abort the scan
+		return None
+	info.update(path=path, mtime=mtime, size=size)
+	return ProfileEntry(**info)
+
+class ProfileCatalog(object):
+	"""
+	Catalog of ICC profiles found in directories. Only profile headers
+	and descriptions are read, files are read by pool of threads.
+	Catalog is persisted as JSON index keyed by path, modification time
+	and size of profile files, so repeated scans read changed files only.
+
+	index_path - JSON index file, catalog is not persisted if omitted
+	threads - number of scanning threads, by default equals to CPU count
+	"""
+
+	def __init__(self, index_path=None, threads=None):
+		self.index_path = index_path
+		self.threads = threads
+		self.entries = {}
+		self.parsed = 0
+		self.reused = 0
+		if index_path is not None:
+			self.load()
+
+	def __len__(self):
+		return len(self.entries)
+
+	def __iter__(self):
+		return iter(sorted(self.entries.values(), key=lambda item: item.path))
+
+	def load(self):
+		"""
+		Loads entries from JSON index. Missing or broken index is ignored.
+		"""
+		try:
+			with open(self.index_path, 'rb') as fileobj:
+				data = json.load(fileobj)
+			if data.get('version') != _INDEX_VERSION:
+				return
+			encoding = sys.getfilesystemencoding() or 'utf-8'
+			entries = {}
+			for item in data['entries']:
+				kwargs = dict([(str(key), value) for key, value in item.items()])
+				for name in ('color_space', 'pcs', 'device_class',
+							'version', 'profile_id'):
+					kwargs[name] = str(kwargs[name])
+				kwargs['path'] = kwargs['path'].encode(encoding)
+				entries[kwargs['path']] = ProfileEntry(**kwargs)
+		except (IOError, OSError, ValueError, KeyError, TypeError,
+			AttributeError, UnicodeError):
+			return
+		self.entries = entries
+
+	def save(self):
+		"""
+		Writes entries into JSON index.
+		"""
+		encoding = sys.getfilesystemencoding() or 'utf-8'
+		entries = []
+		for entry in self:
+			item = entry.as_dict()
+			item['path'] = item['path'].decode(encoding, 'replace')
+			entries.append(item)
+		data = json.dumps({'version': _INDEX_VERSION, 'entries': entries},
+						indent=1, sort_keys=True)
+		# written into temporary file and renamed, so concurrent
+		# processes never read partially written index
+		directory = os.path.dirname(os.path.abspath(self.index_path))
+		fd, tmp_path = tempfile.mkstemp(suffix='.tmp', dir=directory)
+		with os.fdopen(fd, 'wb') as fileobj:
+			fileobj.write(data)
+		if os.name == 'nt' and os.path.exists(self.index_path):
+			os.remove(self.index_path)
+		os.rename(tmp_path, self.index_path)
+
+	def _list_files(self, directories, recursive):
+		files = []
+		for directory in directories:
+			for root, dirs, names in os.walk(directory):
+				for name in names:
+					if os.path.splitext(name)[1].lower() in PROFILE_EXTENSIONS:
+						files.append(os.path.join(root, name))
+				if not recursive:
+					break
+		return files
+
+	def scan(self, directories=None, recursive=True):
+		"""
+		Scans directories for ICC profiles and updates the catalog. Files
+		with unchanged modification time and size are not read again,
+		entries of removed files are dropped. Index is saved if catalog
+		is persisted.
+
+		directories - list of directories, system profile directories
+				by default (see get_system_profile_dirs())
+		recursive - if True, subdirectories are scanned too
+		Returns list of catalog entries sorted by path.
+		"""
+		if directories is None:
+			directories = get_system_profile_dirs()
+
+		# entries of other directories are kept
+		prefixes = tuple([os.path.join(item, '') for item in directories])
+		entries = dict([(path, entry) for path, entry in self.entries.items()
+						if not path.startswith(prefixes)])
+		changed = []
+		self.parsed = self.reused = 0
+		for path in self._list_files(directories, recursive):
+			try:
+				stat = os.stat(path)
+			except OSError:
+				continue
+			entry = self.entries.get(path)
+			if entry is not None and entry.mtime == stat.st_mtime and \
+			entry.size == stat.st_size:
+				entries[path] = entry
+				self.reused += 1
+			else:
+				changed.append((path, stat.st_mtime, stat.st_size))
+
+		if changed:
+			threads = self.threads
+			if threads is None:
+				import multiprocessing
+				try:
+					threads = multiprocessing.cpu_count()
+				except NotImplementedError:
+					threads = 1
+			threads = max(1, min(threads, len(changed)))
+			if threads == 1:
+				results = map(_scan_file, changed)
+			else:
+				from multiprocessing.pool import ThreadPool
+				pool = ThreadPool(threads)
+				try:
+					results = pool.map(_scan_file, changed)
+				finally:
+					pool.close()
+			for entry in results:
+				if entry is not None:
+					entries[entry.path] = entry
+					self.parsed += 1
+
+		self.entries = entries
+		if self.index_path is not None:
+			try:
+				self.save()
+			except (IOError, OSError):
+				pass
+		return list(self)
+
+	def find(self, color_space=None, device_class=None, description=None):
+		"""
+		Returns catalog entries matching all provided criteria.
+
+		color_space - ICC color space signature, i.e. 'RGB' or 'CMYK'
+		device_class - ICC device class signature, i.e. 'mntr' or 'prtr'
+		description - case insensitive substring of profile description
+		"""
+		result = []
+		for entry in self:
+			if color_space is not None and entry.color_space != color_space:
+				continue
+			if device_class is not None and entry.device_class != device_class:
+				continue
+			if description is not None and \
+			description.lower() not in entry.description.lower():
+				continue
+			result.append(entry)
+		return result
+
+	def open_profile(self, path):
+		"""
+		Returns profile handle of catalog entry.
+		"""
+		entry = self.entries.get(path)
+		if entry is None:
+			raise lcms2.CmsError, 'Profile is not in catalog: %s' % path
+		return entry.open()
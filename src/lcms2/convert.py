@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+#
+# 	Copyright (C) 2017 by Igor E. Novikov
+#
+# 	This program is free software: you can redistribute it and/or modify
+# 	it under the terms of the GNU General Public License as published by
+# 	the Free Software Foundation, either version 3 of the License, or
+# 	(at your option) any later version.
+#
+# 	This program is distributed in the hope that it will be useful,
+# 	but WITHOUT ANY WARRANTY; without even the implied warranty of
+# 	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# 	GNU General Public License for more details.
+#
+# 	You should have received a copy of the GNU General Public License
+# 	along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Converts raw raster files between color spaces with bounded memory usage.
+
+Usage: python -m lcms2.convert -i in.icc -o out.icc [options] src dst
+Use '-' as src or dst for stdin or stdout.
+"""
+
+import sys
+import argparse
+
+import lcms2
+
+def get_parser():
+	parser = argparse.ArgumentParser(prog='python -m lcms2.convert',
+		description='Converts raw pixel stream from src to dst file.')
+	parser.add_argument('src', help="raw input raster, '-' for stdin")
+	parser.add_argument('dst', help="raw output raster, '-' for stdout")
+	parser.add_argument('-i', '--input-profile', required=True,
+		help='input ICC profile')
+	parser.add_argument('-o', '--output-profile', required=True,
+		help='output ICC profile')
+	parser.add_argument('--input-mode', default=lcms2.TYPE_RGB_8,
+		help='input pixel mode (default: %(default)s)')
+	parser.add_argument('--output-mode', default=lcms2.TYPE_CMYK_8,
+		help='output pixel mode (default: %(default)s)')
+	parser.add_argument('--intent', type=int, default=lcms2.INTENT_PERCEPTUAL,
+		help='rendering intent 0-3 (default: %(default)s)')
+	parser.add_argument('--bpc', action='store_true',
+		help='use black point compensation')
+	parser.add_argument('--chunk-pixels', type=int, default=65536,
+		help='pixels per transformed chunk (default: %(default)s)')
+	parser.add_argument('--link-cache', metavar='DIR',
+		help='directory of device link cache for built transforms')
+	return parser
+
+def main(argv=None):
+	args = get_parser().parse_args(argv)
+	flags = lcms2.cmsFLAGS_BLACKPOINTCOMPENSATION if args.bpc else 0
+
+	src = dst = None
+	try:
+		in_profile = lcms2.cmsOpenProfileFromFile(args.input_profile)
+		out_profile = lcms2.cmsOpenProfileFromFile(args.output_profile)
+		if args.link_cache:
+			from lcms2.linkcache import DeviceLinkCache
+			transform = DeviceLinkCache(args.link_cache).get_transform(
+							in_profile, args.input_mode,
+							out_profile, args.output_mode, args.intent, flags)
+		else:
+			transform = lcms2.cmsCreateTransform(in_profile, args.input_mode,
+							out_profile, args.output_mode, args.intent, flags)
+
+		src = sys.stdin if args.src == '-' else open(args.src, 'rb')
+		dst = sys.stdout if args.dst == '-' else open(args.dst, 'wb')
+		lcms2.transform_stream(transform, src, dst, args.chunk_pixels)
+	except (lcms2.CmsError, IOError), e:
+		sys.stderr.write('error: %s\n' % e)
+		return 1
+	finally:
+		if src not in (None, sys.stdin):
+			src.close()
+		if dst not in (None, sys.stdout):
+			dst.close()
+	return 0
+
+
+if __name__ == '__main__':
+	sys.exit(main())
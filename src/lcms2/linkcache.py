@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+#
+# 	Copyright (C) 2017 by Igor E. Novikov
+#
+# 	This program is free software: you can redistribute it and/or modify
+# 	it under the terms of the GNU General Public License as published by
+# 	the Free Software Foundation, either version 3 of the License, or
+# 	(at your option) any later version.
+#
+# 	This program is distributed in the hope that it will be useful,
+# 	but WITHOUT ANY WARRANTY; without even the implied warranty of
+# 	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# 	GNU General Public License for more details.
+#
+# 	You should have received a copy of the GNU General Public License
+# 	along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import hashlib
+import tempfile
+
+import lcms2
+
+# Flags which make transform depend on more than input/output pipeline,
+# such transforms cannot be replaced by device link.
+_BYPASS_FLAGS = lcms2.cmsFLAGS_GAMUTCHECK | lcms2.cmsFLAGS_SOFTPROOFING | \
+			lcms2.cmsFLAGS_NULLTRANSFORM
+
+class DeviceLinkCache(object):
+	"""
+	Persistent on-disk cache of built transforms. Each transform is stored
+	as device link profile, so later processes load it by single profile
+	open and cheap link transform instead of repeating optimization.
+	Cache keys include content of source profiles, transform parameters
+	and lcms version, so changed profiles produce new cache entries.
+
+	directory - cache directory, created if missing
+	version - ICC version of stored device links
+	"""
+
+	suffix = '.icc'
+
+	def __init__(self, directory, version=4.3):
+		self.directory = directory
+		self.version = version
+		self.loads = 0
+		self.stores = 0
+		if not os.path.isdir(directory):
+			os.makedirs(directory)
+
+	def _profile_digest(self, profile):
+		# digests are shared with transform_cache keys, see lcms2.digest_cache
+		result = lcms2._profile_digest(profile)
+		if result is None:
+			raise lcms2.CmsError, 'Cannot serialize profile'
+		return result
+
+	def get_key(self, inputProfile, inMode, outputProfile, outMode,
+			renderingIntent, flags):
+		"""
+		Returns hex cache key for provided transform parameters.
+		"""
+		parts = (self._profile_digest(inputProfile), inMode,
+				self._profile_digest(outputProfile), outMode,
+				renderingIntent, flags, self.version,
+				lcms2._lcms2.getVersion())
+		return hashlib.sha1(repr(parts)).hexdigest()
+
+	def get_path(self, key):
+		return os.path.join(self.directory, key + self.suffix)
+
+	def _load(self, path, inMode, outMode, renderingIntent, flags):
+		# alpha copying is a property of transform, not of device link
+		flags = lcms2.cmsFLAGS_NOTPRECALC | (flags & lcms2.cmsFLAGS_COPY_ALPHA)
+		try:
+			with open(path, 'rb') as fileobj:
+				data = fileobj.read()
+			link = lcms2.cmsOpenProfileFromMem(data)
+			transform = lcms2.cmsCreateLinkTransform(link, inMode, outMode,
+									renderingIntent, flags)
+		except (IOError, lcms2.CmsError):
+			return None
+		self.loads += 1
+		return transform
+
+	def _store(self, path, transform, flags):
+		data = lcms2.cmsSaveProfileToMem(lcms2.cmsTransform2DeviceLink(
+								transform, self.version, flags))
+		# written into temporary file and renamed, so concurrent
+		# processes never read partially written link
+		fd, tmp_path = tempfile.mkstemp(suffix='.tmp', dir=self.directory)
+		try:
+			with os.fdopen(fd, 'wb') as fileobj:
+				fileobj.write(data)
+			os.rename(tmp_path, path)
+		except OSError:
+			# target exists on Windows, i.e. stored by other process
+			os.remove(tmp_path)
+			return
+		self.stores += 1
+
+	def get_transform(self, inputProfile, inMode, outputProfile, outMode,
+					renderingIntent=lcms2.INTENT_PERCEPTUAL,
+					flags=lcms2.cmsFLAGS_NOTPRECALC):
+		"""
+		Returns transform handle like lcms2.cmsCreateTransform() does.
+		Stored device link is used if available, otherwise transform
+		is built and stored as device link for next calls.
+
+		inputProfile - a valid lcms profile handle
+		inMode - predefined string constant
+		outputProfile - a valid lcms profile handle
+		outMode - predefined string constant
+		renderingIntent - integer constant (0-3) specifying rendering intent
+				for the transform
+		flags - a set of predefined lcms flags
+		"""
+		if flags & _BYPASS_FLAGS:
+			return lcms2.cmsCreateTransform(inputProfile, inMode,
+							outputProfile, outMode, renderingIntent, flags)
+
+		try:
+			key = self.get_key(inputProfile, inMode, outputProfile, outMode,
+							renderingIntent, flags)
+		except lcms2.CmsError:
+			return lcms2.cmsCreateTransform(inputProfile, inMode,
+							outputProfile, outMode, renderingIntent, flags)
+
+		path = self.get_path(key)
+		if os.path.isfile(path):
+			transform = self._load(path, inMode, outMode, renderingIntent, flags)
+			if transform is not None:
+				return transform
+
+		transform = lcms2.cmsCreateTransform(inputProfile, inMode,
+							outputProfile, outMode, renderingIntent, flags)
+		try:
+			self._store(path, transform, flags)
+		except (IOError, OSError, lcms2.CmsError):
+			pass
+		return transform
+
+	def clear(self):
+		"""
+		Removes all stored device links.
+		"""
+		for name in os.listdir(self.directory):
+			if name.endswith(self.suffix):
+				os.remove(os.path.join(self.directory, name))
@@ -0,0 +1,382 @@
+# -*- coding: utf-8 -*-
+#
+# 	Copyright (C) 2017 by Igor E. Novikov
+#
+# 	This program is free software: you can redistribute it and/or modify
+# 	it under the terms of the GNU General Public License as published by
+# 	the Free Software Foundation, either version 3 of the License, or
+# 	(at your option) any later version.
+#
+# 	This program is distributed in the hope that it will be useful,
+# 	but WITHOUT ANY WARRANTY; without even the implied warranty of
+# 	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# 	GNU General Public License for more details.
+#
+# 	You should have received a copy of the GNU General Public License
+# 	along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Sampled lookup tables of lcms transforms. A transform is sampled once
+over regular grid by single bulk transform, the resulting LUT is applied
+by vectorized NumPy interpolation without any lcms state, so it can be
+pickled, saved or shared through shared memory between processes.
+"""
+
+import json
+import struct
+
+import lcms2
+
+TETRAHEDRAL = 'tetrahedral'
+TRILINEAR = 'trilinear'
+
+_MAGIC = 'LCMSLUT\x01'
+_CHUNK_PIXELS = 1 << 16
+
+# lcms colorspaces of float formats with their sample domains
+_PT_GRAY, _PT_RGB, _PT_CMY, _PT_CMYK, _PT_XYZ, _PT_Lab = 3, 4, 5, 6, 9, 10
+_FLOAT_DOMAINS = {
+	_PT_GRAY: ((0.0, 1.0),),
+	_PT_RGB: ((0.0, 1.0),) * 3,
+	_PT_CMY: ((0.0, 100.0),) * 3,
+	_PT_CMYK: ((0.0, 100.0),) * 4,
+	_PT_XYZ: ((0.0, 1.99997),) * 3,
+	_PT_Lab: ((0.0, 100.0), (-128.0, 127.0), (-128.0, 127.0)),
+}
+
+def _layout(fmt):
+	"""
+	Returns (dtype, samples per pixel, positions of color channels,
+	colorspace) for provided lcms pixel format. Positions list color
+	channels in colorant order, i.e. R, G, B for BGRA pixels.
+	"""
+	import numpy
+
+	channels = (fmt >> 3) & 15
+	extra = (fmt >> 7) & 7
+	nbytes = fmt & 7
+	isfloat = (fmt >> 22) & 1
+	if (fmt >> 12) & 1:
+		raise lcms2.CmsError, 'Planar formats are not supported by LUTs'
+	dtype = lcms2._ARRAY_DTYPES.get((nbytes or 8, isfloat or not nbytes))
+	if dtype is None:
+		raise lcms2.CmsError, 'Pixel format is not supported by LUTs'
+	dtype = numpy.dtype(dtype)
+	if (fmt >> 11) & 1 and nbytes == 2:
+		dtype = dtype.newbyteorder('S')
+
+	doswap = (fmt >> 10) & 1
+	swapfirst = (fmt >> 14) & 1
+	if swapfirst and not extra:
+		raise lcms2.CmsError, 'Rotated channel formats are not supported by LUTs'
+	first = extra if doswap != swapfirst else 0
+	positions = range(first, first + channels)
+	if doswap:
+		positions.reverse()
+	return dtype, channels + extra, positions, (fmt >> 16) & 31
+
+def _sample_max(dtype):
+	if dtype.kind == 'u':
+		return float((1 << (8 * dtype.itemsize)) - 1)
+	return None
+
+class LUT(object):
+	"""
+	Lookup table sampled from lcms transform by sample_lut().
+
+	table - ndarray of (g, ..., g, output channels) shape indexed by
+			input color channels in colorant order; uint16 for integer
+			transform outputs (full scale is 65535), float32 otherwise
+	domain - (min, max) input values of the first and the last grid
+			point for each input channel
+	in_format, out_format - lcms pixel formats of transform, LUT is
+			applied to pixels of the same formats
+	"""
+
+	def __init__(self, table, domain, in_format, out_format):
+		self.table = table
+		self.domain = tuple([tuple(item) for item in domain])
+		self.in_format = in_format
+		self.out_format = out_format
+
+	@property
+	def grid_points(self):
+		return self.table.shape[0]
+
+	@property
+	def input_channels(self):
+		return self.table.ndim - 1
+
+	@property
+	def output_channels(self):
+		return self.table.shape[-1]
+
+	def __getstate__(self):
+		return {'table': self.table, 'domain': self.domain,
+			'in_format': self.in_format, 'out_format': self.out_format}
+
+	def __setstate__(self, state):
+		self.__init__(state['table'], state['domain'],
+					state['in_format'], state['out_format'])
+
+	def interpolate(self, colors, method=TETRAHEDRAL):
+		"""
+		Interpolates LUT values of input colors.
+
+		colors - array of (..., input channels) shape of input values
+				in colorant order
+		method - TETRAHEDRAL (simplex interpolation, tetrahedral for 3D
+				and its generalization for other dimensions) or TRILINEAR
+				(multilinear for other dimensions)
+		Returns float32 array of (..., output channels) shape in table
+		units.
+		"""
+		import numpy
+
+		if method not in (TETRAHEDRAL, TRILINEAR):
+			raise lcms2.CmsError, 'Unknown interpolation method: %s' % (method,)
+		colors = numpy.asarray(colors, dtype=numpy.float64)
+		nin = self.input_channels
+		if colors.shape[-1:] != (nin,):
+			raise lcms2.CmsError, 'Colors should have %d channels' % nin
+
+		grid = self.grid_points
+		flat = self.table.reshape(-1, self.output_channels)
+		if flat.dtype != numpy.float32:
+			flat = flat.astype(numpy.float32)
+		strides = numpy.array([grid ** (nin - 1 - i) for i in range(nin)],
+							dtype=numpy.intp)
+		lo = numpy.array([item[0] for item in self.domain])
+		scale = (grid - 1) / (numpy.array([item[1] for item in self.domain]) - lo)
+
+		points = colors.reshape(-1, nin)
+		result = numpy.empty((len(points), self.output_channels),
+							dtype=numpy.float32)
+		rows = numpy.arange(_CHUNK_PIXELS)[:, None]
+		for start in range(0, len(points), _CHUNK_PIXELS):
+			chunk = points[start:start + _CHUNK_PIXELS]
+			pos = numpy.clip((chunk - lo) * scale, 0, grid - 1)
+			cell = numpy.minimum(pos.astype(numpy.intp), grid - 2)
+			frac = (pos - cell).astype(numpy.float32)
+			base = cell.dot(strides)
+			out = result[start:start + len(chunk)]
+
+			if method == TETRAHEDRAL:
+				# vertices of simplex are walked by descending fractions
+				order = numpy.argsort(-frac, axis=1)
+				frac = frac[rows[:len(chunk)], order]
+				out[:] = flat[base] * (1.0 - frac[:, 0])[:, None]
+				for i in range(nin):
+					base = base + strides[order[:, i]]
+					weight = frac[:, i] - frac[:, i + 1] if i + 1 < nin else frac[:, i]
+					out += flat[base] * weight[:, None]
+			else:
+				out[:] = 0.0
+				for corner in range(1 << nin):
+					weight = numpy.ones(len(chunk), dtype=numpy.float32)
+					offset = 0
+					for i in range(nin):
+						if corner >> i & 1:
+							weight *= frac[:, i]
+							offset += strides[i]
+						else:
+							weight *= 1.0 - frac[:, i]
+					out += flat[base + offset] * weight[:, None]
+
+		return result.reshape(colors.shape[:-1] + (self.output_channels,))
+
+	def apply(self, data, out=None, method=TETRAHEDRAL):
+		"""
+		Applies LUT to pixels packed in transform input format, like
+		the sampled transform does. Extra output channels are zeros.
+
+		data - ndarray of (..., samples per pixel) shape with input
+				format dtype or buffer object of packed pixels
+		out - optional writable ndarray for results
+		method - TETRAHEDRAL or TRILINEAR, see interpolate()
+		Returns ndarray of (..., output samples per pixel) shape
+		with output format dtype.
+		"""
+		import numpy
+
+		in_dtype, in_samples, in_pos, space = _layout(self.in_format)
+		out_dtype, out_samples, out_pos, space = _layout(self.out_format)
+		if isinstance(data, numpy.ndarray):
+			if data.dtype != in_dtype or data.shape[-1:] != (in_samples,):
+				msg = 'Array of %s with %s samples per pixel is required'
+				raise lcms2.CmsError, msg % (in_dtype, in_samples)
+		else:
+			data = numpy.frombuffer(data, dtype=in_dtype)
+			data = data[:len(data) // in_samples * in_samples]
+			data = data.reshape(-1, in_samples)
+
+		values = self.interpolate(data[..., in_pos], method)
+		out_max = _sample_max(out_dtype)
+		if out_max is not None:
+			if self.table.dtype == numpy.uint16:
+				values *= out_max / 65535.0
+			values = numpy.clip(numpy.around(values), 0, out_max)
+
+		shape = data.shape[:-1] + (out_samples,)
+		if out is None:
+			out = numpy.zeros(shape, dtype=out_dtype)
+		elif out.shape != shape or out.dtype != out_dtype:
+			msg = 'Output array should be %s array of %s shape'
+			raise lcms2.CmsError, msg % (out_dtype, shape)
+		for i, pos in enumerate(out_pos):
+			out[..., pos] = values[..., i]
+		return out
+
+	def save_cube(self, fileobj, title=None):
+		"""
+		Writes 3D LUT into file in Adobe/Resolve .cube format. Values are
+		normalized to 0.0-1.0 for integer outputs.
+
+		fileobj - file name or file-like object
+		title - optional LUT title
+		"""
+		if self.input_channels != 3 or self.output_channels != 3:
+			raise lcms2.CmsError, 'Only 3D LUTs of 3 output channels are ' + \
+				'supported by .cube format'
+		if isinstance(fileobj, basestring):
+			with open(fileobj, 'wb') as stream:
+				return self.save_cube(stream, title)
+
+		import numpy
+		grid = self.grid_points
+		lines = []
+		if title:
+			lines.append('TITLE "%s"' % title.replace('"', "'"))
+		lines.append('LUT_3D_SIZE %d' % grid)
+		lines.append('DOMAIN_MIN %s' % ' '.join(['%g' % item[0]
+												for item in self.domain]))
+		lines.append('DOMAIN_MAX %s' % ' '.join(['%g' % item[1]
+												for item in self.domain]))
+		values = self.table.astype(numpy.float64)
+		if self.table.dtype == numpy.uint16:
+			values /= 65535.0
+		# the first input channel changes fastest in .cube data
+		values = values.transpose(2, 1, 0, 3).reshape(-1, 3)
+		fileobj.write('\n'.join(lines) + '\n')
+		fileobj.write(''.join(['%.6f %.6f %.6f\n' % tuple(row)
+							for row in values]))
+
+	def tobytes(self):
+		"""
+		Returns binary LUT representation for load_lut().
+		"""
+		import numpy
+		header = json.dumps({
+			'shape': self.table.shape,
+			'dtype': self.table.dtype.str.replace('>', '<'),
+			'domain': self.domain,
+			'in_format': self.in_format,
+			'out_format': self.out_format,
+		})
+		# table data start is aligned to 16 bytes
+		header += ' ' * (-(len(_MAGIC) + 4 + len(header)) % 16)
+		table = self.table.astype(self.table.dtype.newbyteorder('<'))
+		return _MAGIC + struct.pack('<I', len(header)) + header + \
+			numpy.ascontiguousarray(table).tostring()
+
+	def save(self, fileobj):
+		"""
+		Writes binary LUT representation into file name or file object.
+		"""
+		if isinstance(fileobj, basestring):
+			with open(fileobj, 'wb') as stream:
+				return self.save(stream)
+		fileobj.write(self.tobytes())
+
+def load_lut(data):
+	"""
+	Loads LUT from binary representation (see LUT.tobytes()). Table
+	of LUT loaded from buffer object (i.e. mmap or shared memory)
+	is a view of the buffer, so its data is not copied.
+
+	data - file name or buffer object
+	"""
+	import numpy
+	if isinstance(data, basestring) and not data.startswith(_MAGIC):
+		with open(data, 'rb') as fileobj:
+			data = fileobj.read()
+	head = bytes(buffer(data, 0, len(_MAGIC) + 4))
+	if len(head) < len(_MAGIC) + 4 or head[:len(_MAGIC)] != _MAGIC:
+		raise lcms2.CmsError, 'It seems provided data is not LUT'
+	size = struct.unpack('<I', head[len(_MAGIC):])[0]
+	offset = len(_MAGIC) + 4 + size
+	try:
+		header = json.loads(bytes(buffer(data, len(_MAGIC) + 4, size)))
+		shape = tuple(header['shape'])
+		dtype = numpy.dtype(str(header['dtype']))
+		count = 1
+		for dim in shape:
+			count *= dim
+		table = numpy.frombuffer(data, dtype=dtype, count=count, offset=offset)
+	except (ValueError, KeyError, TypeError):
+		raise lcms2.CmsError, 'It seems provided LUT data is broken'
+	return LUT(table.reshape(shape), header['domain'],
+			header['in_format'], header['out_format'])
+
+def sample_lut(hTransform, grid_points=17, domain=None):
+	"""
+	Samples transform over regular grid of input colors by single bulk
+	transform and returns LUT object. Grid nodes of integer input
+	formats are rounded to sample values, so nodes are exact when
+	grid_points - 1 divides sample maximum (i.e. 16, 18, 52 grid points
+	for 8-bit input).
+
+	hTransform - a valid lcms transformation handle of non-planar
+			formats
+	grid_points - number of grid points per input channel (2-256)
+	domain - optional (min, max) input values of the first and the last
+			grid point for each input channel, by default full range
+			of integer samples and colorspace range of float samples
+	"""
+	import numpy
+
+	formats = lcms2._lcms2.getTransformFormats(hTransform)
+	if formats is None:
+		raise lcms2.CmsError, 'Invalid transform handle provided'
+	if not 2 <= grid_points <= 256:
+		raise lcms2.CmsError, 'grid_points should be between 2 and 256'
+	in_dtype, in_samples, in_pos, space = _layout(formats[0])
+	out_dtype, out_samples, out_pos, out_space = _layout(formats[1])
+	nin = len(in_pos)
+
+	in_max = _sample_max(in_dtype)
+	if domain is None:
+		if in_max is not None:
+			domain = ((0.0, in_max),) * nin
+		elif space in _FLOAT_DOMAINS and len(_FLOAT_DOMAINS[space]) == nin:
+			domain = _FLOAT_DOMAINS[space]
+		else:
+			raise lcms2.CmsError, 'Domain of input channels is required'
+	domain = tuple([(float(lo), float(hi)) for lo, hi in domain])
+	if len(domain) != nin or [1 for lo, hi in domain if hi <= lo]:
+		raise lcms2.CmsError, 'Domain should be (min, max) of %d channels' % nin
+
+	npixels = grid_points ** nin
+	if npixels > 1 << 26:
+		raise lcms2.CmsError, 'Too large LUT: %d grid points' % npixels
+	axes = [numpy.linspace(lo, hi, grid_points) for lo, hi in domain]
+	grid = numpy.meshgrid(*axes, indexing='ij')
+	pixels = numpy.zeros((npixels, in_samples), dtype=in_dtype)
+	for i, pos in enumerate(in_pos):
+		values = grid[i].reshape(-1)
+		if in_max is not None:
+			values = numpy.around(values)
+		pixels[:, pos] = values
+
+	out = numpy.empty((npixels, out_samples), dtype=out_dtype)
+	lcms2.cmsDoTransformBuffer(hTransform, pixels, out, npixels)
+	values = out[:, out_pos]
+	out_max = _sample_max(out_dtype)
+	if out_max is not None:
+		table = numpy.around(values.astype(numpy.float64) * (65535.0 / out_max))
+		table = table.astype(numpy.uint16)
+	else:
+		table = values.astype(numpy.float32)
+
+	shape = (grid_points,) * nin + (len(out_pos),)
+	return LUT(table.reshape(shape), domain, formats[0], formats[1])
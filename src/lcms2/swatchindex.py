@@ -0,0 +1,181 @@
+# -*- coding: utf-8 -*-
+#
+# 	Copyright (C) 2017 by Igor E. Novikov
+#
+# 	This program is free software: you can redistribute it and/or modify
+# 	it under the terms of the GNU General Public License as published by
+# 	the Free Software Foundation, either version 3 of the License, or
+# 	(at your option) any later version.
+#
+# 	This program is distributed in the hope that it will be useful,
+# 	but WITHOUT ANY WARRANTY; without even the implied warranty of
+# 	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# 	GNU General Public License for more details.
+#
+# 	You should have received a copy of the GNU General Public License
+# 	along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import array
+
+import lcms2
+from lcms2 import _lcms2, CmsError, DELTA_E_CIE76, DELTA_E_CIEDE2000
+
+def _is_buffer(colors):
+	return hasattr(colors, '__array_interface__') or \
+		isinstance(colors, (str, bytearray, array.array, buffer, memoryview))
+
+def _buffer_bytes(colors):
+	try:
+		return memoryview(colors).tobytes()
+	except TypeError:
+		# old-style buffers (array.array, mmap)
+		return str(buffer(colors))
+
+def colors_to_lab(colors, mode=lcms2.TYPE_Lab_DBL, profile=None,
+				renderingIntent=lcms2.INTENT_RELATIVE_COLORIMETRIC):
+	"""
+	Converts colors into array.array('d') of L, a, b values
+	(TYPE_Lab_DBL pixels) by transform into D50 Lab.
+
+	colors - sequence of color channel tuples or buffer of packed pixels
+			in mode
+	mode - input mode of colors, Lab values are copied as is if mode
+			is TYPE_Lab_DBL and profile is not provided
+	profile - handle to color profile of colors
+	renderingIntent - rendering intent of transform into Lab
+	"""
+	if profile is None:
+		if mode != lcms2.TYPE_Lab_DBL:
+			raise CmsError, 'Color profile is required for %s colors' % (mode,)
+		if _is_buffer(colors):
+			if hasattr(colors, '__array_interface__'):
+				import numpy
+				colors = numpy.ascontiguousarray(colors, dtype=numpy.float64)
+			lab = array.array('d')
+			lab.fromstring(_buffer_bytes(colors))
+			return lab
+		lab = array.array('d', [0.0]) * (3 * len(colors))
+		for i, color in enumerate(colors):
+			lab[i * 3:i * 3 + 3] = array.array('d', color[:3])
+		return lab
+
+	transform = lcms2.cmsCreateTransform(profile, mode,
+						lcms2.cmsCreateLabProfile(), lcms2.TYPE_Lab_DBL,
+						renderingIntent, 0)
+	if _is_buffer(colors):
+		in_size = _lcms2.getPixelSizes(transform)[0]
+		npixels = lcms2._buffer_size(colors) // in_size
+		lab = array.array('d', [0.0]) * (3 * npixels)
+		lcms2.cmsDoTransformBuffer(transform, colors, lab, npixels)
+		return lab
+	lab = array.array('d', [0.0]) * (3 * len(colors))
+	for i, color in enumerate(colors):
+		lab[i * 3:i * 3 + 3] = array.array('d', transform.apply(*color)[:3])
+	return lab
+
+class SwatchIndex(object):
+	"""
+	Nearest color index of swatch library. Colors are converted into Lab
+	once and stored in implicit k-d tree, i.e. in Lab array ordered by
+	tree nodes and array of color ids, so index is compact and picklable
+	for worker processes. Queries are Lab colors (see colors_to_lab()),
+	results are (id, difference) pairs where id is position of color
+	in source colors list.
+
+	CIEDE2000 queries are exact too, they search CIE76 radius which
+	encloses all colors of requested CIEDE2000 difference and re-rank
+	found colors. Such radius grows with chroma of query color, so
+	CIEDE2000 queries of saturated colors are slower.
+
+	colors - sequence of color channel tuples or buffer of packed pixels
+	mode - input mode of colors
+	profile - handle to color profile of colors, not required
+			for TYPE_Lab_DBL colors
+	names - optional list of color names
+	renderingIntent - rendering intent of transform into Lab
+	"""
+
+	def __init__(self, colors, mode=lcms2.TYPE_Lab_DBL, profile=None,
+				names=None, renderingIntent=lcms2.INTENT_RELATIVE_COLORIMETRIC):
+		self._points = colors_to_lab(colors, mode, profile, renderingIntent)
+		count = len(self._points) // 3
+		if names is not None and len(names) != count:
+			raise CmsError, 'Names count does not match colors count'
+		self.names = list(names) if names is not None else None
+		self._ids = array.array('i', xrange(count))
+		if _lcms2.kdBuild(self._points, self._ids) is None:
+			raise CmsError, 'Cannot build swatch index'
+
+	def __len__(self):
+		return len(self._ids)
+
+	def _params(self, method, params):
+		if method not in (DELTA_E_CIE76, DELTA_E_CIEDE2000):
+			raise CmsError, 'Unsupported delta E method: %s' % (method,)
+		weights = list(lcms2._DELTA_E_PARAMS.get(method, (0.0, 0.0, 0.0)))
+		if params is not None:
+			weights[:len(params)] = params
+		return tuple(weights)
+
+	def nearest_many(self, colors, k=1, method=DELTA_E_CIE76, params=None):
+		"""
+		Finds k nearest colors for each query color by native code with
+		released GIL.
+
+		colors - sequence of Lab tuples or buffer of Lab doubles
+		k - number of nearest colors
+		method - DELTA_E_CIE76 or DELTA_E_CIEDE2000
+		params - (Kl, Kc, Kh) weighting parameters for DELTA_E_CIEDE2000
+		Returns (ids, differences) tuple of array.array('i') and
+		array.array('d') of len(colors) * k items, k items per query
+		color sorted by difference. Ids are -1 if index holds less
+		than k colors.
+		"""
+		weights = self._params(method, params)
+		if k < 1:
+			raise CmsError, 'Number of nearest colors should be positive: %s' % k
+		queries = colors_to_lab(colors)
+		nqueries = len(queries) // 3
+		ids = array.array('i', [-1]) * (nqueries * k)
+		distances = array.array('d', [0.0]) * (nqueries * k)
+		if _lcms2.kdNearest(self._points, self._ids, queries, k, method, weights, ids, distances) is None:
+			raise CmsError, 'Cannot search swatch index'
+		return ids, distances
+
+	def nearest(self, color, k=1, method=DELTA_E_CIE76, params=None):
+		"""
+		Finds k nearest colors for Lab color. Returns list of up to k
+		(id, difference) tuples sorted by difference.
+		"""
+		ids, distances = self.nearest_many([color], k, method, params)
+		return [(ids[i], distances[i]) for i in range(k) if ids[i] >= 0]
+
+	def within(self, color, radius, method=DELTA_E_CIE76, params=None):
+		"""
+		Finds colors within radius from Lab color.
+
+		color - Lab tuple
+		radius - maximum color difference
+		method - DELTA_E_CIE76 or DELTA_E_CIEDE2000
+		params - (Kl, Kc, Kh) weighting parameters for DELTA_E_CIEDE2000
+		Returns list of (id, difference) tuples sorted by difference.
+		"""
+		return self.within_many([color], radius, method, params)[0]
+
+	def within_many(self, colors, radius, method=DELTA_E_CIE76, params=None):
+		"""
+		Finds colors within radius from each query color by single native
+		call with released GIL.
+
+		colors - sequence of Lab tuples or buffer of Lab doubles
+		radius - maximum color difference
+		method - DELTA_E_CIE76 or DELTA_E_CIEDE2000
+		params - (Kl, Kc, Kh) weighting parameters for DELTA_E_CIEDE2000
+		Returns list of within() results, one per query color.
+		"""
+		weights = self._params(method, params)
+		result = _lcms2.kdWithin(self._points, self._ids, colors_to_lab(colors),
+							radius, method, weights)
+		if result is None:
+			raise CmsError, 'Cannot search swatch index'
+		return result
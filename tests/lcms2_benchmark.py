@@ -0,0 +1,247 @@
+# -*- coding: utf-8 -*-
+#
+# 	Copyright (C) 2017 by Igor E. Novikov
+#
+# 	This program is free software: you can redistribute it and/or modify
+# 	it under the terms of the GNU General Public License as published by
+# 	the Free Software Foundation, either version 3 of the License, or
+# 	(at your option) any later version.
+#
+# 	This program is distributed in the hope that it will be useful,
+# 	but WITHOUT ANY WARRANTY; without even the implied warranty of
+# 	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# 	GNU General Public License for more details.
+#
+# 	You should have received a copy of the GNU General Public License
+# 	along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Benchmark suite for lcms2 package. Measures profile open and transform
+build latency, throughput of single pixel and bulk transforms for 8-bit,
+16-bit and double formats, all rendering intents and precalculation
+flags, and scaling of parallel_transform().
+
+Usage: python lcms2_benchmark.py [--pixels N] [--repeat N] [--json FILE]
+							[--parallel WIDTH HEIGHT [THREADS]]
+"""
+
+import lcms2
+import os, sys, time, json, platform, argparse, multiprocessing
+
+_pkgdir = os.path.dirname(__file__)
+
+FLAG_SETS = [
+	('notprecalc', lcms2.cmsFLAGS_NOTPRECALC),
+	('precalc', 0),
+	('highres', lcms2.cmsFLAGS_HIGHRESPRECALC),
+	('lowres', lcms2.cmsFLAGS_LOWRESPRECALC),
+]
+
+INTENTS = [
+	('perceptual', lcms2.INTENT_PERCEPTUAL),
+	('relative', lcms2.INTENT_RELATIVE_COLORIMETRIC),
+	('saturation', lcms2.INTENT_SATURATION),
+	('absolute', lcms2.INTENT_ABSOLUTE_COLORIMETRIC),
+]
+
+# (name, input mode, output mode, maximum sample value, color constructor)
+FORMAT_SETS = [
+	('8bit', lcms2.TYPE_RGBA_8, lcms2.TYPE_CMYK_8, 255, lcms2.COLORB),
+	('16bit', lcms2.TYPE_RGBA_16, lcms2.TYPE_CMYK_16, 65535, lcms2.COLORW),
+	('double', lcms2.TYPE_RGB_DBL, lcms2.TYPE_CMYK_DBL, 1.0, lcms2.cmsCIELab),
+]
+
+def get_filepath(filename):
+	return os.path.join(_pkgdir, 'cms_data', filename)
+
+def measure(func, *args):
+	best = None
+	for i in range(3):
+		start = time.time()
+		func(*args)
+		elapsed = time.time() - start
+		if best is None or elapsed < best:
+			best = elapsed
+	return best
+
+def measure_cold(func, repeat):
+	"""
+	Returns best time of func() calls with emptied package caches, so
+	profiles and transforms are really opened and built.
+	"""
+	best = None
+	for i in range(repeat):
+		lcms2.transform_cache.clear()
+		lcms2.profile_cache.clear()
+		start = time.time()
+		func()
+		elapsed = time.time() - start
+		if best is None or elapsed < best:
+			best = elapsed
+	return best
+
+class Report(object):
+
+	def __init__(self, stream=None):
+		self.results = []
+		self.stream = stream or sys.stdout
+
+	def add(self, group, name, value, unit):
+		self.results.append({'group': group, 'name': name,
+							'value': value, 'unit': unit})
+		self.stream.write('%-12s %-36s %12.3f %s\n' % (group, name, value, unit))
+
+	def as_dict(self):
+		return {
+			'lcms_version': lcms2._lcms2.getVersion(),
+			'python': platform.python_version(),
+			'platform': platform.platform(),
+			'cpu_count': multiprocessing.cpu_count(),
+			'timestamp': int(time.time()),
+			'results': self.results,
+		}
+
+def make_pixels(npixels, mode, maxval):
+	channels, extra, nbytes, isfloat, planar = lcms2._lcms2.getFormatInfo(
+											lcms2.FORMATS[mode])
+	size = npixels * (channels + extra)
+	if isfloat:
+		import array
+		data = array.array('d', [(i % 97) / 96.0 * maxval for i in range(size)])
+		return bytearray(data.tostring())
+	if nbytes == 2:
+		import array
+		data = array.array('H', [(i * 257) % 65536 for i in range(size)])
+		return bytearray(data.tostring())
+	return bytearray(os.urandom(size))
+
+def bench_profiles(report, repeat):
+	for name in ('sRGB.icm', 'CMYK.icm'):
+		path = get_filepath(name)
+		elapsed = measure_cold(lambda: lcms2.cmsOpenProfileFromFile(path),
+							repeat)
+		report.add('open', 'file %s' % name, elapsed * 1e3, 'ms')
+		with open(path, 'rb') as fileobj:
+			data = fileobj.read()
+		elapsed = measure_cold(lambda: lcms2.cmsOpenProfileFromMem(data),
+							repeat)
+		report.add('open', 'mem %s' % name, elapsed * 1e3, 'ms')
+
+def bench_builds(report, in_profile, out_profile, repeat):
+	for flag_name, flags in FLAG_SETS:
+		for intent_name, intent in INTENTS:
+			elapsed = measure_cold(lambda: lcms2.cmsCreateTransform(
+								in_profile, lcms2.TYPE_RGBA_8,
+								out_profile, lcms2.TYPE_CMYK_8, intent, flags),
+								repeat)
+			report.add('build', '%s %s' % (flag_name, intent_name),
+					elapsed * 1e3, 'ms')
+
+def bench_pixels(report, in_profile, out_profile, npixels):
+	single_count = max(1, min(npixels, 20000))
+	for fmt_name, in_mode, out_mode, maxval, color in FORMAT_SETS:
+		for flag_name, flags in FLAG_SETS:
+			transform = lcms2.cmsCreateTransform(in_profile, in_mode,
+							out_profile, out_mode,
+							lcms2.INTENT_PERCEPTUAL, flags)
+			name = '%s %s' % (fmt_name, flag_name)
+
+			colors = [color(*[(i * k % 97) / 96.0 * maxval for k in (3, 5, 7)])
+					for i in range(64)]
+			if not isinstance(maxval, float):
+				colors = [[int(v) for v in item[:4]] + item[4:]
+						for item in colors]
+			outcolor = color()
+
+			def single():
+				for i in xrange(single_count):
+					lcms2.cmsDoTransform(transform, colors[i & 63], outcolor)
+
+			elapsed = measure(single)
+			report.add('single', name, single_count / elapsed / 1e6, 'Mpx/s')
+
+			inbuff = make_pixels(npixels, in_mode, maxval)
+			outbuff = bytearray(npixels * lcms2._lcms2.getPixelSizes(
+											transform)[1])
+			elapsed = measure(lcms2.cmsDoTransformBuffer, transform,
+							inbuff, outbuff, npixels)
+			report.add('buffer', name, npixels / elapsed / 1e6, 'Mpx/s')
+
+def bench_intents(report, in_profile, out_profile, npixels):
+	inbuff = make_pixels(npixels, lcms2.TYPE_RGBA_8, 255)
+	outbuff = bytearray(npixels * 4)
+	for intent_name, intent in INTENTS:
+		transform = lcms2.cmsCreateTransform(in_profile, lcms2.TYPE_RGBA_8,
+						out_profile, lcms2.TYPE_CMYK_8, intent, 0)
+		elapsed = measure(lcms2.cmsDoTransformBuffer, transform,
+						inbuff, outbuff, npixels)
+		report.add('intent', intent_name, npixels / elapsed / 1e6, 'Mpx/s')
+
+def run_parallel_benchmark(width=4096, height=4096, max_threads=None,
+						report=None):
+	if max_threads is None:
+		max_threads = multiprocessing.cpu_count()
+	in_profile = lcms2.cmsOpenProfileFromFile(get_filepath('sRGB.icm'))
+	out_profile = lcms2.cmsOpenProfileFromFile(get_filepath('CMYK.icm'))
+	transform = lcms2.cmsCreateTransform(in_profile, lcms2.TYPE_RGBA_8,
+					out_profile, lcms2.TYPE_CMYK_8, lcms2.INTENT_PERCEPTUAL, 0)
+	npixels = width * height
+	inbuff = bytearray(os.urandom(npixels * 4))
+	outbuff = bytearray(npixels * 4)
+	if report is None:
+		report = Report()
+
+	base = measure(lcms2.cmsDoTransformBuffer, transform,
+				inbuff, outbuff, npixels)
+	report.add('parallel', '%dx%d buffer' % (width, height),
+			npixels / base / 1e6, 'Mpx/s')
+
+	threads = 1
+	while threads <= max_threads:
+		elapsed = measure(lcms2.parallel_transform, transform,
+						inbuff, outbuff, width, height, threads)
+		report.add('parallel', '%dx%d %d thr' % (width, height, threads),
+				npixels / elapsed / 1e6, 'Mpx/s')
+		if threads < max_threads and threads * 2 > max_threads:
+			threads = max_threads
+		else:
+			threads *= 2
+	return report
+
+def run_benchmarks(npixels=1 << 18, repeat=5, parallel=None, stream=None):
+	report = Report(stream)
+	in_profile = lcms2.cmsOpenProfileFromFile(get_filepath('sRGB.icm'))
+	out_profile = lcms2.cmsOpenProfileFromFile(get_filepath('CMYK.icm'))
+	bench_profiles(report, repeat)
+	bench_builds(report, in_profile, out_profile, repeat)
+	bench_pixels(report, in_profile, out_profile, npixels)
+	bench_intents(report, in_profile, out_profile, npixels)
+	if parallel:
+		run_parallel_benchmark(*parallel, report=report)
+	return report
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(description='lcms2 benchmark suite')
+	parser.add_argument('--pixels', type=int, default=1 << 18,
+		help='pixels per bulk transform (default: %(default)s)')
+	parser.add_argument('--repeat', type=int, default=5,
+		help='cold runs per latency measurement (default: %(default)s)')
+	parser.add_argument('--json', metavar='FILE',
+		help="write results as JSON into FILE, '-' for stdout")
+	parser.add_argument('--parallel', type=int, nargs='+',
+		metavar='N', help='run parallel benchmark: WIDTH HEIGHT [THREADS]')
+	args = parser.parse_args(argv)
+
+	# table goes to stderr when JSON is written to stdout
+	stream = sys.stderr if args.json == '-' else sys.stdout
+	report = run_benchmarks(args.pixels, args.repeat, args.parallel, stream)
+	if args.json == '-':
+		json.dump(report.as_dict(), sys.stdout, indent=1, sort_keys=True)
+	elif args.json:
+		with open(args.json, 'wb') as fileobj:
+			json.dump(report.as_dict(), fileobj, indent=1, sort_keys=True)
+	return report
+
+
+if __name__ == '__main__':
+	main()
@@ -16,7 +16,12 @@
 # 	along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import lcms2
-import unittest, os
+import lcms2.linkcache
+import lcms2.convert
+import lcms2.swatchindex
+import lcms2.catalog
+import lcms2.lut
+import unittest, os, shutil, tempfile, pickle, StringIO
 
 _pkgdir = os.path.dirname(__file__)
 
@@ -76,6 +81,62 @@ class TestCmsFunctions(unittest.TestCase):
 			return
 		self.fail()
 
+	def test07a_open_profile_from_mem(self):
+		import array, mmap
+		data = open(get_filepath('CMYK.icm'), 'rb').read()
+		lcms2.profile_cache.clear()
+		profile = lcms2.cmsOpenProfileFromMem(data)
+		self.assertEqual('Fogra27L CMYK Coated Press',
+						lcms2.cmsGetProfileName(profile))
+		self.assertTrue(profile is lcms2.cmsOpenProfileFromMem(bytearray(data)))
+		self.assertTrue(profile is lcms2.cmsOpenProfileFromMem(
+						array.array('B', data)))
+		self.assertEqual(1, len(lcms2.profile_cache))
+		collection = mmap.mmap(-1, len(data) + 200)
+		collection[100:100 + len(data)] = data
+		self.assertTrue(profile is lcms2.cmsOpenProfileFromMem(collection,
+						100, len(data)))
+		lcms2.profile_cache.clear()
+		profile = lcms2.cmsOpenProfileFromMem(memoryview(collection[:]),
+						100, len(data))
+		transform = lcms2.cmsCreateTransform(profile, lcms2.TYPE_CMYK_8,
+						self.inProfile, lcms2.TYPE_RGBA_8)
+		rgb = lcms2.COLORB()
+		lcms2.cmsDoTransform(transform, lcms2.COLORB(), rgb)
+		self.assertTrue(rgb[0] > 200)
+
+		# cached handles don't depend on caller's buffer
+		lcms2.profile_cache.clear()
+		lcms2.transform_cache.clear()
+		lcms2.cmsOpenProfileFromMem(collection, 100, len(data))
+		collection.close()
+		buff = bytearray(data)
+		profile = lcms2.cmsOpenProfileFromMem(buff)
+		buff[:] = ''
+		transform = lcms2.cmsCreateTransform(profile, lcms2.TYPE_CMYK_8,
+						self.inProfile, lcms2.TYPE_RGBA_8)
+		lcms2.cmsDoTransform(transform, lcms2.COLORB(), rgb)
+		self.assertTrue(rgb[0] > 200)
+
+	def test07b_open_invalid_profile_from_mem(self):
+		data = open(get_filepath('CMYK.icm'), 'rb').read()
+		self.assertRaises(lcms2.CmsError, lcms2.cmsOpenProfileFromMem, '')
+		self.assertRaises(lcms2.CmsError, lcms2.cmsOpenProfileFromMem,
+						data[:200])
+		self.assertRaises(lcms2.CmsError, lcms2.cmsOpenProfileFromMem,
+						data, 10)
+		self.assertRaises(lcms2.CmsError, lcms2.cmsOpenProfileFromMem,
+						data, 0, len(data) + 1)
+		self.assertRaises(lcms2.CmsError, lcms2.cmsOpenProfileFromMem,
+						data, -1)
+		self.assertRaises(lcms2.CmsError, lcms2.cmsOpenProfileFromMem, None)
+
+	def test08a_create_transform_of_large_pixels(self):
+		# 15 channels with 7 extra doubles don't fit single pixel buffers
+		fmt = (15 << 3) | (7 << 7) | (1 << 22)
+		self.assertRaises(lcms2.CmsError, lcms2.cmsCreateTransform,
+						self.inProfile, lcms2.TYPE_RGB_8, self.inProfile, fmt)
+
 	def test08_create_transform(self):
 		self.assertNotEqual(None, lcms2.cmsCreateTransform(self.inProfile,
 				lcms2.TYPE_RGB_8, self.outProfile, lcms2.TYPE_CMYK_8))
@@ -149,6 +210,219 @@ class TestCmsFunctions(unittest.TestCase):
 			return
 		self.fail()
 
+	def test13a_transform_cache(self):
+		cache = lcms2.transform_cache
+		cache.clear()
+		t1 = lcms2.cmsCreateTransform(self.inProfile, lcms2.TYPE_RGB_8,
+				self.outProfile, lcms2.TYPE_CMYK_8)
+		t2 = lcms2.cmsCreateTransform(
+				lcms2.cmsOpenProfileFromFile(get_filepath('sRGB.icm')),
+				lcms2.TYPE_RGB_8, self.outProfile, lcms2.TYPE_CMYK_8)
+		t3 = lcms2.cmsCreateTransform(self.inProfile, lcms2.TYPE_RGB_8,
+				self.outProfile, lcms2.TYPE_CMYK_8, lcms2.INTENT_PERCEPTUAL, 0)
+		self.assertTrue(t1 is t2)
+		self.assertFalse(t1 is t3)
+		p1 = lcms2.cmsCreateProofingTransform(self.inProfile, lcms2.TYPE_RGB_8,
+				self.inProfile, lcms2.TYPE_RGB_8, self.outProfile)
+		p2 = lcms2.cmsCreateProofingTransform(self.inProfile, lcms2.TYPE_RGB_8,
+				self.inProfile, lcms2.TYPE_RGB_8, self.outProfile)
+		self.assertTrue(p1 is p2)
+		stats = cache.stats()
+		self.assertEqual(2, stats['hits'])
+		self.assertEqual(3, stats['misses'])
+		self.assertEqual(3, stats['size'])
+		cache.clear()
+		self.assertEqual(0, len(cache))
+		self.assertEqual(0, cache.stats()['hits'])
+
+		# stored profile ID is not trusted, it can stay after editing
+		import hashlib, struct
+		data = bytearray(open(get_filepath('sRGB.icm'), 'rb').read())
+		count = struct.unpack('>I', str(data[128:132]))[0]
+		for i in range(count):
+			tag = 132 + i * 12
+			if data[tag:tag + 4] == 'rXYZ':
+				offset = struct.unpack('>I', str(data[tag + 4:tag + 8]))[0]
+		header = data[:44] + '\0' * 4 + data[48:64] + '\0' * 4 + \
+			data[68:84] + '\0' * 16 + data[100:]
+		data[84:100] = hashlib.md5(str(header)).digest()
+		edited = bytearray(data)
+		edited[offset + 8:offset + 12] = struct.pack('>i', 0x4000)
+		p1 = lcms2.cmsOpenProfileFromMem(str(data))
+		p2 = lcms2.cmsOpenProfileFromMem(str(edited))
+		t1 = lcms2.cmsCreateTransform(p1, lcms2.TYPE_RGB_8,
+				self.outProfile, lcms2.TYPE_CMYK_8)
+		t2 = lcms2.cmsCreateTransform(p2, lcms2.TYPE_RGB_8,
+				self.outProfile, lcms2.TYPE_CMYK_8)
+		self.assertFalse(t1 is t2)
+		self.assertNotEqual(t1.apply(255, 0, 0), t2.apply(255, 0, 0))
+		# profile ID is not written into header of caller's profile
+		self.assertEqual('\0' * 16,
+						lcms2.cmsSaveProfileToMem(self.inProfile)[84:100])
+
+	def test13b_private_transform(self):
+		lcms2.transform_cache.clear()
+		t1 = lcms2.cmsCreateTransform(self.inProfile, lcms2.TYPE_RGB_8,
+				self.outProfile, lcms2.TYPE_CMYK_8)
+		t2 = lcms2.cmsCreateTransform(self.inProfile, lcms2.TYPE_RGB_8,
+				self.outProfile, lcms2.TYPE_CMYK_8, cached=False)
+		t3 = lcms2.cmsCreateTransform(self.inProfile, lcms2.TYPE_RGB_8,
+				self.outProfile, lcms2.TYPE_CMYK_8)
+		self.assertTrue(t1 is t3)
+		self.assertFalse(t1 is t2)
+		self.assertEqual(1, len(lcms2.transform_cache))
+		lcms2.enable_color_cache(t2)
+		self.assertEqual(None, lcms2.get_color_cache_stats(t1))
+		self.assertEqual(t1.apply(10, 20, 30), t2.apply(10, 20, 30))
+		a1 = lcms2.cmsCreateAdaptiveTransform(self.inProfile,
+				lcms2.TYPE_RGB_8, self.outProfile, lcms2.TYPE_CMYK_8)
+		a2 = lcms2.cmsCreateAdaptiveTransform(self.inProfile,
+				lcms2.TYPE_RGB_8, self.outProfile, lcms2.TYPE_CMYK_8)
+		a1.apply(10, 20, 30)
+		self.assertFalse(a1 is a2)
+		self.assertEqual(0, lcms2.get_precalc_info(a2)['pixels'])
+		a3 = lcms2.cmsCreateAdaptiveTransform(self.inProfile,
+				lcms2.TYPE_RGB_8, self.outProfile, lcms2.TYPE_CMYK_8,
+				cached=True)
+		self.assertTrue(a3 is lcms2.cmsCreateAdaptiveTransform(self.inProfile,
+				lcms2.TYPE_RGB_8, self.outProfile, lcms2.TYPE_CMYK_8,
+				cached=True))
+
+	def test13c_transform_cache_eviction(self):
+		cache = lcms2.cache.LRUCache(2)
+		self.assertEqual(1, cache.get('a', lambda: 1))
+		self.assertEqual(2, cache.get('b', lambda: 2))
+		self.assertEqual(1, cache.get('a', lambda: None))
+		self.assertEqual(3, cache.get('c', lambda: 3))
+		self.assertTrue('a' in cache and 'c' in cache)
+		self.assertFalse('b' in cache)
+		self.assertEqual(1, cache.evictions)
+		self.assertEqual(None, cache.get('d', lambda: None))
+		self.assertFalse('d' in cache)
+		cache.set_maxsize(0)
+		self.assertEqual(0, len(cache))
+		self.assertEqual(4, cache.get('e', lambda: 4))
+		self.assertEqual(0, len(cache))
+
+	def test13d_device_link_cache(self):
+		directory = tempfile.mkdtemp()
+		try:
+			cache = lcms2.linkcache.DeviceLinkCache(directory)
+			transform = cache.get_transform(self.inProfile, lcms2.TYPE_RGBA_8,
+						self.outProfile, lcms2.TYPE_CMYK_8,
+						lcms2.INTENT_PERCEPTUAL, 0)
+			self.assertEqual((0, 1), (cache.loads, cache.stores))
+			self.assertEqual(1, len(os.listdir(directory)))
+
+			cache = lcms2.linkcache.DeviceLinkCache(directory)
+			link_transform = cache.get_transform(self.inProfile,
+						lcms2.TYPE_RGBA_8, self.outProfile, lcms2.TYPE_CMYK_8,
+						lcms2.INTENT_PERCEPTUAL, 0)
+			self.assertEqual((1, 0), (cache.loads, cache.stores))
+			self.assertNotEqual(transform, link_transform)
+			for color in ((0, 0, 0), (255, 255, 255), (255, 0, 0),
+						(10, 128, 200), (90, 250, 30)):
+				rgb = lcms2.COLORB(*color)
+				cmyk = lcms2.COLORB()
+				link_cmyk = lcms2.COLORB()
+				lcms2.cmsDoTransform(transform, rgb, cmyk)
+				lcms2.cmsDoTransform(link_transform, rgb, link_cmyk)
+				for i in range(4):
+					self.assertTrue(abs(cmyk[i] - link_cmyk[i]) <= 2)
+
+			cache.clear()
+			self.assertEqual([], os.listdir(directory))
+		finally:
+			shutil.rmtree(directory)
+
+	def test13e_device_link_cache_keys(self):
+		directory = tempfile.mkdtemp()
+		lcms2.digest_cache.clear()
+		try:
+			cache = lcms2.linkcache.DeviceLinkCache(directory)
+			key = cache.get_key(self.inProfile, lcms2.TYPE_RGBA_8,
+						self.outProfile, lcms2.TYPE_CMYK_8, 0, 0)
+			self.assertEqual(key, cache.get_key(self.inProfile,
+						lcms2.TYPE_RGBA_8, self.outProfile, lcms2.TYPE_CMYK_8,
+						0, 0))
+			self.assertNotEqual(key, cache.get_key(self.inProfile,
+						lcms2.TYPE_RGBA_8, lcms2.cmsCreateLabProfile(),
+						lcms2.TYPE_Lab_DBL, 0, 0))
+			self.assertNotEqual(key, cache.get_key(self.inProfile,
+						lcms2.TYPE_RGBA_8, self.outProfile, lcms2.TYPE_CMYK_8,
+						1, 0))
+			cache.get_transform(self.inProfile, lcms2.TYPE_RGBA_8,
+						self.outProfile, lcms2.TYPE_CMYK_8, 0,
+						lcms2.cmsFLAGS_GAMUTCHECK)
+			self.assertEqual([], os.listdir(directory))
+			self.assertEqual(3, len(lcms2.digest_cache))
+			self.assertEqual(3, lcms2.digest_cache.misses)
+
+			key = cache.get_key(self.inProfile, lcms2.TYPE_RGBA_8,
+						self.outProfile, lcms2.TYPE_CMYK_8, 0, 0)
+			os.mkdir(cache.get_path(key))
+			cache.get_transform(self.inProfile, lcms2.TYPE_RGBA_8,
+						self.outProfile, lcms2.TYPE_CMYK_8, 0, 0)
+			self.assertEqual(0, cache.stores)
+			self.assertEqual(1, len(os.listdir(directory)))
+		finally:
+			shutil.rmtree(directory)
+
+	def test13f_create_transform_with_packed_formats(self):
+		rgba = bytearray([255, 255, 255, 0, 100, 190, 150, 0, 10, 20, 30, 0])
+		ref = bytearray(12)
+		lcms2.cmsDoTransformBuffer(self.transform, rgba, ref, 3)
+		for in_mode, rgb in (
+				(lcms2.TYPE_RGB_8, [255, 255, 255, 100, 190, 150, 10, 20, 30]),
+				(lcms2.TYPE_BGR_8, [255, 255, 255, 150, 190, 100, 30, 20, 10]),
+				(lcms2.TYPE_ARGB_8, [0, 255, 255, 255, 0, 100, 190, 150,
+									0, 10, 20, 30])):
+			transform = lcms2.cmsCreateTransform(self.inProfile, in_mode,
+							self.outProfile, lcms2.TYPE_CMYK_8,
+							lcms2.INTENT_PERCEPTUAL, lcms2.cmsFLAGS_NOTPRECALC)
+			cmyk = bytearray(12)
+			lcms2.cmsDoTransformBuffer(transform, bytearray(rgb), cmyk, 3)
+			self.assertEqual(ref, cmyk)
+
+		transform = lcms2.cmsCreateTransform(self.inProfile, lcms2.TYPE_RGB_8,
+						self.outProfile, lcms2.TYPE_CMYKA_8,
+						lcms2.INTENT_PERCEPTUAL, lcms2.cmsFLAGS_NOTPRECALC)
+		self.assertEqual((3, 5), lcms2._lcms2.getPixelSizes(transform))
+
+	def test13g_create_transform_with_float_formats(self):
+		import array
+		ref = bytearray(4)
+		lcms2.cmsDoTransformBuffer(self.transform,
+								bytearray([100, 190, 150, 0]), ref, 1)
+		transform = lcms2.cmsCreateTransform(self.inProfile,
+						lcms2.TYPE_RGB_FLT, self.outProfile, lcms2.TYPE_CMYK_FLT,
+						lcms2.INTENT_PERCEPTUAL, lcms2.cmsFLAGS_NOTPRECALC)
+		cmyk = array.array('f', [0.0] * 4)
+		lcms2.cmsDoTransformBuffer(transform,
+					array.array('f', [100 / 255.0, 190 / 255.0, 150 / 255.0]),
+					cmyk, 1)
+		for i in range(4):
+			self.assertTrue(abs(cmyk[i] * 2.55 - ref[i]) < 2.0)
+
+		transform = lcms2.cmsCreateTransform(self.inProfile,
+						lcms2.TYPE_RGB_HALF_FLT, self.outProfile,
+						lcms2.TYPE_CMYK_16_SE, lcms2.INTENT_PERCEPTUAL,
+						lcms2.cmsFLAGS_NOTPRECALC)
+		self.assertEqual((6, 8), lcms2._lcms2.getPixelSizes(transform))
+
+	def test13h_create_transform_with_unknown_format(self):
+		self.assertRaises(lcms2.CmsError, lcms2.cmsCreateTransform,
+						self.inProfile, 'RGB;48', self.outProfile,
+						lcms2.TYPE_CMYK_8)
+		self.assertRaises(lcms2.CmsError, lcms2.cmsCreateTransform,
+						self.inProfile, lcms2.TYPE_RGBA_8, self.outProfile,
+						None)
+		fmt = lcms2.FORMATS[lcms2.TYPE_RGB_16]
+		self.assertEqual((3, 0, 2, 0, 0), lcms2._lcms2.getFormatInfo(fmt))
+		transform = lcms2.cmsCreateTransform(self.inProfile, fmt,
+						self.outProfile, lcms2.TYPE_CMYK_8)
+		self.assertEqual((6, 4), lcms2._lcms2.getPixelSizes(transform))
+
 	#---8bit transform tests
 
 	def test14_do_transform_with_null_input(self):
@@ -205,6 +479,69 @@ class TestCmsFunctions(unittest.TestCase):
 			return
 		self.fail()
 
+	def test18a_do_transform_with_color_cache(self):
+		transform = lcms2.cmsCreateTransform(self.inProfile,
+						lcms2.TYPE_RGBA_8, self.outProfile, lcms2.TYPE_CMYK_8,
+						lcms2.INTENT_PERCEPTUAL, lcms2.cmsFLAGS_BLACKPOINTCOMPENSATION,
+						cached=False)
+		colors = [(100, 190, 150), (255, 255, 255), (0, 0, 0), (10, 20, 30)]
+		refs = []
+		for color in colors:
+			cmyk = lcms2.COLORB()
+			lcms2.cmsDoTransform(transform, lcms2.COLORB(*color), cmyk)
+			refs.append(cmyk)
+		self.assertEqual(None, lcms2.get_color_cache_stats(transform))
+		self.assertEqual(4, lcms2.enable_color_cache(transform, 3))
+		for i in range(5):
+			for color, ref in zip(colors, refs):
+				cmyk = lcms2.COLORB()
+				lcms2.cmsDoTransform(transform, lcms2.COLORB(*color), cmyk)
+				self.assertEqual(ref, cmyk)
+		stats = lcms2.get_color_cache_stats(transform)
+		self.assertEqual(4, stats['capacity'])
+		self.assertEqual(20, stats['hits'] + stats['misses'])
+		self.assertEqual(stats['misses'], stats['size'] + stats['evictions'])
+		self.assertTrue(stats['hits'] > 0)
+		self.assertTrue(0.0 < stats['hit_rate'] <= 0.8)
+		lcms2.disable_color_cache(transform)
+		self.assertEqual(None, lcms2.get_color_cache_stats(transform))
+		self.assertRaises(lcms2.CmsError, lcms2.enable_color_cache,
+						transform, 0)
+		self.assertRaises(lcms2.CmsError, lcms2.disable_color_cache, None)
+
+	def test18b_transform_apply(self):
+		self.assertTrue(isinstance(self.transform, lcms2._lcms2.Transform))
+		self.assertTrue(isinstance(self.inProfile, lcms2._lcms2.Profile))
+		self.assertEqual(lcms2.FORMATS[lcms2.TYPE_RGBA_8],
+						self.transform.input_format)
+		self.assertEqual(lcms2.FORMATS[lcms2.TYPE_CMYK_8],
+						self.transform.output_format)
+
+		cmyk = lcms2.COLORB()
+		lcms2.cmsDoTransform(self.transform, lcms2.COLORB(100, 190, 150), cmyk)
+		self.assertEqual(tuple(cmyk[:4]), self.transform.apply(100, 190, 150))
+		out = [0, 0, 0, 0]
+		self.assertEqual(None, self.transform.apply_into(out, 100, 190, 150, 0))
+		self.assertEqual(cmyk[:4], out)
+		cmyk16 = self.transform_16b.apply(65535, 65535, 65535, 0)
+		self.assertEqual(4, len(cmyk16))
+		self.assertTrue(cmyk16[0] < 256)
+
+		lab_profile = lcms2.cmsCreateLabProfile()
+		transform = lcms2.cmsCreateTransform(self.inProfile,
+						lcms2.TYPE_RGB_8, lab_profile, lcms2.TYPE_Lab_DBL)
+		lab = transform.apply(255, 255, 255)
+		self.assertEqual(3, len(lab))
+		self.assertTrue(abs(lab[0] - 100.0) < 0.1)
+		out = lcms2.cmsCIELab()
+		transform.apply_into(out, 255, 255, 255)
+		self.assertEqual(list(lab) + [0.0, lcms2.COLOR_DBL], out)
+
+		self.assertRaises(TypeError, self.transform.apply, 'a')
+		self.assertRaises(TypeError, self.transform.apply_into, (0, 0, 0, 0))
+		self.assertRaises(lcms2.CmsError, lcms2.cmsDoTransform,
+						None, lcms2.COLORB(), lcms2.COLORB())
+
 	#---16bit transform tests
 
 	def test19_do_transform_16b_with_null_input(self):
@@ -262,8 +599,838 @@ class TestCmsFunctions(unittest.TestCase):
 		self.fail()
 
 
+	#---Buffer transform tests
+
+	def test24_do_transform_buffer(self):
+		rgb = bytearray([255, 255, 255, 0, 100, 190, 150, 0])
+		cmyk = bytearray(8)
+		ret = lcms2.cmsDoTransformBuffer(self.transform, rgb, cmyk, 2)
+		self.assertEqual(2, ret)
+		self.assertEqual([0, 0, 0, 0], list(cmyk[:4]))
+		ref = lcms2.COLORB()
+		lcms2.cmsDoTransform(self.transform, lcms2.COLORB(100, 190, 150), ref)
+		self.assertEqual(ref[:4], list(cmyk[4:]))
+
+	def test25_do_transform_buffer_objects(self):
+		import array, mmap
+		rgb = array.array('B', [100, 190, 150, 0] * 16)
+		outputs = [bytearray(64), array.array('B', [0] * 64), mmap.mmap(-1, 64)]
+		for item in outputs:
+			lcms2.cmsDoTransformBuffer(self.transform, rgb, item, 16)
+		lcms2.cmsDoTransformBuffer(self.transform, memoryview(rgb.tostring()),
+								outputs[0], 16)
+		self.assertEqual(str(outputs[0]), outputs[1].tostring())
+		self.assertEqual(str(outputs[0]), outputs[2][:])
+
+	def test26_do_transform_buffer_16b(self):
+		import array
+		rgb = array.array('H', [65535, 65535, 65535, 0, 25535, 35535, 30535, 0])
+		cmyk = array.array('H', [0] * 8)
+		lcms2.cmsDoTransformBuffer(self.transform_16b, rgb, cmyk, 2)
+		self.assertTrue(max(cmyk[:4]) < 10)
+		self.assertNotEqual(0, min(cmyk[4:]))
+
+	def test27_do_transform_buffer_with_short_buffers(self):
+		rgb = bytearray(16)
+		cmyk = bytearray(16)
+		self.assertRaises(lcms2.CmsError, lcms2.cmsDoTransformBuffer,
+						self.transform, rgb, cmyk, 5)
+		self.assertRaises(lcms2.CmsError, lcms2.cmsDoTransformBuffer,
+						self.transform, rgb, bytearray(12), 4)
+		self.assertRaises(lcms2.CmsError, lcms2.cmsDoTransformBuffer,
+						self.transform, rgb, 'readonly' * 2, 4)
+		self.assertRaises(lcms2.CmsError, lcms2.cmsDoTransformBuffer,
+						self.transform, rgb, cmyk, -1)
+		self.assertRaises(lcms2.CmsError, lcms2.cmsDoTransformBuffer,
+						None, rgb, cmyk, 4)
+
+	def test27a_do_transform_line_stride(self):
+		# 2x2 crop at (1, 1) of 4x3 image, transformed in place
+		image = bytearray(range(48))
+		ref = bytearray(16)
+		crop = image[20:28] + image[36:44]
+		lcms2.cmsDoTransformBuffer(self.transform, crop, ref, 4)
+		ret = lcms2.cmsDoTransformLineStride(self.transform, buffer(image, 20),
+								memoryview(image)[20:], 2, 2, 16, 16)
+		self.assertEqual(2, ret)
+		self.assertEqual(ref, image[20:28] + image[36:44])
+		self.assertEqual(bytearray(range(20)), image[:20])
+		self.assertEqual(bytearray(range(28, 36)), image[28:36])
+
+	def test27b_do_transform_line_stride_planar(self):
+		rgb = bytearray([255, 255, 255, 100, 190, 150, 10, 20, 30, 0, 0, 0])
+		ref = bytearray(16)
+		transform = lcms2.cmsCreateTransform(self.inProfile, lcms2.TYPE_RGB_8,
+						self.outProfile, lcms2.TYPE_CMYK_8,
+						lcms2.INTENT_PERCEPTUAL, lcms2.cmsFLAGS_NOTPRECALC)
+		lcms2.cmsDoTransformBuffer(transform, rgb, ref, 4)
+		transform = lcms2.cmsCreateTransform(self.inProfile, lcms2.TYPE_RGB_8,
+						self.outProfile, lcms2.TYPE_CMYK_8_PLANAR,
+						lcms2.INTENT_PERCEPTUAL, lcms2.cmsFLAGS_NOTPRECALC)
+		# planes of 2x2 separations placed with 10 bytes plane stride
+		planes = bytearray(40)
+		lcms2.cmsDoTransformLineStride(transform, rgb, planes, 2, 2, 6, 2, 0, 10)
+		for channel in range(4):
+			plane = planes[channel * 10:channel * 10 + 4]
+			self.assertEqual(ref[channel::4], plane)
+
+	def test27c_do_transform_line_stride_with_short_buffers(self):
+		rgb = bytearray(48)
+		self.assertRaises(lcms2.CmsError, lcms2.cmsDoTransformLineStride,
+						self.transform, rgb, bytearray(48), 4, 3, 20, 16)
+		self.assertRaises(lcms2.CmsError, lcms2.cmsDoTransformLineStride,
+						self.transform, rgb, bytearray(47), 4, 3, 16, 16)
+		self.assertRaises(lcms2.CmsError, lcms2.cmsDoTransformLineStride,
+						self.transform, rgb, bytearray(48), 4, 3, 16, -16)
+		transform = lcms2.cmsCreateTransform(self.inProfile, lcms2.TYPE_RGBA_8,
+						self.outProfile, lcms2.TYPE_CMYK_8_PLANAR)
+		self.assertRaises(lcms2.CmsError, lcms2.cmsDoTransformLineStride,
+						transform, rgb, bytearray(40), 4, 3, 16, 4)
+		self.assertRaises(lcms2.CmsError, lcms2.parallel_transform,
+						transform, rgb, bytearray(48), 4, 3)
+
+	def test27d_transform_stream(self):
+		import io
+		rgb = bytearray(range(256)) * 3
+		ref = bytearray(768)
+		lcms2.cmsDoTransformBuffer(self.transform, rgb, ref, 192)
+		chunks = [str(rgb[i:i + 7]) for i in range(0, len(rgb), 7)]
+		for src in (str(rgb), rgb, memoryview(rgb), io.BytesIO(rgb), chunks):
+			dst = io.BytesIO()
+			ret = lcms2.transform_stream(self.transform, src, dst, 50)
+			self.assertEqual(192, ret)
+			self.assertEqual(str(ref), dst.getvalue())
+		sizes = [len(item) for item in
+				lcms2.iter_transform(self.transform, rgb, 50)]
+		self.assertEqual([200, 200, 200, 168], sizes)
+		self.assertRaises(lcms2.CmsError, lcms2.transform_stream,
+						self.transform, rgb[:-1], io.BytesIO())
+
+	def test27e_convert_command(self):
+		directory = tempfile.mkdtemp()
+		try:
+			src = os.path.join(directory, 'image.rgb')
+			dst = os.path.join(directory, 'image.cmyk')
+			rgb = bytearray(range(255)) * 4
+			with open(src, 'wb') as fileobj:
+				fileobj.write(rgb)
+			ret = lcms2.convert.main(['-i', get_filepath('sRGB.icm'),
+							'-o', get_filepath('CMYK.icm'),
+							'--chunk-pixels', '100', src, dst])
+			self.assertEqual(0, ret)
+			transform = lcms2.cmsCreateTransform(self.inProfile,
+							lcms2.TYPE_RGB_8, self.outProfile, lcms2.TYPE_CMYK_8,
+							lcms2.INTENT_PERCEPTUAL, 0)
+			ref = bytearray(1360)
+			lcms2.cmsDoTransformBuffer(transform, rgb, ref, 340)
+			with open(dst, 'rb') as fileobj:
+				self.assertEqual(str(ref), fileobj.read())
+		finally:
+			shutil.rmtree(directory)
+
+	def test27f_async_functions(self):
+		try:
+			import lcms2.aio
+		except ImportError:
+			self.skipTest('trollius and futures are required by lcms2.aio')
+		asyncio = lcms2.aio.asyncio
+		loop = asyncio.new_event_loop()
+		lcms2.aio.configure(max_concurrency=2)
+		try:
+			profile = loop.run_until_complete(lcms2.aio.open_profile(
+							get_filepath('sRGB.icm'), loop=loop))
+			transform = loop.run_until_complete(lcms2.aio.create_transform(
+							profile, lcms2.TYPE_RGBA_8,
+							self.outProfile, lcms2.TYPE_CMYK_8,
+							lcms2.INTENT_PERCEPTUAL, 0, loop=loop))
+			rgb = bytearray(range(256)) * 4
+			ref = bytearray(1024)
+			lcms2.cmsDoTransformBuffer(transform, rgb, ref, 256)
+			outputs = [bytearray(1024) for i in range(4)]
+			futures = [lcms2.aio.transform_buffer(transform, rgb, item, 256,
+							chunk_pixels=16, loop=loop) for item in outputs]
+			futures[-1].cancel()
+			loop.run_until_complete(asyncio.wait(futures[:-1], loop=loop))
+			for item in futures[:-1]:
+				self.assertEqual(256, item.result())
+			for item in outputs[:-1]:
+				self.assertEqual(ref, item)
+			self.assertTrue(futures[-1].cancelled())
+			self.assertRaises(lcms2.CmsError, loop.run_until_complete,
+							lcms2.aio.open_profile('absent.icc', loop=loop))
+		finally:
+			loop.close()
+
+		# jobs of closed loops release their slots
+		import time
+		loop = asyncio.new_event_loop()
+		for i in range(3):
+			lcms2.aio.open_profile(get_filepath('sRGB.icm'), loop=loop)
+		loop.close()
+		for i in range(100):
+			if not lcms2.aio._running and not lcms2.aio._queue:
+				break
+			time.sleep(0.01)
+		self.assertEqual((0, 0), (lcms2.aio._running, len(lcms2.aio._queue)))
+
+	def test27g_stats(self):
+		lcms2.enable_stats()
+		lcms2.reset_stats()
+		try:
+			profile = lcms2.cmsCreateLabProfile()
+			stats = lcms2.get_stats()
+			self.assertTrue(stats['enabled'])
+			self.assertEqual(1, stats['profiles_opened'])
+			live = stats['profiles_live']
+			del profile
+			stats = lcms2.get_stats()
+			self.assertEqual(1, stats['profiles_closed'])
+			self.assertEqual(live - 1, stats['profiles_live'])
+
+			lcms2.transform_cache.clear()
+			transform = lcms2.cmsCreateTransform(self.inProfile,
+							lcms2.TYPE_RGB_8, self.outProfile, lcms2.TYPE_CMYK_8,
+							lcms2.INTENT_PERCEPTUAL, 0)
+			lcms2.cmsDoTransformBuffer(transform, bytearray(30), bytearray(40), 10)
+			lcms2.cmsDoTransform(self.transform, lcms2.COLORB(), lcms2.COLORB())
+			stats = lcms2.get_stats()
+			self.assertEqual(1, stats['transforms_built'])
+			self.assertTrue(stats['build_time'] > 0)
+			self.assertEqual(2, stats['transform_calls'])
+			self.assertEqual(11, stats['pixels'])
+			self.assertEqual({lcms2.TYPE_RGB_8: 10, lcms2.TYPE_RGBA_8: 1},
+							stats['pixels_by_format'])
+			del transform
+			lcms2.transform_cache.clear()
+			self.assertTrue(lcms2.get_stats()['transforms_freed'] >= 1)
+
+			lcms2.reset_stats()
+			stats = lcms2.get_stats()
+			self.assertEqual(0, stats['pixels'])
+			self.assertEqual({}, stats['pixels_by_format'])
+		finally:
+			lcms2.enable_stats(False)
+
+	def test27h_slow_build_hook(self):
+		builds = []
+		lcms2.set_slow_build_hook(builds.append, 0.0)
+		try:
+			lcms2.transform_cache.clear()
+			lcms2.cmsCreateTransform(self.inProfile, lcms2.TYPE_RGBA_16,
+							self.outProfile, lcms2.TYPE_CMYK_16,
+							lcms2.INTENT_SATURATION, 0)
+		finally:
+			lcms2.set_slow_build_hook(None)
+		self.assertEqual(1, len(builds))
+		self.assertEqual(lcms2.TYPE_RGBA_16, builds[0]['input_format'])
+		self.assertEqual(lcms2.TYPE_CMYK_16, builds[0]['output_format'])
+		self.assertEqual(lcms2.INTENT_SATURATION, builds[0]['intent'])
+		self.assertFalse(builds[0]['proofing'])
+		self.assertRaises(lcms2.CmsError, lcms2.set_slow_build_hook, 1)
+
+	def test27i_transform_palette(self):
+		palette = bytearray([255, 0, 0, 0, 0, 255, 0, 0, 10, 20, 30, 0])
+		ref = bytearray(12)
+		lcms2.cmsDoTransformBuffer(self.transform, palette, ref, 3)
+		self.assertEqual(str(ref),
+						lcms2.transform_palette(self.transform, palette))
+
+		indices = bytearray([2, 0, 1, 1, 0])
+		cmyk = lcms2.transform_palette(self.transform, palette, indices)
+		self.assertEqual(20, len(cmyk))
+		self.assertEqual(ref[8:12] + ref[0:4] + ref[4:8] * 2 + ref[0:4], cmyk)
+		out = bytearray(24)
+		self.assertTrue(out is lcms2.transform_palette(self.transform,
+												palette, indices, out))
+		self.assertEqual(cmyk, out[:20])
+
+		import array
+		words = array.array('H', [1, 2, 0])
+		cmyk = lcms2.transform_palette(self.transform, palette, words,
+									index_size=2)
+		self.assertEqual(ref[4:12] + ref[0:4], cmyk)
+		unaligned = bytearray(1) + bytearray(words.tostring())
+		cmyk = lcms2.transform_palette(self.transform, palette,
+									memoryview(unaligned)[1:], index_size=2)
+		self.assertEqual(ref[4:12] + ref[0:4], cmyk)
+		self.assertRaises(lcms2.CmsError, lcms2.transform_palette,
+						self.transform, palette, memoryview(unaligned)[1:6],
+						index_size=2)
+		words = array.array('H', [1, 2, 0, 3])
+		self.assertRaises(lcms2.CmsError, lcms2.transform_palette,
+						self.transform, palette, words, index_size=2)
+
+		self.assertRaises(lcms2.CmsError, lcms2.transform_palette,
+						self.transform, palette, bytearray([3]))
+		self.assertRaises(lcms2.CmsError, lcms2.transform_palette,
+						self.transform, palette, bytearray([0, 1, 2, 3]))
+		self.assertRaises(lcms2.CmsError, lcms2.transform_palette,
+						self.transform, palette, indices, bytearray(16))
+		self.assertRaises(lcms2.CmsError, lcms2.transform_palette,
+						self.transform, bytearray(2), indices)
+		self.assertRaises(lcms2.CmsError, lcms2.transform_palette,
+						self.transform, palette, indices, None, 3)
+		self.assertRaises(lcms2.CmsError, lcms2.transform_palette,
+						None, palette, indices)
+
+	def test27j_gamut_check(self):
+		transform = lcms2.cmsCreateGamutCheckTransform(self.inProfile,
+						lcms2.TYPE_RGB_8, self.outProfile)
+		self.assertTrue(transform is lcms2.cmsCreateGamutCheckTransform(
+						self.inProfile, lcms2.TYPE_RGB_8, self.outProfile))
+		# blue and green are out of press gamut, grays are inside
+		rgb = bytearray([0, 0, 255, 128, 128, 128, 0, 255, 0] + [200] * 27)
+		mask, count = lcms2.gamut_check(transform, rgb, 12)
+		self.assertEqual(2, count)
+		self.assertEqual(bytearray([0xa0, 0x00]), mask)
+		mask, count = lcms2.gamut_check(transform, rgb, 3, packed=False)
+		self.assertEqual((bytearray([1, 0, 1]), 2), (mask, count))
+		out = bytearray(4)
+		self.assertTrue(out is lcms2.gamut_check(transform, rgb, 3, out)[0])
+
+		import array
+		transform = lcms2.cmsCreateGamutCheckTransform(self.inProfile,
+						lcms2.TYPE_RGB_DBL, self.outProfile)
+		rgb = array.array('d', [0.0, 0.0, 1.0, 0.5, 0.5, 0.5])
+		self.assertEqual((bytearray([0x80]), 1),
+						lcms2.gamut_check(transform, rgb, 2))
+
+		self.assertRaises(lcms2.CmsError, lcms2.gamut_check,
+						transform, rgb, 3)
+		self.assertRaises(lcms2.CmsError, lcms2.gamut_check,
+						transform, rgb, 2, bytearray(1), False)
+		self.assertRaises(lcms2.CmsError, lcms2.gamut_check,
+						self.transform, bytearray(4), 1)
+		self.assertRaises(lcms2.CmsError, lcms2.gamut_check,
+						None, rgb, 2)
+
+	def test28_parallel_transform(self):
+		import random
+		width, height = 67, 131
+		rgb = bytearray(random.randint(0, 255) for i in range(width * height * 4))
+		cmyk = bytearray(width * height * 4)
+		ref = bytearray(width * height * 4)
+		lcms2.cmsDoTransformBuffer(self.transform2, rgb, ref, width * height)
+		for threads in (1, 2, 3, 8, 500):
+			cmyk[:] = bytearray(len(cmyk))
+			ret = lcms2.parallel_transform(self.transform2, rgb, cmyk,
+										width, height, threads)
+			self.assertEqual(min(threads, height), ret)
+			self.assertEqual(ref, cmyk)
+		self.assertTrue(lcms2.parallel_transform(self.transform2, rgb, cmyk,
+												width, height) >= 1)
+
+	def test29_parallel_transform_with_incorrect_args(self):
+		rgb = bytearray(64)
+		cmyk = bytearray(64)
+		self.assertRaises(lcms2.CmsError, lcms2.parallel_transform,
+						self.transform, rgb, cmyk, 4, 5, 2)
+		self.assertRaises(lcms2.CmsError, lcms2.parallel_transform,
+						self.transform, rgb, cmyk, 4, 4, 0)
+		self.assertEqual(1, lcms2.parallel_transform(self.transform,
+						rgb, cmyk, 0, 0, 4))
+
+	#---NumPy array transform tests
+
+	def test40_transform_array(self):
+		try:
+			import numpy
+		except ImportError:
+			return
+		rgb = numpy.zeros((3, 5, 4), dtype=numpy.uint8)
+		rgb[:, :, :3] = (100, 190, 150)
+		cmyk = lcms2.transform_array(self.transform, rgb)
+		self.assertEqual((3, 5, 4), cmyk.shape)
+		self.assertEqual(numpy.uint8, cmyk.dtype)
+		ref = lcms2.COLORB()
+		lcms2.cmsDoTransform(self.transform, lcms2.COLORB(100, 190, 150), ref)
+		self.assertTrue((cmyk == ref[:4]).all())
+
+	def test41_transform_array_16b_and_dbl(self):
+		try:
+			import numpy
+		except ImportError:
+			return
+		rgb = numpy.zeros((10, 4), dtype=numpy.uint16)
+		rgb[:, :3] = 65535
+		cmyk = lcms2.transform_array(self.transform_16b, rgb)
+		self.assertEqual((10, 4), cmyk.shape)
+		self.assertTrue((cmyk < 10).all())
+		transform = lcms2.cmsCreateTransform(self.inProfile, lcms2.TYPE_RGBA_8,
+					lcms2.cmsCreateLabProfile(), lcms2.TYPE_Lab_DBL)
+		lab = lcms2.transform_array(transform, numpy.zeros((2, 4), numpy.uint8))
+		self.assertEqual(numpy.float64, lab.dtype)
+		self.assertEqual((2, 3), lab.shape)
+		self.assertTrue(abs(lab[0, 0]) < 0.01)
+
+	def test42_transform_array_strided(self):
+		try:
+			import numpy
+		except ImportError:
+			return
+		image = numpy.zeros((8, 8, 4), dtype=numpy.uint8)
+		image[2:5, 3:7, :3] = (100, 190, 150)
+		out = numpy.zeros((8, 8, 4), dtype=numpy.uint8)
+		ret = lcms2.transform_array(self.transform, image[2:5, 3:7],
+								out[1:4, 2:6])
+		self.assertEqual((3, 4, 4), ret.shape)
+		ref = lcms2.COLORB()
+		lcms2.cmsDoTransform(self.transform, lcms2.COLORB(100, 190, 150), ref)
+		self.assertTrue((out[1:4, 2:6] == ref[:4]).all())
+		self.assertEqual(0, out[0].sum() + out[4:].sum())
+		self.assertEqual(0, out[:, :2].sum() + out[:, 6:].sum())
+		flipped = lcms2.transform_array(self.transform, image[::-1])
+		self.assertTrue((flipped[3:6, 3:7] == ref[:4]).all())
+
+	def test43_transform_array_with_incorrect_arrays(self):
+		try:
+			import numpy
+		except ImportError:
+			return
+		self.assertRaises(lcms2.CmsError, lcms2.transform_array,
+				self.transform, numpy.zeros((4, 3), numpy.uint8))
+		self.assertRaises(lcms2.CmsError, lcms2.transform_array,
+				self.transform, numpy.zeros((4, 4), numpy.uint16))
+		self.assertRaises(lcms2.CmsError, lcms2.transform_array,
+				self.transform, numpy.zeros((4,), numpy.uint8))
+		self.assertRaises(lcms2.CmsError, lcms2.transform_array,
+				self.transform, numpy.zeros((4, 4), numpy.uint8),
+				numpy.zeros((5, 4), numpy.uint8))
+
 	#---Profile info related tests
 
+	def test44_gamut_check_array(self):
+		import numpy
+		transform = lcms2.cmsCreateGamutCheckTransform(self.inProfile,
+						lcms2.TYPE_RGB_8, self.outProfile)
+		arr = numpy.empty((2, 3, 3), dtype=numpy.uint8)
+		arr.fill(200)
+		arr[0, 0] = (0, 0, 255)
+		arr[1, 2] = (0, 255, 0)
+		arr[1, 1] = (128, 128, 128)
+		mask, count = lcms2.gamut_check_array(transform, arr[:, ::-1])
+		self.assertEqual(2, count)
+		self.assertEqual([[False, False, True], [True, False, False]],
+						mask.tolist())
+		self.assertRaises(lcms2.CmsError, lcms2.gamut_check_array,
+						transform, arr.astype(numpy.uint16))
+
+	def test45_delta_e(self):
+		import array, numpy
+		# CIEDE2000 pairs from Sharma, Wu and Dalal test data
+		lab1 = array.array('d', [50.0, 2.6772, -79.7751, 50.0, 0.0, 0.0,
+							60.2574, -34.0099, 36.2677])
+		lab2 = array.array('d', [50.0, 0.0, -82.7485, 50.0, -1.0, 2.0,
+							60.4626, -34.1751, 39.4387])
+		diff = lcms2.delta_e(lab1, lab2, lcms2.DELTA_E_CIEDE2000)
+		self.assertEqual(3, len(diff))
+		for value, ref in zip(diff, (2.0425, 2.3669, 1.2644)):
+			self.assertAlmostEqual(ref, value, 4)
+
+		diff = lcms2.delta_e(lab1, lab2)
+		self.assertAlmostEqual(5.0 ** 0.5, diff[1], 6)
+		for method in (lcms2.DELTA_E_CIE94, lcms2.DELTA_E_CMC,
+					lcms2.DELTA_E_BFD):
+			self.assertEqual(3, len(lcms2.delta_e(lab1, lab2, method)))
+
+		arr1 = numpy.zeros((2, 5, 3))
+		arr2 = numpy.zeros((2, 5, 3))
+		arr2[..., 0] = numpy.arange(10).reshape(2, 5)
+		diff, stats = lcms2.delta_e(arr1, arr2, stats=True,
+								percentiles=(0, 50, 90, 100))
+		self.assertEqual((2, 5), diff.shape)
+		self.assertEqual(9.0, diff[1, 4])
+		self.assertEqual(10, stats['count'])
+		self.assertAlmostEqual(4.5, stats['mean'])
+		self.assertEqual((0.0, 9.0), (stats['min'], stats['max']))
+		self.assertEqual({0: 0.0, 50: 4.5, 90: 8.1, 100: 9.0},
+				dict([(k, round(v, 6)) for k, v in stats['percentiles'].items()]))
+
+		self.assertRaises(lcms2.CmsError, lcms2.delta_e, lab1, lab2[:6])
+		self.assertRaises(lcms2.CmsError, lcms2.delta_e, lab1, lab2, 10)
+		self.assertRaises(lcms2.CmsError, lcms2.delta_e, lab1, lab2,
+						out=array.array('d', [0.0]))
+
+		# arrays are converted into doubles with provided output too
+		out = numpy.zeros(2)
+		lcms2.delta_e(numpy.zeros((2, 3), dtype=numpy.float32),
+					numpy.array([[0, 0, 0], [10, 0, 0]], dtype=numpy.float32),
+					out=out)
+		self.assertEqual([0.0, 10.0], list(out))
+		self.assertRaises(lcms2.CmsError, lcms2.delta_e, lab1, lab2,
+						out=numpy.zeros(3, dtype=numpy.float32))
+		self.assertRaises(lcms2.CmsError, lcms2.delta_e,
+						array.array('f', [0.0] * 9), lab2)
+
+	def test46_swatch_index(self):
+		import array, pickle, random
+		rnd = random.Random(5)
+		colors = [(rnd.uniform(0, 100), rnd.uniform(-80, 80),
+				rnd.uniform(-80, 80)) for i in range(500)]
+		queries = [(rnd.uniform(0, 100), rnd.uniform(-80, 80),
+				rnd.uniform(-80, 80)) for i in range(20)]
+		index = lcms2.swatchindex.SwatchIndex(colors)
+		self.assertEqual(500, len(index))
+		lab = array.array('d', [v for color in colors for v in color])
+		for method in (lcms2.DELTA_E_CIE76, lcms2.DELTA_E_CIEDE2000):
+			for query in queries:
+				diff = lcms2.delta_e(lab, array.array('d', query * 500), method)
+				ref = sorted(range(500), key=diff.__getitem__)
+				result = index.nearest(query, 3, method)
+				self.assertEqual(ref[:3], [i for i, value in result])
+				self.assertAlmostEqual(diff[ref[0]], result[0][1])
+				result = index.within(query, 12.0, method)
+				self.assertEqual([i for i in ref if diff[i] <= 12.0],
+								[i for i, value in result])
+		ids, diffs = index.nearest_many(queries, 2, lcms2.DELTA_E_CIEDE2000)
+		self.assertEqual(40, len(ids))
+		self.assertEqual(index.nearest(queries[7], 2, lcms2.DELTA_E_CIEDE2000),
+						zip(ids[14:16], diffs[14:16]))
+
+		copy = pickle.loads(pickle.dumps(index, 2))
+		self.assertEqual(index.within_many(queries, 15.0),
+						copy.within_many(queries, 15.0))
+		# batched radius queries match single queries, buffers are accepted
+		buff = array.array('d', [v for query in queries for v in query])
+		for method in (lcms2.DELTA_E_CIE76, lcms2.DELTA_E_CIEDE2000):
+			result = index.within_many(buff, 10.0, method)
+			self.assertEqual(20, len(result))
+			self.assertEqual([index.within(query, 10.0, method)
+							for query in queries], result)
+		self.assertEqual([], index.within_many([], 10.0))
+		self.assertRaises(lcms2.CmsError, index.within_many, queries, -1.0)
+
+		index = lcms2.swatchindex.SwatchIndex([(255, 0, 0), (0, 0, 255)],
+							lcms2.TYPE_RGB_8, self.inProfile, ['red', 'blue'])
+		[(i, value)] = index.nearest((30.0, 60.0, -90.0))
+		self.assertEqual('blue', index.names[i])
+		self.assertEqual(2, len(index.nearest((30.0, 60.0, -90.0), 5)))
+		self.assertRaises(lcms2.CmsError, lcms2.swatchindex.SwatchIndex,
+						[(255, 0, 0)], lcms2.TYPE_RGB_8)
+
+	def test47_profile_catalog(self):
+		directory = tempfile.mkdtemp()
+		try:
+			profiles = os.path.join(directory, 'profiles')
+			os.makedirs(os.path.join(profiles, 'printer'))
+			shutil.copy(get_filepath('sRGB.icm'), profiles)
+			shutil.copy(get_filepath('empty.icm'), profiles)
+			shutil.copy(get_filepath('CMYK.icm'),
+					os.path.join(profiles, 'printer', 'press.ICC'))
+			index_path = os.path.join(directory, 'index.json')
+
+			catalog = lcms2.catalog.ProfileCatalog(index_path, threads=2)
+			entries = catalog.scan([profiles])
+			self.assertEqual((2, 0), (catalog.parsed, catalog.reused))
+			self.assertEqual(['CMYK', 'RGB'], [e.color_space for e in entries])
+			[entry] = catalog.find(device_class='prtr')
+			self.assertEqual('Lab', entry.pcs)
+			self.assertEqual('2.2', entry.version)
+			self.assertEqual(u'Fogra27L CMYK Coated Press', entry.description)
+			self.assertEqual(lcms2.cmsGetProfileName(entry.open()),
+							entry.description)
+			self.assertEqual(1, len(catalog.find(description='iec61966')))
+
+			catalog = lcms2.catalog.ProfileCatalog(index_path)
+			self.assertEqual(2, len(catalog))
+			path = os.path.join(profiles, 'sRGB.icm')
+			os.utime(path, (0, 0))
+			catalog.scan([profiles], recursive=False)
+			self.assertEqual((1, 0), (catalog.parsed, catalog.reused))
+			self.assertEqual(['RGB'], [e.color_space for e in catalog])
+			self.assertEqual(u'sRGB IEC61966-2.1',
+						lcms2.cmsGetProfileName(catalog.open_profile(path)))
+			self.assertRaises(lcms2.CmsError, catalog.open_profile, profiles)
+
+			# malformed mluc description doesn't break the scan
+			import struct
+			header = bytearray(132)
+			header[36:40] = 'acsp'
+			header[128:132] = struct.pack('>I', 1)
+			tag = 'desc' + struct.pack('>II', 144, 16)
+			data = 'mluc\0\0\0\0' + struct.pack('>II', 0xFFFFFFF0, 0)
+			with open(os.path.join(profiles, 'broken.icc'), 'wb') as fileobj:
+				fileobj.write(str(header) + tag + data)
+			catalog.scan([profiles])
+			self.assertEqual(3, len(catalog))
+			self.assertEqual(u'', [e for e in catalog
+								if e.path.endswith('broken.icc')][0].description)
+		finally:
+			shutil.rmtree(directory)
+
+	def test48_multiprofile_transform(self):
+		lab_profile = lcms2.cmsCreateLabProfile()
+		chain = lcms2.cmsCreateMultiprofileTransform(
+						[self.inProfile, lab_profile, self.outProfile],
+						lcms2.TYPE_RGB_8, lcms2.TYPE_CMYK_8,
+						[lcms2.INTENT_RELATIVE_COLORIMETRIC,
+						lcms2.INTENT_PERCEPTUAL], 0, bpc=(True, False))
+		to_lab = lcms2.cmsCreateTransform(self.inProfile, lcms2.TYPE_RGB_8,
+						lab_profile, lcms2.TYPE_Lab_DBL,
+						lcms2.INTENT_RELATIVE_COLORIMETRIC,
+						lcms2.cmsFLAGS_BLACKPOINTCOMPENSATION)
+		to_cmyk = lcms2.cmsCreateTransform(lab_profile, lcms2.TYPE_Lab_DBL,
+						self.outProfile, lcms2.TYPE_CMYK_8,
+						lcms2.INTENT_PERCEPTUAL, 0)
+		for rgb in ((255, 0, 0), (10, 200, 90), (128, 128, 128)):
+			expected = to_cmyk.apply(*to_lab.apply(*rgb))
+			for value, ref in zip(chain.apply(*rgb), expected):
+				self.assertTrue(abs(value - ref) <= 2)
+
+		self.assertTrue(chain is lcms2.cmsCreateMultiprofileTransform(
+						[self.inProfile, lab_profile, self.outProfile],
+						lcms2.TYPE_RGB_8, lcms2.TYPE_CMYK_8, [1, 0], 0,
+						bpc=[1, 0]))
+		self.assertRaises(lcms2.CmsError, lcms2.cmsCreateMultiprofileTransform,
+						[self.inProfile], lcms2.TYPE_RGB_8, lcms2.TYPE_RGB_8)
+		self.assertRaises(lcms2.CmsError, lcms2.cmsCreateMultiprofileTransform,
+						[self.inProfile, self.outProfile], lcms2.TYPE_RGB_8,
+						lcms2.TYPE_CMYK_8, [0, 1])
+		self.assertRaises(lcms2.CmsError, lcms2.cmsCreateMultiprofileTransform,
+						[self.inProfile, self.outProfile], lcms2.TYPE_RGB_8,
+						lcms2.TYPE_RGB_8)
+
+	def test49_adaptive_transform(self):
+		transform = lcms2.cmsCreateAdaptiveTransform(self.inProfile,
+						lcms2.TYPE_RGB_8, self.outProfile, lcms2.TYPE_CMYK_8,
+						levels=[(0, lcms2.cmsFLAGS_NOTPRECALC),
+						(100, lcms2.cmsFLAGS_GRIDPOINTS(17)),
+						(1000, lcms2.cmsFLAGS_HIGHRESPRECALC)])
+		info = lcms2.get_precalc_info(transform)
+		self.assertEqual((True, 'none', 0, 0),
+				(info['adaptive'], info['precalc'], info['level'], info['pixels']))
+		reference = transform.apply(10, 200, 90)
+
+		for i in range(99):
+			transform.apply(10, 200, 90)
+		info = lcms2.get_precalc_info(transform)
+		self.assertEqual(('default', 17, 1, 1), (info['precalc'],
+				info['grid_points'], info['level'], info['upgrades']))
+		for value, ref in zip(transform.apply(10, 200, 90), reference):
+			self.assertTrue(abs(value - ref) <= 2)
+
+		inbuff = bytearray(3000)
+		outbuff = bytearray(4000)
+		lcms2.cmsDoTransformBuffer(transform, inbuff, outbuff, 1000)
+		info = lcms2.get_precalc_info(transform)
+		self.assertEqual(('highres', 2, 1101), (info['precalc'],
+						info['upgrades'], info['pixels']))
+		# rejected calls are not counted
+		self.assertRaises(lcms2.CmsError, lcms2.cmsDoTransformBuffer,
+						transform, bytearray(3), bytearray(24), 10 ** 9)
+		self.assertEqual(1101, lcms2.get_precalc_info(transform)['pixels'])
+		transform = lcms2.cmsCreateAdaptiveTransform(self.inProfile,
+						lcms2.TYPE_RGB_8, self.outProfile, lcms2.TYPE_CMYK_8)
+		self.assertRaises(lcms2.CmsError, lcms2.cmsDoTransformBuffer,
+						transform, bytearray(3), bytearray(24), 10 ** 9)
+		info = lcms2.get_precalc_info(transform)
+		self.assertEqual((0, 0, 0), (info['level'], info['upgrades'],
+						info['pixels']))
+
+		transform = lcms2.cmsCreateAdaptiveTransform(self.inProfile,
+						lcms2.TYPE_RGB_8, self.outProfile, lcms2.TYPE_CMYK_8,
+						expected_pixels=1 << 30)
+		self.assertEqual('highres',
+						lcms2.get_precalc_info(transform)['precalc'])
+		info = lcms2.get_precalc_info(self.transform)
+		self.assertEqual((False, 'none'), (info['adaptive'], info['precalc']))
+		self.assertRaises(lcms2.CmsError, lcms2.cmsCreateAdaptiveTransform,
+						self.inProfile, lcms2.TYPE_RGB_8, self.outProfile,
+						lcms2.TYPE_CMYK_8, levels=[(10, 0)])
+
+		transform = lcms2.cmsCreateAdaptiveTransform(self.inProfile,
+						lcms2.TYPE_RGB_8, self.outProfile, lcms2.TYPE_CMYK_8,
+						levels=[(0, lcms2.cmsFLAGS_NOTPRECALC),
+						(100, lcms2.cmsFLAGS_GRIDPOINTS(17))])
+		lcms2.enable_color_cache(transform, 16)
+		for i in range(99):
+			transform.apply(10, 200, 90)
+		self.assertEqual((1, 98), tuple([lcms2.get_color_cache_stats(
+						transform)[name] for name in ('misses', 'hits')]))
+		transform.apply(10, 200, 90)
+		self.assertEqual(1, lcms2.get_precalc_info(transform)['level'])
+		stats = lcms2.get_color_cache_stats(transform)
+		self.assertEqual((1, 2, 98),
+						(stats['size'], stats['misses'], stats['hits']))
+
+	def test50_sample_lut(self):
+		import numpy
+		transform = lcms2.cmsCreateTransform(self.inProfile,
+						lcms2.TYPE_RGB_8, self.outProfile, lcms2.TYPE_CMYK_8,
+						lcms2.INTENT_PERCEPTUAL, 0)
+		lut = lcms2.lut.sample_lut(transform, 18)
+		self.assertEqual((18, 18, 18, 4), lut.table.shape)
+		self.assertEqual(numpy.uint16, lut.table.dtype)
+
+		# grid nodes are exact for 8-bit input of 18 grid points
+		nodes = numpy.array([[0, 15, 255], [30, 120, 45]], dtype=numpy.uint8)
+		expected = lcms2.transform_array(transform, nodes)
+		for method in (lcms2.lut.TETRAHEDRAL, lcms2.lut.TRILINEAR):
+			self.assertTrue((lut.apply(nodes, method=method) == expected).all())
+
+		pixels = numpy.random.RandomState(1).randint(0, 256, (1000, 3))
+		pixels = pixels.astype(numpy.uint8)
+		expected = lcms2.transform_array(transform, pixels).astype(int)
+		result = lut.apply(pixels.tostring())
+		self.assertEqual((1000, 4), result.shape)
+		error = abs(result.astype(int) - expected)
+		self.assertTrue(error.mean() < 1.0 and error.max() <= 16)
+
+		transform = lcms2.cmsCreateTransform(self.inProfile,
+						lcms2.TYPE_BGR_8, self.inProfile, lcms2.TYPE_RGB_DBL,
+						lcms2.INTENT_PERCEPTUAL, 0)
+		lut = lcms2.lut.sample_lut(transform, 5)
+		self.assertEqual(numpy.float32, lut.table.dtype)
+		self.assertTrue(abs(lut.table[4, 0, 0] - (1.0, 0.0, 0.0)).max() < 1e-3)
+		result = lut.apply(numpy.array([[0, 64, 255]], dtype=numpy.uint8))
+		self.assertTrue(abs(result[0] - (1.0, 0.25, 0.0)).max() < 2e-3)
+
+		stream = StringIO.StringIO()
+		lut.save_cube(stream, 'identity')
+		lines = stream.getvalue().splitlines()
+		self.assertEqual(['TITLE "identity"', 'LUT_3D_SIZE 5'], lines[:2])
+		self.assertEqual(4 + 125, len(lines))
+
+		loaded = lcms2.lut.load_lut(bytearray(lut.tobytes()))
+		self.assertEqual(lut.domain, loaded.domain)
+		self.assertEqual(lut.in_format, loaded.in_format)
+		self.assertTrue((lut.table == loaded.table).all())
+		self.assertRaises(lcms2.CmsError, lcms2.lut.load_lut, bytearray(32))
+		lut = pickle.loads(pickle.dumps(lut, 2))
+		self.assertTrue((lut.table == loaded.table).all())
+
+	def test51_apply_to_image(self):
+		from PIL import Image
+		im = Image.new('RGB', (7, 5), (10, 200, 90))
+		im.putpixel((3, 2), (255, 0, 0))
+		cmyk = lcms2.apply_to_image(self.transform, im)
+		self.assertEqual(('CMYK', (7, 5)), (cmyk.mode, cmyk.size))
+		self.assertEqual(tuple(self.transform.apply(10, 200, 90)),
+						cmyk.getpixel((0, 0)))
+		self.assertEqual(tuple(self.transform.apply(255, 0, 0)),
+						cmyk.getpixel((3, 2)))
+
+		# packed RGB transform is applied to 4-byte PIL pixels
+		transform = lcms2.cmsCreateTransform(self.inProfile,
+						lcms2.TYPE_RGB_8, self.outProfile, lcms2.TYPE_CMYK_8,
+						lcms2.INTENT_PERCEPTUAL, lcms2.cmsFLAGS_NOTPRECALC)
+		self.assertEqual(cmyk.tobytes(),
+						lcms2.apply_to_image(transform, im).tobytes())
+
+		rgba = Image.new('RGBA', (4, 3), (10, 200, 90, 77))
+		transform = lcms2.cmsCreateTransform(self.outProfile,
+						lcms2.TYPE_CMYK_8, self.inProfile, lcms2.TYPE_RGB_8,
+						lcms2.INTENT_PERCEPTUAL, 0)
+		back = lcms2.apply_to_image(transform, cmyk, outMode='RGBA')
+		self.assertEqual('RGBA', back.mode)
+		proof = lcms2.cmsCreateTransform(self.inProfile, lcms2.TYPE_RGB_8,
+						self.inProfile, lcms2.TYPE_RGB_8,
+						lcms2.INTENT_PERCEPTUAL, 0)
+		copy = lcms2.apply_to_image(proof, rgba, inplace=False)
+		self.assertFalse(copy is rgba)
+		self.assertTrue(lcms2.apply_to_image(proof, rgba) is rgba)
+		self.assertEqual(77, rgba.getpixel((3, 2))[3])
+		self.assertEqual(copy.tobytes(), rgba.tobytes())
+
+		self.assertRaises(lcms2.CmsError, lcms2.apply_to_image,
+						self.transform, Image.new('L', (2, 2)))
+		self.assertRaises(lcms2.CmsError, lcms2.apply_to_image,
+						self.transform, im, outMode='RGB')
+
+		# native call checks image cores itself
+		native = lcms2._lcms2.transformImage
+		self.assertEqual(None, native(self.transform, 8, 8, 1, 1, 4, 4))
+		self.assertEqual(None, native(self.transform, im.im, cmyk.im,
+						8, 5, 4, 4))
+		self.assertEqual(None, native(self.transform, im.im, cmyk.im,
+						7, 6, 4, 4))
+		self.assertEqual(None, native(self.transform, im.im, cmyk.im,
+						7, 5, 8, 4))
+		self.assertEqual(None, native(self.transform, im.im,
+						Image.new('CMYK', (7, 4)).im, 7, 5, 4, 4))
+		self.assertEqual(5, native(self.transform, im.im, cmyk.im,
+						7, 5, 4, 4))
+
+	def test52_copy_alpha(self):
+		transform = lcms2.cmsCreateTransform(self.inProfile,
+						lcms2.TYPE_RGBA_8, self.inProfile, lcms2.TYPE_RGBA_16,
+						lcms2.INTENT_PERCEPTUAL, lcms2.cmsFLAGS_COPY_ALPHA)
+		self.assertEqual(77 * 257, transform.apply(10, 200, 90, 77)[3])
+		inbuff = bytearray([10, 200, 90, 77, 0, 0, 0, 255])
+		outbuff = bytearray(16)
+		lcms2.cmsDoTransformBuffer(transform, inbuff, outbuff, 2)
+		self.assertEqual((77 * 257, 65535), (outbuff[6] + 256 * outbuff[7],
+						outbuff[14] + 256 * outbuff[15]))
+
+		transform = lcms2.cmsCreateTransform(self.outProfile,
+						lcms2.TYPE_CMYKA_8, self.inProfile, lcms2.TYPE_RGBA_FLT,
+						lcms2.INTENT_PERCEPTUAL, lcms2.cmsFLAGS_COPY_ALPHA)
+		self.assertAlmostEqual(0.2, transform.apply(0, 0, 0, 0, 51)[3], 5)
+		gray = lcms2.cmsCreateGrayProfile()
+		transform = lcms2.cmsCreateTransform(gray, lcms2.TYPE_GRAYA_8,
+						gray, lcms2.TYPE_GRAYA_16, lcms2.INTENT_PERCEPTUAL,
+						lcms2.cmsFLAGS_COPY_ALPHA)
+		self.assertEqual(128 * 257, transform.apply(0, 128)[1])
+
+		# alpha is not copied without the flag
+		transform = lcms2.cmsCreateTransform(self.inProfile,
+						lcms2.TYPE_RGBA_8, self.inProfile, lcms2.TYPE_RGBA_16,
+						lcms2.INTENT_PERCEPTUAL, 0)
+		self.assertEqual(0, transform.apply(10, 200, 90, 77)[3])
+		self.assertRaises(lcms2.CmsError, lcms2.cmsCreateTransform,
+						self.inProfile, lcms2.TYPE_RGBA_8, self.outProfile,
+						lcms2.TYPE_CMYK_8, lcms2.INTENT_PERCEPTUAL,
+						lcms2.cmsFLAGS_COPY_ALPHA)
+
+	def test53_fanout_transform(self):
+		inbuff = bytearray(range(256) * 30)[:7500]
+		targets = [(self.outProfile, lcms2.TYPE_CMYK_8),
+				(self.outProfile, lcms2.TYPE_CMYK_16, 1),
+				(lcms2.cmsCreateLabProfile(), lcms2.TYPE_Lab_DBL)]
+		outbuffs, counts = lcms2.fanout_transform(self.inProfile,
+						lcms2.TYPE_RGB_8, targets, inbuff, 2500, tile_pixels=1000)
+		self.assertEqual(None, counts)
+		self.assertEqual([10000, 20000, 60000], [len(item) for item in outbuffs])
+		for target, outbuff in zip(targets, outbuffs):
+			expected = bytearray(len(outbuff))
+			transform = lcms2.cmsCreateTransform(self.inProfile,
+						lcms2.TYPE_RGB_8, target[0], target[1],
+						target[2] if len(target) == 3 else 0,
+						lcms2.cmsFLAGS_NOTPRECALC)
+			lcms2.cmsDoTransformBuffer(transform, inbuff, expected, 2500)
+			self.assertEqual(expected, outbuff)
+
+		outbuffs, counts = lcms2.fanout_transform(self.inProfile,
+						lcms2.TYPE_RGB_8, targets[:2], inbuff, 2500,
+						gamut_check=True)
+		gamut = lcms2.cmsCreateGamutCheckTransform(self.inProfile,
+						lcms2.TYPE_RGB_8, self.outProfile,
+						lcms2.INTENT_PERCEPTUAL)
+		self.assertEqual(lcms2.gamut_check(gamut, inbuff, 2500)[1], counts[0])
+		self.assertTrue(counts[0] > 0)
+
+		self.assertRaises(lcms2.CmsError, lcms2.fanout_transform,
+						self.inProfile, lcms2.TYPE_RGB_8, targets, inbuff, 2501)
+		self.assertRaises(lcms2.CmsError, lcms2.fanout_transform,
+						self.inProfile, lcms2.TYPE_RGB_8, targets, inbuff, 10,
+						outbuffs=[bytearray(40)])
+		self.assertRaises(lcms2.CmsError, lcms2.fanout_transform,
+						self.inProfile, lcms2.TYPE_RGB_8, [], inbuff, 10)
+
+		# pixels of each target and gamut check are accounted
+		lcms2.enable_stats()
+		lcms2.reset_stats()
+		try:
+			lcms2.fanout_transform(self.inProfile, lcms2.TYPE_RGB_8,
+						targets[:2], inbuff, 2500, gamut_check=True)
+			stats = lcms2.get_stats()
+			self.assertEqual((1, 10000), (stats['transform_calls'],
+						stats['pixels']))
+			self.assertEqual({lcms2.TYPE_RGB_8: 10000},
+						stats['pixels_by_format'])
+		finally:
+			lcms2.enable_stats(False)
+
 	def test30_get_profile_name(self):
 		name = lcms2.cmsGetProfileName(self.outProfile)
 		self.assertEqual(name, 'Fogra27L CMYK Coated Press')